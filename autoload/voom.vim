@@ -82,6 +82,8 @@ if !exists('s:voom_did_init')
     "   'mmode' : markup mode,
     "   'tick' : b:changedtick of Body on Body BufLeave,
     "   'tick_' : b:changedtick of Body on last Tree update 
+    "   'lid' : Body listener id, see voom#BodyListener(), if any,
+    "   'dirty' : Body lines changed since last Tree update, see voom#BodyListener()
     "         }, {...}, ... }
     let s:voom_bodies = {}
 
@@ -135,6 +137,53 @@ if !exists('g:voom_verify_oop')
     let g:voom_verify_oop = 1
 endif
 
+" Update outline by reparsing only changed Body lines when markup mode allows it.
+" Requires Vim with listener_add().
+if !exists('g:voom_incremental_update')
+    let g:voom_incremental_update = 1
+endif
+
+" Search Body with Python regexps for :Voomgrep when patterns can be translated.
+if !exists('g:voom_python_grep')
+    let g:voom_python_grep = 1
+endif
+
+" Search joined Body lines with one regexp to construct outline in markup modes
+" that allow it. Faster when headlines are sparse, slower when they are dense.
+if !exists('g:voom_scan_outline')
+    let g:voom_scan_outline = 0
+endif
+
+" Construct outline in background when entering Tree if Body has at least this
+" many lines and all of it must be parsed. 0 disables. Requires +timers.
+if !exists('g:voom_async_lines')
+    let g:voom_async_lines = 0
+endif
+
+" Directory for outline cache files. Outline of a Body that is unmodified file
+" is loaded from cache when the outline is created. Empty string disables.
+if !exists('g:voom_cache_dir')
+    let g:voom_cache_dir = ''
+endif
+
+" Construct outline with several processes when all of Body must be parsed and
+" it has at least this many lines. 0 disables. Not all modes. Requires fork().
+if !exists('g:voom_parallel_lines')
+    let g:voom_parallel_lines = 0
+endif
+
+" Number of processes for g:voom_parallel_lines. 0 is the number of CPUs.
+if !exists('g:voom_parallel_workers')
+    let g:voom_parallel_workers = 0
+endif
+
+" Copy and Cut do not write nodes to the clipboard register: Paste gets them
+" from VOoM clipboard while the register is unchanged. The register is written
+" when Vim loses focus or by voom#ClipboardMirror(). Requires sha256().
+if !exists('g:voom_clipboard_lazy')
+    let g:voom_clipboard_lazy = 0
+endif
+
 " Which key to map to Select-Node-and-Shuttle-between-Body/Tree
 if !exists('g:voom_return_key')
     let g:voom_return_key = '<Return>'
@@ -176,6 +225,11 @@ com! Voomquit call voom#DeleteOutline()
 com! VoomQuitAll call voom#DeleteOutlines()
 com! -nargs=? Voominfo call voom#Voominfo(<q-args>)
 
+augroup VoomClipboard
+    au!
+    au FocusLost * call voom#ClipboardMirror()
+augroup END
+
 """ development helpers
 if exists('g:voom_create_devel_commands')
     " reload autoload/voom.vim (outlines are preserved)
@@ -433,6 +487,12 @@ func! voom#UnVoom(body,tree) "{{{2
 " Can be called from any buffer.
 " Note: when called from Tree BufUnload au, tree doesn't exist.
     if has_key(s:voom_bodies, a:body) && has_key(s:voom_trees, a:tree)
+        if has_key(s:voom_bodies[a:body], 'lid')
+            call listener_remove(s:voom_bodies[a:body].lid)
+        endif
+        if has_key(s:voom_bodies[a:body], 'timer')
+            call timer_stop(s:voom_bodies[a:body].timer)
+        endif
         unlet s:voom_bodies[a:body]
         unlet s:voom_trees[a:tree]
     else
@@ -607,6 +667,32 @@ func! voom#Voominfo(qargs) "{{{2
 endfunc
 
 
+func! voom#Profile(qargs) "{{{2
+" :Voomprofile start|stop|report [file]
+" Profile Python code of VOoM commands with cProfile, report stats in PyLog
+" buffer (or as messages) or write them to file.
+    let l:action = matchstr(a:qargs, '^\s*\zs\S\+')
+    let l:fname = matchstr(a:qargs, '^\s*\S\+\s\+\zs.\{-}\ze\s*$')
+    if index(['start', 'stop', 'report'], l:action) < 0
+        call voom#ErrorMsg('VOoM: unknown :Voomprofile argument: "'.l:action.'"')
+        return
+    elseif l:fname!=#'' && l:action!=#'report'
+        call voom#ErrorMsg('VOoM: file name is allowed only with :Voomprofile report')
+        return
+    endif
+    if l:fname!=#''
+        let l:fname = fnamemodify(expand(l:fname), ':p')
+    endif
+    exe s:PYCMD "_VOoM2657.voom_Profile()"
+endfunc
+
+
+func! voom#ProfileComplete(A,L,P) "{{{2
+" Argument completion for command :Voomprofile.
+    return "start\nstop\nreport"
+endfunc
+
+
 func! voom#ReloadAllPre() "{{{2
 " Helper for reloading the entire plugin and all modes.
 " Wipe out all Tree buffers and PyLog buffer. Delete Python voom modules.
@@ -669,6 +755,23 @@ func! voom#GetModeBodyTree(bnr) "{{{2
 endfunc
 
 
+func! voom#Stats(...) "{{{2
+" Return Dict with run time counters and sizes of outline of Body a:1, or of
+" the current Tree or Body. Return {} if there is no outline.
+    let bnr = a:0 ? a:1 : bufnr('')
+    if has_key(s:voom_trees, bnr)
+        let bnr = s:voom_trees[bnr]
+    endif
+    if !has_key(s:voom_bodies, bnr)
+        return {}
+    endif
+    let l:body = bnr
+    let l:stats = {}
+    exe s:PYCMD "_VOoM2657.voom_Stats()"
+    return l:stats
+endfunc
+
+
 "---Windows Navigation and Creation-----------{{{1
 " These deal only with the current tab page.
 
@@ -896,6 +999,7 @@ func! voom#TreeCreate(body, blnr) "{{{2
                 keepj call setline(1, ' '.getline(1)[1 : ])
             endif
             let s:voom_bodies[a:body].tick_ = s:voom_bodies[a:body].tick
+            call voom#BodyDirtyReset(a:body)
         endif
     finally
         let &l:ul = ul_
@@ -954,6 +1058,8 @@ func! voom#TreeConfig() "{{{2
         au BufUnload <buffer> nested call voom#TreeBufUnload()
     augroup END
     call voom#TreeMap()
+    " fold levels of Tree lines, set by Python code, see voom#TreeConfigWin()
+    let b:voom_fdl = []
     call voom#TreeConfigWin()
     " local to buffer, may be changed by the user
     setl bufhidden=wipe
@@ -968,7 +1074,8 @@ func! voom#TreeConfigWin() "{{{2
     setl foldenable
     setl foldtext=getline(v:foldstart).'\ \ \ /'.(v:foldend-v:foldstart)
     setl foldmethod=expr
-    setl foldexpr=voom#TreeFoldexpr(v:lnum)
+    " b:voom_fdl is valid if its length is the number of Tree lines
+    setl foldexpr=len(b:voom_fdl)==line('$')?b:voom_fdl[v:lnum-1]:voom#TreeFoldexpr(v:lnum)
     setl cul nocuc nowrap nolist
     "setl winfixheight
     setl winfixwidth
@@ -1034,10 +1141,15 @@ func! voom#TreeBufEnter() "{{{2
     setl ma
     let ul_ = &l:ul | setl ul=-1
     try
-        let l:ok = 0
+        let [l:ok, l:parsing] = [0, 0]
         exe "keepj" s:PYCMD "_VOoM2657.updateTree(int(vim.eval('l:body')), int(vim.eval('l:tree')))"
-        if l:ok
+        if l:parsing
+            call voom#TreeParsing(body, tree)
+        elseif l:ok
             let s:voom_bodies[body].tick_ = s:voom_bodies[body].tick
+            call voom#BodyDirtyReset(body)
+        else
+            let s:voom_bodies[body].dirty = [-1]
         endif
     finally
         let &l:ul = ul_
@@ -1052,6 +1164,70 @@ func! voom#TreeBufEnter() "{{{2
 endfunc
 
 
+func! voom#TreeParsing(body, tree) "{{{2
+" Outline of Body is being constructed in background, see updateTree().
+" Show status line in Tree windows. Poll for the result with a timer.
+    let d = s:voom_bodies[a:body]
+    if !has_key(d, 'timer')
+        let d.timer = timer_start(100, function('voom#TreeParsePoll', [a:body]), {'repeat': -1})
+    endif
+    for w in win_findbuf(a:tree)
+        if type(getwinvar(w, 'voom_stl', 0))==type(0)
+            call setwinvar(w, 'voom_stl', getwinvar(w, '&stl'))
+        endif
+        call setwinvar(w, '&stl', 'VOoM: parsing... %<%f')
+    endfor
+endfunc
+
+
+func! voom#TreeParsePoll(body, timer) "{{{2
+" Timer callback, see voom#TreeParsing(). Draw outline constructed in
+" background when it is ready. Can be called from any buffer.
+    if !has_key(s:voom_bodies, a:body)
+        call timer_stop(a:timer)
+        return
+    endif
+    let d = s:voom_bodies[a:body]
+    let tree = d.tree
+    let snLn_ = d.snLn
+    let [l:status, l:tick] = ['none', 0]
+    if bufloaded(a:body) && bufloaded(tree)
+        call setbufvar(tree, '&ma', 1)
+        let ul_ = &l:ul
+        call setbufvar(tree, '&ul', -1)
+        try
+            let l:status = 'error'
+            exe "keepj" s:PYCMD "_VOoM2657.voom_ParsePoll()"
+        finally
+            call setbufvar(tree, '&ul', ul_)
+            call setbufvar(tree, '&ma', 0)
+        endtry
+        if l:status==#'running' | return | endif
+    endif
+    call timer_stop(a:timer)
+    unlet d.timer
+    for w in win_findbuf(tree)
+        if type(getwinvar(w, 'voom_stl', 0))==type('')
+            call setwinvar(w, '&stl', getwinvar(w, 'voom_stl'))
+            call setwinvar(w, 'voom_stl', 0)
+        endif
+    endfor
+    if l:status==#'done'
+        let d.tick_ = l:tick
+        call voom#BodyDirtyReset(a:body)
+        if bufnr('')==tree && snLn_ != d.snLn
+            exe 'keepj normal!' d.snLn.'Gzv'
+        endif
+    elseif l:status==#'stale'
+        " Body was changed while parsing. Start again if Tree is current.
+        if bufnr('')==tree | call voom#TreeBufEnter() | endif
+    elseif l:status==#'error'
+        let d.dirty = [-1]
+        call voom#ErrorMsg('VOoM: Cannot update outline. Python function hook_makeOutline() failed. Enable :Voomlog to see Python traceback.')
+    endif
+endfunc
+
+
 func! voom#TreeBufUnload() "{{{2
 " Tree BufUnload au. Wipe out Tree and cleanup.
     let tree = expand("<abuf>")
@@ -1073,6 +1249,7 @@ endfunc
 
 
 func! voom#TreeFoldexpr(lnum) "{{{2
+" Fold level of Tree line lnum. Used when b:voom_fdl is not valid.
     let ind = stridx(getline(a:lnum),'|') / 2
     let indn = stridx(getline(a:lnum+1),'|') / 2
     return indn>ind ? '>'.ind : ind-1
@@ -1081,6 +1258,23 @@ func! voom#TreeFoldexpr(lnum) "{{{2
 endfunc
 
 
+func! voom#TreeFdl(tree, z, i1, i2, fdl) "{{{2
+" Replace items i1 to i2-1 of b:voom_fdl of Tree buffer tree with list fdl.
+" Python code does this before changing Tree lines. If b:voom_fdl does not
+" have expected length z, empty it: voom#TreeFoldexpr() will be used until the
+" next outline update.
+    let l = getbufvar(a:tree, 'voom_fdl')
+    if type(l)==type([]) && len(l)==a:z
+        if a:i2 > a:i1
+            call remove(l, a:i1, a:i2-1)
+        endif
+        call extend(l, a:fdl, a:i1)
+    else
+        call setbufvar(a:tree, 'voom_fdl', [])
+    endif
+endfunc
+
+
 func! voom#TreeMap() "{{{2=
 " Tree buffer local mappings and commands.
     let cpo_ = &cpo | set cpo&vim
@@ -1791,6 +1985,9 @@ func! voom#OopInsert(as_child) "{{{3
         exe "keepj" s:PYCMD "_VOoM2657.voom_OopInsert(as_child=False)"
     endif
     setl noma
+    " New headline is in Tree but not in outline data: next outline update
+    " must be full, it can't use Body changes.
+    let s:voom_bodies[body].dirty = [-1]
 
     let snLn = s:voom_bodies[body].snLn
     exe "keepj normal! ".snLn."G0f|"
@@ -1846,6 +2043,15 @@ func! voom#OopPaste() "{{{3
 endfunc
 
 
+func! voom#ClipboardMirror() "{{{3
+" Write nodes of the last Copy or Cut to the clipboard register if they were
+" not written because of g:voom_clipboard_lazy. Called on FocusLost.
+    if g:voom_clipboard_lazy
+        exe s:PYCMD "_VOoM2657.voom_ClipboardMirror()"
+    endif
+endfunc
+
+
 func! voom#OopMark(op, mode) "{{{3
 " Mark or unmark current node or all nodes in selection
     " Checks and init vars. {{{
@@ -2252,6 +2458,7 @@ func! voom#OopFromBody(body,tree,blnShow) "{{{3
     let s:voom_bodies[a:body].tick = b:changedtick
     if getbufvar(a:tree,'&ma')
         let s:voom_bodies[a:body].tick_ = b:changedtick
+        call voom#BodyDirtyReset(a:body)
     endif
     " show line at blnShow
     if a:blnShow > 0
@@ -2273,6 +2480,7 @@ func! voom#OopFromBody(body,tree,blnShow) "{{{3
     if &ma
         if s:voom_bodies[a:body].tick != b_tick
             let s:voom_bodies[a:body].tick_ = s:voom_bodies[a:body].tick
+            call voom#BodyDirtyReset(a:body)
             let s:verify = 1
         endif
     elseif s:voom_bodies[a:body].tick_ != s:voom_bodies[a:body].tick
@@ -2337,6 +2545,7 @@ func! voom#OopVerify(body, tree, op) "{{{3
     if l:ok | return | endif
     call voom#ErrorMsg('VOoM: outline verification failed after "'.a:op.'". Forcing outline update...')
     let s:voom_bodies[a:body].tick_ = -1
+    let s:voom_bodies[a:body].dirty = [-1]
     if bufnr('')!=a:tree || voom#BufNotTree(a:tree)
         echoerr 'VOoM: INTERNAL ERROR. Outline update aborted.'
         return
@@ -2378,6 +2587,12 @@ func! voom#BodyConfig() "{{{2
     augroup END
     " will be also set on BufLeave
     let s:voom_bodies[bufnr('')].tick = b:changedtick
+    " track changed Body lines for incremental outline update
+    let d = s:voom_bodies[bufnr('')]
+    if g:voom_incremental_update && exists('*listener_add') && !has_key(d, 'lid')
+        let d.lid = listener_add('voom#BodyListener')
+    endif
+    let d.dirty = [-1]
     call voom#BodyMap()
     unlet! w:voom_tree
 endfunc
@@ -2469,13 +2684,22 @@ func! voom#BodyCheckTicks(body) "{{{2
         echoerr 'VOoM: wrong buffer'
         return -1
     endif
-    " Wrong ticks, probably after :bun or :bd. Force outline update.
     if s:voom_bodies[a:body].tick_!=b:changedtick
+        " Outline is being constructed in background, see voom#TreeParsing().
+        " This is not an error: update outline now, don't wait for it.
+        if has_key(s:voom_bodies[a:body], 'timer')
+            call voom#BodyUpdateTree()
+            if s:voom_bodies[a:body].tick_==b:changedtick | return | endif
+            call voom#WarningMsg('VOoM: outline is being updated, try again when it is done')
+            return -1
+        endif
+        " Wrong ticks, probably after :bun or :bd. Force outline update.
         let tree = s:voom_bodies[a:body].tree
         if !exists("s:voom_trees") || !has_key(s:voom_trees, tree)
             echoerr "VOoM: INTERNAL ERROR"
             return -1
         endif
+        let s:voom_bodies[a:body].dirty = [-1]
         call voom#BodyUpdateTree()
         call voom#ErrorMsg('VOoM: wrong ticks for Body buffer '.a:body.'. Outline has been updated.')
         return -1
@@ -2509,6 +2733,9 @@ func! voom#BodyUpdateTree() "{{{2
         if l:ok
             let s:voom_bodies[body].tick_ = b:changedtick
             let s:voom_bodies[body].tick  = b:changedtick
+            call voom#BodyDirtyReset(body)
+        else
+            let s:voom_bodies[body].dirty = [-1]
         endif
     finally
         " &ul is global, but 'let &ul=ul_' causes 'undo list corrupt' error. WHY?
@@ -2518,6 +2745,50 @@ func! voom#BodyUpdateTree() "{{{2
 endfunc
 
 
+func! voom#BodyListener(bufnr, start, end, added, changes) "{{{2
+" Body listener callback, see |listener_add()|. Accumulate Body lines changed
+" since the last outline update in s:voom_bodies[body].dirty:
+"   [first changed lnum, last changed lnum, number of added lines, b:changedtick]
+" lnums are current Body lnums. [0,0,0,tick] means there were no changes.
+" [-1] means changes are not known, full outline update is needed.
+    if !has_key(s:voom_bodies, a:bufnr) | return | endif
+    let d = s:voom_bodies[a:bufnr].dirty
+    if d[0] < 0 | return | endif
+    let last = a:end + a:added - 1
+    if d[0] == 0
+        let [d[0], d[1]] = [a:start, last]
+    else
+        let d[1] = max([d[1] < a:end ? d[1] : d[1] + a:added, last])
+        let d[0] = min([d[0], a:start])
+    endif
+    let d[2] += a:added
+    let d[3] = getbufvar(a:bufnr, 'changedtick')
+endfunc
+
+
+func! voom#BodyDirty(body) "{{{2
+" Return Body lines changed since the last outline update, see voom#BodyListener().
+" Return [-1] if they are not known, e.g. there were changes not seen by the
+" listener, such as reloading Body with :e!.
+    if !has_key(s:voom_bodies[a:body], 'lid') | return [-1] | endif
+    call listener_flush(a:body)
+    let d = s:voom_bodies[a:body].dirty
+    if d[0] >= 0 && d[3] != getbufvar(a:body, 'changedtick')
+        return [-1]
+    endif
+    return d
+endfunc
+
+
+func! voom#BodyDirtyReset(body) "{{{2
+" Outline is up to date with Body body. Forget Body changes recorded so far.
+    if has_key(s:voom_bodies[a:body], 'lid')
+        call listener_flush(a:body)
+        let s:voom_bodies[a:body].dirty = [0, 0, 0, getbufvar(a:body, 'changedtick')]
+    endif
+endfunc
+
+
 "---Tree or Body------------------------------{{{1
 
 func! voom#EchoUNL() "{{{2
@@ -2543,7 +2814,8 @@ endfunc
 func! voom#Grep(input) "{{{2
 " Seach Body for pattern(s). Show list of UNLs of nodes with matches.
 " Input can have several patterns separated by boolean 'AND' and 'NOT'.
-" Stop if >500000 matches found for a pattern.
+" Patterns are searched in Python if possible, see voom_GrepScan().
+" Otherwise, stop if >500000 matches found for a pattern.
 " Set "/ register to AND patterns.
 
     """ Process input first in case we are in Tree and want word under cursor.
@@ -2578,15 +2850,10 @@ func! voom#Grep(input) "{{{2
         return
     endif
 
-    """ Search for each pattern with search().
-    let [lnum_,cnum_] = [line('.'), col('.')]
-    let lz_ = &lz | set lz
-    let winsave_dict = winsaveview()
-    " search results: list of lists with blnums for each pattern
-    let [matchesAND, matchesNOT] = [[], []]
     " inheritance flags (hierarchical search): 0 or 1
     let [inhAND, inhNOT] = [[], []]
-    let pattsAND1 = []
+    " patterns without leading '*'
+    let [pattsAND1, pattsNOT1] = [[], []]
     for patt in pattsAND
         if patt =~ '\m^\*.'
             let patt = patt[1 : ]
@@ -2595,17 +2862,6 @@ func! voom#Grep(input) "{{{2
             call add(inhAND, 0)
         endif
         call add(pattsAND1, patt)
-        let [matches, notOK] = voom#GrepSearch(patt)
-        if notOK
-            if notOK == 1
-                call voom#ErrorMsg('VOoM (Voomgrep): pattern not found: '. patt)
-            endif
-            call winrestview(winsave_dict)
-            call winline()
-            let &lz=lz_
-            return
-        endif
-        call add(matchesAND, matches)
     endfor
     for patt in pattsNOT
         if patt =~ '\m^\*.'
@@ -2614,18 +2870,58 @@ func! voom#Grep(input) "{{{2
         else
             call add(inhNOT, 0)
         endif
-        let [matches, notOK] = voom#GrepSearch(patt)
-        if notOK > 1
-            call winrestview(winsave_dict)
-            call winline()
-            let &lz=lz_
+        call add(pattsNOT1, patt)
+    endfor
+
+    """ Search all patterns in Python if they can be translated.
+    " Otherwise, search for each pattern with search().
+    " numbers of matches for each pattern
+    let [countsAND, countsNOT] = [[], []]
+    let [lnum_,cnum_] = [line('.'), col('.')]
+    let pyGrep = 0
+    if g:voom_python_grep
+        exe s:PYCMD "_VOoM2657.voom_GrepScan()"
+    endif
+    if pyGrep
+        let i = index(countsAND, 0)
+        if i > -1
+            call voom#ErrorMsg('VOoM (Voomgrep): pattern not found: '. pattsAND1[i])
             return
         endif
-        call add(matchesNOT, matches)
-    endfor
-    call winrestview(winsave_dict)
-    call winline()
-    let &lz=lz_
+    else
+        let lz_ = &lz | set lz
+        let winsave_dict = winsaveview()
+        " search results: list of lists with blnums for each pattern
+        let [matchesAND, matchesNOT] = [[], []]
+        for patt in pattsAND1
+            let [matches, notOK] = voom#GrepSearch(patt)
+            if notOK
+                if notOK == 1
+                    call voom#ErrorMsg('VOoM (Voomgrep): pattern not found: '. patt)
+                endif
+                call winrestview(winsave_dict)
+                call winline()
+                let &lz=lz_
+                return
+            endif
+            call add(matchesAND, matches)
+        endfor
+        for patt in pattsNOT1
+            let [matches, notOK] = voom#GrepSearch(patt)
+            if notOK > 1
+                call winrestview(winsave_dict)
+                call winline()
+                let &lz=lz_
+                return
+            endif
+            call add(matchesNOT, matches)
+        endfor
+        call winrestview(winsave_dict)
+        call winline()
+        let &lz=lz_
+        let countsAND = map(copy(matchesAND), 'len(v:val)')
+        let countsNOT = map(copy(matchesNOT), 'len(v:val)')
+    endif
 
     let [lenAND, lenNOT] = [len(pattsAND), len(pattsNOT)]
     """ Highlight all AND pattern.
@@ -2647,16 +2943,14 @@ func! voom#Grep(input) "{{{2
     " 2nd line shows patterns and numbers of matches
     let line2 = ':Voomgrep'
     for i in range(lenAND)
-        let L = matchesAND[i]
         if i == 0
-            let line2 = line2 .    '  '. pattsAND[i] .' {'. len(L) .' matches}'
+            let line2 = line2 .    '  '. pattsAND[i] .' {'. countsAND[i] .' matches}'
         else
-            let line2 = line2 .'  AND '. pattsAND[i] .' {'. len(L) .' matches}'
+            let line2 = line2 .'  AND '. pattsAND[i] .' {'. countsAND[i] .' matches}'
         endif
     endfor
     for i in range(lenNOT)
-        let L = matchesNOT[i]
-        let line2 = line2 .'  NOT '. pattsNOT[i] .' {'. len(L) .' matches}'
+        let line2 = line2 .'  NOT '. pattsNOT[i] .' {'. countsNOT[i] .' matches}'
     endfor
     " initiate quickfix list with two lines
     call setqflist([{'text':line1, 'bufnr':body, 'lnum':lnum_, 'col':cnum_}, {'text':line2}])
@@ -2759,9 +3053,7 @@ func! voom#LogInit() "{{{2
     """ Log buffer exists, show it.
     if s:voom_logbnr
         if !bufloaded(s:voom_logbnr)
-            exe s:PYCMD "sys.stdout = _voom2657_py_sys_stdout"
-            exe s:PYCMD "sys.stderr = _voom2657_py_sys_stderr"
-            exe s:PYCMD "if 'pydoc' in sys.modules: del sys.modules['pydoc']"
+            call s:LogRestoreStdout()
             if bufexists(s:voom_logbnr)
                 exe 'au! VoomLog * <buffer='.s:voom_logbnr.'>'
                 exe 'bwipeout '.s:voom_logbnr
@@ -2781,6 +3073,10 @@ func! voom#LogInit() "{{{2
     endif
 
     """ Create and configure PyLog buffer.
+    if exists('s:exec_timer')
+        call voom#ErrorMsg('VOoM: background Python script is still running, try again later')
+        return
+    endif
     if bufexists('__PyLog__') > 0
         call voom#ErrorMsg('VOoM: there is already a buffer named __PyLog__')
         return
@@ -2845,9 +3141,13 @@ func! voom#LogBufUnload() "{{{2
         echoerr 'VOoM: INTERNAL ERROR'
         return
     endif
-    exe s:PYCMD "sys.stdout = _voom2657_py_sys_stdout"
-    exe s:PYCMD "sys.stderr = _voom2657_py_sys_stderr"
-    exe s:PYCMD "if 'pydoc' in sys.modules: del sys.modules['pydoc']"
+    " Output of background script is written to sys.stdout until it ends.
+    " voom#ExecBgPoll() will restore sys.stdout.
+    if exists('s:exec_timer')
+        exe s:PYCMD "_VOoM2657.voom_ExecBgStop()"
+    else
+        call s:LogRestoreStdout()
+    endif
     exe 'au! VoomLog * <buffer='.s:voom_logbnr.'>'
     try
         exe 'bwipeout '.s:voom_logbnr
@@ -2858,6 +3158,14 @@ func! voom#LogBufUnload() "{{{2
 endfunc
 
 
+func! s:LogRestoreStdout() "{{{2
+" Restore Python stdout and stderr redirected by voom#LogConfig().
+    exe s:PYCMD "sys.stdout = _voom2657_py_sys_stdout"
+    exe s:PYCMD "sys.stderr = _voom2657_py_sys_stderr"
+    exe s:PYCMD "if 'pydoc' in sys.modules: del sys.modules['pydoc']"
+endfunc
+
+
 func! voom#LogScroll() "{{{2
 " Scroll windows with the __PyLog__ buffer.
 " All tabs are searched. Only the first found Log window in each tab is scrolled.
@@ -3084,6 +3392,53 @@ func! s:ExecVim() "{{{2
 endfunc
 
 
+func! voom#ExecBg(qargs) "{{{2
+" Execute Python script like voom#Exec() in a background thread. Output is
+" written to PyLog, which is created if needed. If argument is 'stop': cancel
+" the running script.
+    if !has('timers')
+        call voom#ErrorMsg('VOoM: Voomexecbg requires Vim with +timers')
+        return
+    endif
+    if a:qargs==#'stop'
+        exe s:PYCMD "_VOoM2657.voom_ExecBgStop()"
+        return
+    elseif a:qargs!=''
+        call voom#ErrorMsg('VOoM: unsupported argument: "'.a:qargs.'"')
+        return
+    endif
+    if exists('s:exec_timer')
+        call voom#ErrorMsg('VOoM: background Python script is already running, use :Voomexecbg stop')
+        return
+    endif
+    let [bufType, body, bln1, bln2] = voom#GetExecRange(line('.'))
+    if body<1 | return | endif
+    if !s:voom_logbnr
+        call voom#LogInit()
+        if !s:voom_logbnr | return | endif
+    endif
+    let l:ok = 0
+    exe s:PYCMD "_VOoM2657.voom_ExecBg()"
+    if l:ok
+        let s:exec_timer = timer_start(100, 'voom#ExecBgPoll', {'repeat': -1})
+    endif
+endfunc
+
+
+func! voom#ExecBgPoll(timer) "{{{2
+" Timer callback, see voom#ExecBg(). Write output of the script to PyLog.
+    let l:status = 'error'
+    exe s:PYCMD "_VOoM2657.voom_ExecBgPoll()"
+    if l:status==#'running' | return | endif
+    call timer_stop(a:timer)
+    unlet! s:exec_timer
+    " PyLog was unloaded while the script was running, see voom#LogBufUnload()
+    if !s:voom_logbnr
+        call s:LogRestoreStdout()
+    endif
+endfunc
+
+
 "---execute user command----------------------{{{1
 if exists('g:voom_user_command')
     execute g:voom_user_command
@@ -0,0 +1,633 @@
+# File: voom_bench.py
+# Last Modified: 2026-10-18
+# Description: VOoM -- two-pane outliner plugin for Python-enabled Vim
+# Website: http://www.vim.org/scripts/script.php?script_id=2657
+# Author: Vlad Irnov (vlad DOT irnov AT gmail DOT com)
+# License: CC0, see http://creativecommons.org/publicdomain/zero/1.0/
+
+"""
+VOoM benchmarks. Time outline construction, outline update and outline
+operations for all markup modes. Vim is not needed, voom_core.py is used.
+Run from directory autoload/voom:
+    python -m voom_vimplugin2657.voom_bench [options]
+    python -m voom_vimplugin2657.voom_bench --help
+
+For each markup mode, a synthetic Body is generated for each number of lines
+(--sizes) and each headline density (--every: one headline per N lines).
+Levels of headlines are a random walk, the random seed is fixed.
+Measured, best of --repeat runs:
+    makeOutline   -- hook_makeOutline() or makeOutline(), also peak memory
+    makeOutline_scan -- makeOutlineScan() of modes that allow it: one regexp
+                     instead of loop over lines, see g:voom_scan_outline
+    makeOutline_parallel -- makeOutlineChunks() with --workers processes
+                     (modes with LINE_CONTEXT)
+    update_same   -- updateOutline() after no change: compare all Tree lines
+    update_edit   -- updateOutline() after one headline was edited
+    update_insert -- updateOutline() after one node was inserted
+    region_edit, region_insert -- same, updateOutlineRegion() (modes with
+                     LINE_CONTEXT)
+    copy, cut, paste -- copyNodes(), cutNodes(), pasteNodes(): node in the
+                     middle of the outline, with subnodes
+    sort          -- deep reverse sort of top level nodes and outline update
+Times are in seconds. Peak memory (KiB) requires module tracemalloc.
+
+Option --check-python verifies that python mode gets the same lines from its
+fast scanner as from tokenize on a corpus of .py files, e.g., Python library,
+and on the tricky Bodies in PYTHON_CASES.
+
+Option --check-grep verifies that Voomgrep search in Python finds the same
+matches as Vim's search() for random patterns. Vim executable is required.
+
+Results are saved as JSON (--output). Each result has 'digest': hash of the
+outline produced by makeOutline. Option --compare checks results against an
+older JSON file: changed digests are parse regressions (exit status 1), slower
+times are reported. A case that raises an exception is reported and saved with
+'error', the other cases are still run.
+"""
+
+import sys, os, re
+import time, random, json, hashlib
+import traceback
+import argparse
+
+import voom_vimplugin2657.voom_core as voom_core
+from voom_vimplugin2657.voom_core import MARKER
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PY_VERSION = sys.version_info[0]
+if PY_VERSION > 2:
+    xrange = range
+
+clock = getattr(time, 'perf_counter', time.time)
+
+SIZES = [1000, 10000, 100000, 1000000]
+EVERY = [3, 10, 100]
+SEED = 2657
+
+
+#---Synthetic Body----------------------------{{{1
+# HEADS[mmode](head, lev) returns list of Body lines of headline with text
+# head and level lev. The headline must be the first of these lines.
+# BODYS[mmode](lev) returns Body line that is not a headline, used after
+# headline with level lev.
+# MAXLEVS[mmode] is the maximum level, 3 if not given.
+
+HEADS = {
+    'fmr':      lambda h,l: ['%s %s%s' %(h, MARKER, l)],
+    'fmr1':     lambda h,l: ['%s %s%s' %(h, MARKER, l)],
+    'fmr2':     lambda h,l: ['%s%s %s' %(MARKER, l, h)],
+    'fmr3':     lambda h,l: ['%s%s %s' %(MARKER, l, h)],
+    'markdown': lambda h,l: ['%s %s' %('#'*l, h)],
+    'pandoc':   lambda h,l: ['%s %s' %('#'*l, h)],
+    'rest':     lambda h,l: [h, '=-~'[l-1]*len(h)],
+    'asciidoc': lambda h,l: ['%s %s' %('='*l, h)],
+    'latex':    lambda h,l: ['\\%ssection{%s}' %('sub'*(l-1), h)],
+    'latexDtx': lambda h,l: ['%% \\%ssection{%s}' %('sub'*(l-1), h)],
+    'org':      lambda h,l: ['%s %s' %('*'*l, h)],
+    'viki':     lambda h,l: ['%s %s' %('*'*l, h)],
+    'python':   lambda h,l: ['%sdef %s():' %('    '*(l-1), h)],
+    'html':     lambda h,l: ['<h%s>%s</h%s>' %(l, h, l)],
+    'taskpaper':lambda h,l: ['%s- %s' %('\t'*(l-1), h)],
+    'wiki':     lambda h,l: ['%s %s %s' %('='*l, h, '='*l)],
+    'vimwiki':  lambda h,l: ['%s %s %s' %('='*l, h, '='*l)],
+    'txt2tags': lambda h,l: ['%s %s %s' %('='*l, h, '='*l)],
+    'dokuwiki': lambda h,l: ['%s %s %s' %('='*(7-l), h, '='*(7-l))],
+    'cwiki':    lambda h,l: ['++%s %s' %('+'*l, h)],
+    'hashes':   lambda h,l: ['%s %s' %('#'*l, h)],
+    'inverseAtx': lambda h,l: ['%s %s' %('@'*(4-l), h)],
+    'vimoutliner':    lambda h,l: ['%s%s' %('\t'*(l-1), h)],
+    'thevimoutliner': lambda h,l: ['%s%s' %('\t'*(l-1), h)],
+    'paragraphBlank':    lambda h,l: [h],
+    'paragraphIndent':   lambda h,l: [' %s' %h],
+    'paragraphNoIndent': lambda h,l: [h],
+    }
+
+TEXT = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit'
+BODYS = {
+    'latexDtx':       lambda l: '%% %s' %TEXT,
+    'python':         lambda l: '%sx = 1' %('    '*l),
+    'taskpaper':      lambda l: '%s%s' %('\t'*l, TEXT),
+    'vimoutliner':    lambda l: '%s: %s' %('\t'*l, TEXT),
+    'thevimoutliner': lambda l: '%s| %s' %('\t'*l, TEXT),
+    'paragraphNoIndent': lambda l: ' %s' %TEXT,
+    }
+
+MAXLEVS = {'paragraphBlank':1, 'paragraphIndent':1, 'paragraphNoIndent':1}
+
+
+def getModes(): #{{{2
+    """Return sorted list of all markup modes (voom_mode_*.py files)."""
+    d = os.path.dirname(os.path.abspath(voom_core.__file__))
+    modes = []
+    for f in os.listdir(d):
+        m = re.match(r'^voom_mode_(\w+)\.py$', f)
+        if m: modes.append(m.group(1))
+    modes.sort()
+    return modes
+
+
+def makeHead(mmode, n, lev): #{{{2
+    """Return Body lines of headline number n with level lev.
+    Headline text has fixed length.
+    """
+    return HEADS[mmode]('Head%07d' %n, lev)
+
+
+def makeBody(mmode, nlines, every, seed=SEED): #{{{2
+    """Return (blines, nodes): Body lines, list of (lnum, lev) of headlines.
+    There is one headline per every lines, at least nlines lines.
+    Every node ends with a blank line.
+    """
+    rnd = random.Random(seed)
+    maxlev = MAXLEVS.get(mmode, 3)
+    body_f = BODYS.get(mmode, lambda l: TEXT)
+    blines, nodes = [], []
+    n, lev = 0, 1
+    while len(blines) < nlines:
+        n += 1
+        lines = makeHead(mmode, n, lev)
+        nodes.append((len(blines)+1, lev))
+        blines.extend(lines)
+        k = every - len(lines) - 1
+        # Python: def must have a body
+        if k < 1 and mmode=='python': k = 1
+        bline = body_f(lev)
+        for i in xrange(k):
+            blines.append(bline)
+        blines.append('')
+        lev = max(1, min(maxlev, lev + rnd.choice((-1,0,1))))
+    return (blines, nodes)
+
+
+#---Measurements------------------------------{{{1
+
+def cloneOutline(VO): #{{{2
+    """Return copy of outline VO with copies of Body, Tree, bnodes, levels."""
+    VO2 = voom_core.VoomOutline()
+    VO2.__dict__.update(VO.__dict__)
+    VO2.Body, VO2.Tree = VO.Body[:], VO.Tree[:]
+    VO2.bnodes, VO2.levels = VO.bnodes[:], VO.levels[:]
+    return VO2
+
+
+def timeIt(func, repeat, setup=None): #{{{2
+    """Return the best time of repeat calls of func(arg), arg=setup() if setup
+    is given, else func(). setup() is not timed.
+    """
+    best = None
+    for i in xrange(repeat):
+        if setup:
+            arg = setup()
+            t = clock()
+            func(arg)
+        else:
+            t = clock()
+            func()
+        t = clock() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def peakMem(func): #{{{2
+    """Return peak memory (KiB) allocated during func() or None."""
+    if not tracemalloc:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak // 1024
+
+
+def outlineDigest(outline): #{{{2
+    """Return hash of outline (tlines, bnodes, levels)."""
+    tlines, bnodes, levels = outline
+    s = '%s\n%s\n%s' %('\n'.join(tlines), bnodes, levels)
+    if PY_VERSION > 2:
+        s = s.encode('utf-8')
+    return hashlib.md5(s).hexdigest()
+
+
+def benchCase(mmode, nlines, every, repeat=3, oops=True, memory=True, workers=0): #{{{2
+    """Benchmark markup mode mmode for one synthetic Body. Return dict.
+    If benchmark fails, 'ok' is False and 'error' is the exception.
+    """
+    R = {'mode':mmode, 'lines':nlines, 'every':every, 'heads':None, 'digest':None, 'ok':False}
+    try:
+        benchSteps(R, mmode, nlines, every, repeat, oops, memory, workers)
+    except Exception:
+        R['ok'] = False
+        R['error'] = traceback.format_exc().strip().split('\n')[-1]
+    return R
+
+
+def benchSteps(R, mmode, nlines, every, repeat, oops, memory, workers): #{{{2
+    """Do benchCase(), add results to dict R."""
+    blines, nodes = makeBody(mmode, nlines, every)
+    VO = voom_core.newOutline(blines, mmode)
+    Z = len(blines)
+    R['lines'] = Z
+    R['heads_expected'] = len(nodes)
+
+    ### makeOutline
+    outline = VO.makeOutline(VO, VO.Body)
+    R['heads'] = len(outline[1])
+    R['digest'] = outlineDigest(outline)
+    R['ok'] = outline[1]==[i[0] for i in nodes] and outline[2]==[i[1] for i in nodes]
+    t = timeIt(lambda: VO.makeOutline(VO, VO.Body), repeat)
+    R['makeOutline'] = t
+    R['lines_per_sec'] = int(Z/t) if t else None
+    if memory:
+        R['makeOutline_peak_kb'] = peakMem(lambda: VO.makeOutline(VO, VO.Body))
+    if hasattr(VO.mModule, 'hook_scanHeadline'):
+        R['makeOutline_scan'] = timeIt(lambda: voom_core.makeOutlineScan(VO, VO.Body), repeat)
+    if workers and VO.lineContext >= 0:
+        R['makeOutline_parallel'] = timeIt(lambda: voom_core.makeOutlineChunks(VO, VO.Body, workers), repeat)
+
+    ### outline update
+    # Edit headline (all its lines) and insert node in the middle of Body.
+    bln, lev = nodes[len(nodes)//2]
+    head = makeHead(mmode, len(nodes)+1, lev)
+    k = len(head)
+    ins = head + ['']
+    if mmode=='python':
+        ins = head + [BODYS['python'](lev), '']
+
+    def edited(VO):
+        VO = cloneOutline(VO)
+        VO.Body[bln-1:bln-1+k] = head
+        return VO
+    def inserted(VO):
+        VO = cloneOutline(VO)
+        VO.Body[bln-1:bln-1] = ins
+        return VO
+
+    R['update_same'] = timeIt(voom_core.updateOutline, repeat, lambda: cloneOutline(VO))
+    R['update_edit'] = timeIt(voom_core.updateOutline, repeat, lambda: edited(VO))
+    R['update_insert'] = timeIt(voom_core.updateOutline, repeat, lambda: inserted(VO))
+    if memory:
+        VO2 = inserted(VO)
+        R['update_insert_peak_kb'] = peakMem(lambda: voom_core.updateOutline(VO2))
+    if VO.lineContext >= 0:
+        R['region_edit'] = timeIt(lambda VO: voom_core.updateOutlineRegion(VO, bln, bln+k-1, 0),
+                repeat, lambda: edited(VO))
+        R['region_insert'] = timeIt(lambda VO: voom_core.updateOutlineRegion(VO, bln, bln+len(ins)-1, len(ins)),
+                repeat, lambda: inserted(VO))
+
+    if not oops:
+        return
+
+    ### outline operations
+    # node in the middle, with subnodes
+    ln1 = max(len(VO.levels)//2, 2)
+    ln2 = ln1 + voom_core.nodeSubnodes(VO, ln1)
+    R['oop_nodes'] = ln2-ln1+1
+    R['copy'] = timeIt(lambda: voom_core.copyNodes(VO, ln1, ln2), repeat)
+    R['cut'] = timeIt(lambda VO: voom_core.cutNodes(VO, ln1, ln2, ln1-1),
+            repeat, lambda: cloneOutline(VO))
+
+    pBlines_ = voom_core.copyNodes(VO, ln1, ln2)
+    def paste(VO):
+        # as voom_OopPaste(): clipboard outline is part of the operation
+        pBlines = pBlines_[:]
+        pTlines, pBnodes, pLevels = VO.makeOutline(VO, pBlines)
+        voom_core.checkNodes(pBnodes, pLevels)
+        voom_core.pasteNodes(VO, ln1-1, True, pBlines, pTlines, pBnodes, pLevels)
+    def pasteSetup():
+        VO2 = cloneOutline(VO)
+        voom_core.cutNodes(VO2, ln1, ln2, ln1-1)
+        return VO2
+    R['paste'] = timeIt(paste, repeat, pasteSetup)
+
+    def sort(VO):
+        voom_core.sortNodes(VO, voom_core.nodeSiblings(VO, 2), True, oReverse=1)
+        voom_core.updateOutline(VO)
+    R['sort'] = timeIt(sort, repeat, lambda: cloneOutline(VO))
+
+
+#---Python Mode Check-------------------------{{{1
+
+# Python mode Bodies checked by checkPython() before files: string prefixes
+# must not be seen as names.
+PYTHON_CASES = [
+    ["(b'a'", " b'b')", "def g(): pass"],
+    ["class A:", "    def f(self):", "        (b'a'", "    b'b')", "    x = 1"],
+    ["x = (rb'a'", "     Rb'b', u'c', BR'd',", "     r'''e", "f''')", "def g(): pass"],
+    ["(ub'a'", " b'b')", "(bx,", " b'b')"],
+    ]
+
+def checkPython(paths): #{{{2
+    """Compare get_lnums_from_scan() with get_lnums_from_tokenize() of python
+    mode for each Body in PYTHON_CASES and each .py file in paths (files or
+    directories). Print Bodies with different results. Return the number of
+    such Bodies.
+    """
+    import voom_vimplugin2657.voom_mode_python as mode
+    nbad = 0
+    for (i, blines) in enumerate(PYTHON_CASES):
+        lnums_scan = mode.get_lnums_from_scan(blines)
+        if not (lnums_scan is None or lnums_scan==mode.get_lnums_from_tokenize(blines)):
+            nbad += 1
+            print('DIFFERENT: PYTHON_CASES[%s]' %i)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (d, dirs, fnames) in os.walk(path):
+                dirs.sort()
+                files.extend([os.path.join(d, f) for f in sorted(fnames) if f.endswith('.py')])
+        else:
+            files.append(path)
+    nfallback = 0
+    t_tok = t_scan = 0.0
+    for fpath in files:
+        f = open(fpath, 'rb')
+        try:
+            blines = f.read().split(b'\n')
+        finally:
+            f.close()
+        if PY_VERSION > 2:
+            blines = [b.decode('utf-8', 'replace') for b in blines]
+        if blines and not blines[-1]:
+            blines.pop()
+        t = clock()
+        try:
+            lnums_tok = mode.get_lnums_from_tokenize(blines)
+        except Exception:
+            lnums_tok = None
+        t_tok += clock()-t
+        t = clock()
+        lnums_scan = mode.get_lnums_from_scan(blines)
+        t_scan += clock()-t
+        if lnums_scan is None:
+            nfallback += 1
+        elif not lnums_scan==lnums_tok:
+            nbad += 1
+            if lnums_tok is None:
+                print('DIFFERENT: %s: tokenize failed' %fpath)
+            else:
+                ignore = sorted(set(lnums_scan[0]) ^ set(lnums_tok[0]))
+                func = sorted(set(lnums_scan[1]) ^ set(lnums_tok[1]))
+                print('DIFFERENT: %s: ignore_lnums %s, func_lnums %s' %(fpath, ignore[:10], func[:10]))
+    print('%s files, %s different, %s need tokenize; tokenize %.2f s, scan %.2f s'
+            %(len(files), nbad, nfallback, t_tok, t_scan))
+    return nbad
+
+
+#---Voomgrep Check----------------------------{{{1
+# Vim script for checkGrep(): search for each pattern like voom#GrepSearch(),
+# write lnums of matches. Arguments: patterns file, output file.
+GREP_VIM = r"""
+set nomore magic noignorecase
+let s:res = []
+for s:patt in readfile(%s)
+    keepj normal! gg0
+    let s:m = []
+    if searchpos(s:patt, 'nc', 1) == [1,1]
+        call add(s:m, 1)
+    endif
+    let s:found = search(s:patt, 'W')
+    while s:found > 0
+        call add(s:m, s:found)
+        let s:found = search(s:patt, 'W')
+    endwhile
+    call add(s:res, join(s:m, ','))
+endfor
+call writefile(s:res, %s)
+qa!
+"""
+
+GREP_ATOMS = ['a', 'b', 'ab', 'A', '.', '[ab]', '[^a ]', '\\s', '\\S', '\\w',
+        '\\W', '\\d', '\\a', '\\<', '\\>', 'x', '\\.']
+GREP_MULTIS = ['', '', '', '*', '\\+', '\\=', '\\?', '\\{-}', '\\{1,2}',
+        '\\{,2}', '\\{-1,}', '\\{2}']
+GREP_CHARS = u'aabbAx1_ .\t\xd7\xe9'
+
+
+def makeGrepPattern(rnd, depth=0): #{{{2
+    """Return random Vim pattern for checkGrep()."""
+    items = []
+    for i in xrange(rnd.randint(1, 3)):
+        if depth < 2 and rnd.random() < 0.2:
+            alts = [makeGrepPattern(rnd, depth+1) for j in xrange(rnd.randint(1, 2))]
+            atom = rnd.choice(('\\(', '\\%(')) + '\\|'.join(alts) + '\\)'
+        else:
+            atom = rnd.choice(GREP_ATOMS)
+        items.append(atom + rnd.choice(GREP_MULTIS))
+    patt = ''.join(items)
+    if depth == 0:
+        r = rnd.random()
+        if r < 0.1:
+            patt = '^' + patt
+        elif r < 0.2:
+            patt = patt + '$'
+        elif r < 0.25:
+            patt = '\\c' + patt
+    return patt
+
+
+def checkGrep(vim='vim', seeds=5, npatts=200, nlines=300): #{{{2
+    """Compare matches found by grepNodes() with matches found by Vim's
+    search() in voom#GrepSearch() for random patterns and random Bodies.
+    vim is Vim executable. Bodies of odd seeds have non-ASCII chars.
+    Print patterns with different results. Return the number of such patterns.
+    """
+    import io, subprocess, shutil, tempfile
+    nbad = nchecked = 0
+    tmp = tempfile.mkdtemp()
+    try:
+        for seed in xrange(SEED, SEED+seeds):
+            rnd = random.Random(seed)
+            chars = GREP_CHARS if seed % 2 else GREP_CHARS[:-2]
+            blines = [''.join([rnd.choice(chars) for j in xrange(rnd.randint(0, 8))])
+                        for i in xrange(nlines)]
+            patts = [makeGrepPattern(rnd) for i in xrange(npatts)]
+            fbody, fpatts, fout, fscript = [os.path.join(tmp, f) for f in ('body', 'patts', 'out', 'script.vim')]
+            for fpath, lines in ((fbody, blines), (fpatts, patts)):
+                f = io.open(fpath, 'w', encoding='utf-8', newline='\n')
+                try:
+                    f.write(u'\n'.join(lines) + u'\n')
+                finally:
+                    f.close()
+            f = open(fscript, 'w')
+            try:
+                f.write(GREP_VIM %(repr(fpatts), repr(fout)))
+            finally:
+                f.close()
+            subprocess.call([vim, '-u', 'NONE', '-i', 'NONE', '-N', '-n', '-es',
+                '--cmd', 'set enc=utf-8 fencs=utf-8', '-S', fscript, fbody])
+            f = io.open(fout, encoding='utf-8')
+            try:
+                results = f.read().split(u'\n')
+            finally:
+                f.close()
+            text = u'\n'.join(blines)
+            keyword = not voom_core.NON_ASCII_RE.search(text)
+            VO = voom_core.VoomOutline()
+            VO.bnodes = list(xrange(1, nlines+1))
+            for patt, res in zip(patts, results):
+                regex = voom_core.compileVimRegex(patt, keyword=keyword)
+                if regex is None:
+                    continue
+                nchecked += 1
+                counts = {}
+                for lnum in res.split(u','):
+                    if lnum:
+                        counts[int(lnum)] = counts.get(int(lnum), 0) + 1
+                n, nodes = voom_core.grepNodes(VO, text, regex)
+                if not dict([(tln, c) for (tln, (c, bln)) in nodes.items()]) == counts:
+                    nbad += 1
+                    print('DIFFERENT: seed %s: %s' %(seed, patt))
+    finally:
+        shutil.rmtree(tmp)
+    print('%s patterns translated, %s different' %(nchecked, nbad))
+    return nbad
+
+
+#---Reports-----------------------------------{{{1
+
+TIMES = ('makeOutline', 'makeOutline_scan', 'makeOutline_parallel', 'update_same', 'update_edit', 'update_insert',
+        'region_edit', 'region_insert', 'copy', 'cut', 'paste', 'sort')
+
+
+def formatCase(R): #{{{2
+    """Return report line for result R."""
+    L = ['%-17s %8s %4s %7s' %(R['mode'], R['lines'], R['every'], '-' if R['heads'] is None else R['heads'])]
+    L.append('%10s' %(R.get('lines_per_sec') or '-'))
+    L.append('%8s' %(R.get('makeOutline_peak_kb') or '-'))
+    for k in TIMES:
+        if k in R:
+            L.append('%8.2f' %(R[k]*1000))
+        else:
+            L.append('%8s' %'-')
+    if 'error' in R:
+        L.append('  !!! ERROR: %s' %R['error'])
+    elif not R['ok']:
+        L.append('  !!! %s HEADLINES EXPECTED' %R['heads_expected'])
+    return ' '.join(L)
+
+
+def formatHeader(): #{{{2
+    L = ['%-17s %8s %4s %7s' %('mode', 'lines', 'evry', 'heads'), '%10s' %'lines/s', '%8s' %'peak KiB']
+    for k in TIMES:
+        L.append('%8s' %k.replace('makeOutline_','').replace('update_','upd_').replace('region_','reg_')[:8])
+    return ' '.join(L) + '\n' + ' '*60 + '(times are in ms)'
+
+
+def compareResults(results, old, tolerance=1.25): #{{{2
+    """Compare results with old results (lists of dicts). Return (regressions,
+    slowdowns): lists of message strings. Regression: different digest or
+    number of headlines, or failed benchmark. Slowdown: time larger by factor tolerance and by at
+    least 1 ms.
+    """
+    old_d = {}
+    for R in old:
+        old_d[(R['mode'], R['lines'], R['every'])] = R
+    regressions, slowdowns = [], []
+    for R in results:
+        key = (R['mode'], R['lines'], R['every'])
+        O = old_d.get(key)
+        if not O or 'error' in O: continue
+        case = '%s lines=%s every=%s' %key
+        if 'error' in R:
+            regressions.append('%s: failed: %s' %(case, R['error']))
+            continue
+        if R['digest'] != O['digest'] or R['heads'] != O['heads']:
+            regressions.append('%s: outline changed, headlines %s -> %s' %(case, O['heads'], R['heads']))
+        for k in TIMES:
+            if not (k in R and k in O): continue
+            if R[k] > O[k]*tolerance and R[k]-O[k] > 0.001:
+                slowdowns.append('%s: %s %.2f ms -> %.2f ms' %(case, k, O[k]*1000, R[k]*1000))
+    return (regressions, slowdowns)
+
+
+def main(args=None): #{{{2
+    # markup modes without synthetic Body (e.g., user's new modes) are skipped
+    modes_all = [m for m in getModes() if m in HEADS]
+    p = argparse.ArgumentParser(prog='python -m voom_vimplugin2657.voom_bench',
+            description='Benchmark VOoM markup modes. See module docstring.')
+    p.add_argument('-m', '--modes', default=','.join(modes_all),
+            help='comma-separated markup modes (default: all %s)' %len(modes_all))
+    p.add_argument('-s', '--sizes', default=','.join([str(i) for i in SIZES]),
+            help='comma-separated numbers of Body lines (default: %(default)s)')
+    p.add_argument('-e', '--every', default=','.join([str(i) for i in EVERY]),
+            help='comma-separated headline densities: one headline per N lines (default: %(default)s)')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+            help='report the best of N runs (default: %(default)s)')
+    p.add_argument('--no-oops', action='store_true', help='do not time outline operations')
+    p.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    p.add_argument('-w', '--workers', type=int, default=0,
+            help='also time makeOutline with N worker processes (default: 0, do not)')
+    p.add_argument('-o', '--output', help='save results to JSON file')
+    p.add_argument('-c', '--compare', help='compare results with older JSON file')
+    p.add_argument('-t', '--tolerance', type=float, default=1.25,
+            help='with --compare, report times slower by this factor (default: %(default)s)')
+    p.add_argument('--check-python', nargs='+', metavar='PATH',
+            help='check python mode scanner against tokenize on .py files in PATHs, do nothing else')
+    p.add_argument('--check-grep', nargs='?', const='vim', metavar='VIM',
+            help='check Python search of Voomgrep against Vim executable VIM (default: vim), do nothing else')
+    opts = p.parse_args(args)
+    if opts.check_python:
+        return 1 if checkPython(opts.check_python) else 0
+    if opts.check_grep:
+        return 1 if checkGrep(opts.check_grep) else 0
+
+    modes = [m for m in opts.modes.split(',') if m]
+    for m in modes:
+        if not m in modes_all:
+            p.error('unknown markup mode: %s' %m)
+    sizes = [int(i) for i in opts.sizes.split(',')]
+    everys = [int(i) for i in opts.every.split(',')]
+
+    print(formatHeader())
+    results = []
+    for m in modes:
+        for n in sizes:
+            for e in everys:
+                R = benchCase(m, n, e, opts.repeat, not opts.no_oops, not opts.no_memory, opts.workers)
+                results.append(R)
+                print(formatCase(R))
+                sys.stdout.flush()
+
+    data = {'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'repeat': opts.repeat,
+            'results': results}
+    if opts.output:
+        f = open(opts.output, 'w')
+        try:
+            json.dump(data, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    bad = [R for R in results if not R['ok']]
+    if opts.compare:
+        f = open(opts.compare)
+        try:
+            old = json.load(f)['results']
+        finally:
+            f.close()
+        regressions, slowdowns = compareResults(results, old, opts.tolerance)
+        for s in regressions:
+            print('REGRESSION: %s' %s)
+        for s in slowdowns:
+            print('SLOWER: %s' %s)
+        if regressions:
+            bad.append(regressions)
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# modelines {{{1
+# vim:fdm=marker:fdl=0:
+# vim:foldtext=getline(v\:foldstart).'...'.(v\:foldend-v\:foldstart):
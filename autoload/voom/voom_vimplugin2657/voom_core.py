@@ -0,0 +1,2167 @@
+# File: voom_core.py
+# Last Modified: 2026-10-18
+# Description: VOoM -- two-pane outliner plugin for Python-enabled Vim
+# Website: http://www.vim.org/scripts/script.php?script_id=2657
+# Author: Vlad Irnov (vlad DOT irnov AT gmail DOT com)
+# License: CC0, see http://creativecommons.org/publicdomain/zero/1.0/
+
+"""
+VOoM core: outline data, outline traversal, outline operations.
+This module does not import vim. voom_vim.py is the Vim adapter: it uses Vim
+buffer objects as Body and Tree. Here Body and Tree can also be Python lists
+of lines, which allows to use VOoM outlines without Vim:
+    >>> import voom_vimplugin2657.voom_core as voom_core
+    >>> VO = voom_core.newOutline(['* one', 'text', '** two'], 'org')
+    >>> VO.Tree
+    ['=org', '  |one', '  . |two']
+    >>> voom_core.nodeSubnodes(VO, 2)
+    1
+"""
+
+import sys, re, time
+import bisect
+import copy, threading, traceback
+import ast
+import os, marshal, hashlib
+import difflib
+from collections import Counter
+# lazy imports
+shuffle = None # random.shuffle
+
+PY_VERSION = sys.version_info[0]
+IS_PY2 = PY_VERSION==2
+if PY_VERSION > 2:
+    xrange = range
+clock = getattr(time, 'perf_counter', time.time)
+
+
+#---Constants---------------------------------{{{1
+
+# {filetype: make_head_<filetype> function, ...}
+MAKE_HEAD = {}
+
+# default start fold marker string and regexp
+MARKER = '{{{'                            #}}}
+MARKER_RE = re.compile(r'{{{(\d*[1-9]\d*)(x?)')   #}}}
+
+# node flags of "fmr" modes, see markerFlags(): x (marked), o (opened fold),
+# = (startup node) after start fold marker with level
+FLAG_MARKED, FLAG_OPENED, FLAG_STARTUP = 1, 2, 4
+
+# makeOutlineScan(): number of Body lines searched at once
+SCAN_BLOCK = 2000
+
+# drawTree(): max product of numbers of old and new changed Tree lines that
+# are compared with difflib.
+DIFF_MAX = 250000
+
+# addTime(): number of the last run times of each counter kept for p95
+STAT_SAMPLES = 200
+
+# LineEdits: unchanged lines between changed lines are rewritten if there are
+# at most this many of them, see lineRuns().
+EDIT_GAP = 8
+
+# Markup modes with user settings (latex, asciidoc, etc.) do not read them
+# and do not compile regexps when the mode module is imported. Such markup mode
+# module defines:
+#   SETTINGS -- {name: default value, ...}. In Vim, the value of setting
+#       "name" is Body variable b:voom_{name} if it exists, or g:voom_{name}.
+#   makeState(settings) -- return dict with compiled regexps and other data
+#       for settings {name: value, ...}. The values are as returned by
+#       vim.eval(): strings, lists, dicts.
+# The dict is VO.modeState, see setModeState(). It is made once for each
+# markup mode and settings and is shared by outlines. Compiled fold marker
+# regexps are also cached here, see markerRegex().
+MODE_STATES = {} # {(mmode, settings): state, ...}
+
+# Markup modes report problems, e.g., levels corrected after Paste, with
+# errorMsg(). The Vim adapter sets ERROR_MSG to function(msgs) that shows
+# them. Without Vim the messages are kept in ERROR_MSGS (the last ERROR_MSGS_MAX).
+ERROR_MSG = None
+ERROR_MSGS = []
+ERROR_MSGS_MAX = 100
+
+
+#---Outline Construction----------------------{{{1
+
+
+class VoomOutline: #{{{2
+    """Outline data for one Body.
+    VO.Body -- Body lines: Vim buffer object or list of lines.
+    VO.Tree -- Tree lines: Vim buffer object or list of lines.
+    VO.bnodes -- Body lnums of headlines, VO.levels -- headline levels.
+    First Tree line is not a headline, it is VO.bname with bnode 1, level 1.
+    VO.subtreeEnds, VO.parents -- index, see makeIndex(). None if not available.
+    VO.unls -- cache of nodeUNL() results. None if empty.
+    VO.modeState, VO.modeKey -- markup mode state, see setModeState().
+    VO.parseJob -- ParseJob constructing outline in background, or None.
+    VO.treeLines -- lines in Tree after the last drawTree(), None if unknown.
+    VO.treeDraw -- (lines compared, lines written) by the last drawTree().
+    VO.stats -- run time counters, see addTime(). None if empty.
+    VO.written -- (Body lines, Tree lines) written so far, see addWritten().
+    VO.spliceTree -- function(VO, i1, i2, levels) called before Tree lines
+        i1 to i2-1 (0-based) are replaced with headlines at levels levels, or
+        None. The Vim adapter uses it to keep Tree fold levels.
+    VO.nodeFlags -- node flags ("fmr" modes), see getNodeFlags(). None if not
+        known.
+    VO.flagsArg -- True if VO.makeOutline() takes argument flags, see
+        makeOutlineFlags().
+    """
+    subtreeEnds = None
+    parents = None
+    unls = None
+    modeState = None
+    modeKey = None
+    parseJob = None
+    treeLines = None
+    treeDraw = (0, 0)
+    stats = None
+    written = (0, 0)
+    spliceTree = None
+    nodeFlags = None
+    flagsArg = False
+
+
+def loadMode(mmode): #{{{2
+    """Import and return module of markup mode mmode. Can raise ImportError."""
+    mName = 'voom_vimplugin2657.voom_mode_%s' %mmode
+    __import__(mName)
+    return sys.modules[mName]
+
+
+def setMode(VO, mmode, mModule, settings=None, scan=False): #{{{2
+    """Set markup mode mmode, module mModule, for outline VO: define
+    mode-specific methods. VO.filetype must be set. For "fmr" modes (MTYPE 0),
+    VO.marker and VO.rstrip_chars must be set. settings are markup mode
+    settings, see setModeState(). If scan is True, use makeOutlineScan() if
+    the markup mode allows it.
+    """
+    VO.mModule = mModule
+    VO.mmode = mmode
+    VO.MTYPE = getattr(mModule, 'MTYPE', 1)
+    # lines of context needed to reparse part of Body, -1 if not possible
+    VO.lineContext = getattr(mModule, 'LINE_CONTEXT', -1)
+    # "fmr" mode, markup mode for fold markers
+    if VO.MTYPE == 0:
+        f = getattr(mModule, 'hook_makeOutline', 0)
+        if f:
+            VO.makeOutline = f
+            # hook_makeOutline(VO, blines, flags) records node flags
+            VO.flagsArg = getattr(mModule, 'FLAGS_ARG', False)
+        else:
+            if VO.filetype in MAKE_HEAD:
+                VO.makeOutline = makeOutlineH
+            else:
+                VO.makeOutline = makeOutline
+            VO.flagsArg = True
+        VO.newHeadline = getattr(mModule, 'hook_newHeadline', 0) or newHeadline
+        VO.changeLevBodyHead = changeLevBodyHead
+        VO.hook_doBodyAfterOop = 0
+
+        # start fold marker regexp ("fmr" modes)
+        VO.marker_re = markerRegex(VO.marker)
+
+    # not an "fmr" markup mode: not for fold markers
+    else:
+        VO.makeOutline = getattr(mModule, 'hook_makeOutline', 0) or makeOutline
+        VO.flagsArg = False
+        if scan and hasattr(mModule, 'hook_scanHeadline'):
+            VO.makeOutline = makeOutlineScan
+        VO.newHeadline = getattr(mModule, 'hook_newHeadline', 0) or newHeadline
+        # These must be False if not defined by the markup mode.
+        VO.changeLevBodyHead = getattr(mModule, 'hook_changeLevBodyHead', 0)
+        VO.hook_doBodyAfterOop = getattr(mModule, 'hook_doBodyAfterOop', 0)
+
+    VO.modeState = VO.modeKey = None
+    if hasattr(mModule, 'SETTINGS'):
+        setModeState(VO, settings)
+
+
+def markerRegex(marker): #{{{2
+    """Return compiled regexp for start fold marker string marker."""
+    if marker==MARKER:
+        return MARKER_RE
+    key = ('marker', marker)
+    marker_re = MODE_STATES.get(key)
+    if marker_re is None:
+        marker_re = MODE_STATES[key] = re.compile(re.escape(marker) + r'(\d*[1-9]\d*)(x?)')
+    return marker_re
+
+
+def setModeState(VO, settings=None): #{{{2
+    """Set VO.modeState for markup mode settings: dict {name: value, ...}.
+    Settings that are not in the dict have default values.
+    Return True if VO.modeState has changed.
+    """
+    mModule = VO.mModule
+    S = dict(mModule.SETTINGS)
+    if settings:
+        S.update(settings)
+    key = (VO.mmode, freezeValue(S))
+    if key == VO.modeKey:
+        return False
+    state = MODE_STATES.get(key)
+    if state is None:
+        state = MODE_STATES[key] = mModule.makeState(S)
+    VO.modeState, VO.modeKey = state, key
+    return True
+
+
+def freezeValue(v): #{{{2
+    """Return hashable copy of value v: lists become tuples, dicts become
+    sorted tuples of items.
+    """
+    if isinstance(v, dict):
+        return tuple(sorted([(k, freezeValue(v[k])) for k in v]))
+    elif isinstance(v, (list, tuple)):
+        return tuple([freezeValue(i) for i in v])
+    return v
+
+
+def newOutline(blines, mmode='fmr', filetype='', marker=MARKER, rstrip_chars=' \t', scan=False): #{{{2
+    """Create and return outline (VoomOutline instance) for list of Body
+    lines blines. Use markup mode mmode. Can raise ImportError.
+    scan -- use makeOutlineScan() if possible, see setMode().
+    """
+    VO = VoomOutline()
+    VO.body, VO.tree = None, None # no Vim buffers
+    VO.Body = blines
+    VO.Tree = []
+    VO.bnodes = []
+    VO.levels = []
+    VO.snLn = 1
+    VO.bname = ' %s' %mmode
+    VO.filetype = filetype
+    VO.enc = 'utf-8'
+    VO.marker = marker
+    VO.rstrip_chars = rstrip_chars
+    setMode(VO, mmode, loadMode(mmode), scan=scan)
+    updateOutline(VO)
+    return VO
+
+
+def makeOutline(VO, blines, flags=None): #{{{2
+    """Return (tlines, bnodes, levels) for Body lines blines.
+    blines is either Vim buffer object (Body) or list of buffer lines.
+    Node flags are appended to bytearray flags if it is given.
+    """
+    # blines is usually Body. It is list of clipboard lines during Paste.
+    # This function is slower when blines is Vim buffer object instead of
+    # Python list. But overall time to do outline update is the same and memory
+    # usage is less because we don't create new list (see v3.0 notes)
+
+    # Optimized for buffers in which most lines don't have fold markers.
+
+    # NOTE: duplicate code with makeOutlineH(), only head construction is different
+    marker = VO.marker
+    marker_re_search = VO.marker_re.search
+    Z = len(blines)
+    tlines, bnodes, levels = [], [], []
+    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    flags_add = flags is not None and flags.append
+    c = VO.rstrip_chars
+    for i in xrange(Z):
+        if not marker in blines[i]: continue
+        bline = blines[i]
+        m = marker_re_search(bline)
+        if not m: continue
+        lev = int(m.group(1))
+        head = bline[:m.start()].lstrip().rstrip(c).strip('-=~').strip()
+        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
+        tlines_add(tline)
+        bnodes_add(i+1)
+        levels_add(lev)
+        if flags_add:
+            flags_add(markerFlags(bline, m))
+    return (tlines, bnodes, levels)
+
+
+def makeOutlineH(VO, blines, flags=None): #{{{2
+    """Identical to makeOutline(), duplicate code. The only difference is that
+    a custom function is used to construct Tree headline text.
+    """
+    # NOTE: duplicate code with makeOutline(), only head construction is different
+    marker = VO.marker
+    marker_re_search = VO.marker_re.search
+    Z = len(blines)
+    tlines, bnodes, levels = [], [], []
+    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    flags_add = flags is not None and flags.append
+    h = MAKE_HEAD[VO.filetype]
+    for i in xrange(Z):
+        if not marker in blines[i]: continue
+        bline = blines[i]
+        m = marker_re_search(bline)
+        if not m: continue
+        lev = int(m.group(1))
+        head = h(bline,m)
+        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
+        tlines_add(tline)
+        bnodes_add(i+1)
+        levels_add(lev)
+        if flags_add:
+            flags_add(markerFlags(bline, m))
+    return (tlines, bnodes, levels)
+
+
+def markerFlags(bline, m): #{{{2
+    """Return node flags of "fmr" mode headline bline, m is match of
+    VO.marker_re: FLAG_MARKED if 'x' follows marker and level, FLAG_OPENED
+    if 'o' follows that, FLAG_STARTUP if '=' follows that.
+    """
+    e = m.end()
+    c = bline[e:e+2]
+    return ((m.group(2)=='x') + 2*(c[:1]=='o') + 4*(c[:1]=='=' or c=='o='))
+
+
+def makeOutlineFlags(VO, blines): #{{{2
+    """Return (tlines, bnodes, levels, flags): outline made by
+    VO.makeOutline(VO, blines) and bytearray of node flags, with flags of the
+    first Tree line, see getNodeFlags(). flags is None if they were not
+    recorded: not an "fmr" mode or its hook_makeOutline() does not take
+    argument flags (mode module does not define FLAGS_ARG).
+    """
+    if not VO.flagsArg:
+        return VO.makeOutline(VO, blines) + (None,)
+    flags = bytearray(1)
+    tlines, bnodes, levels = VO.makeOutline(VO, blines, flags)
+    if not len(flags) == len(bnodes)+1:
+        flags = None
+    return (tlines, bnodes, levels, flags)
+
+
+def makeOutlineScan(VO, blines): #{{{2
+    """As VO.mModule.hook_makeOutline(), but Body lines are joined and searched
+    with one regexp. Used instead of it if enabled, see setMode(): it is faster
+    when headlines are sparse and slower when they are dense (1 per 3 lines).
+    For markup modes that define:
+        HEADLINE_SCAN -- compiled regexp that matches newline followed by a
+            headline in '\n' + '\n'.join(blines); it is in VO.modeState
+            instead for modes with SETTINGS.
+        hook_scanHeadline(VO, m) -- return (level, Tree line) for match m, or
+            None if m is not a headline.
+    """
+    # Faster than a loop over lines: lines that are not headlines are never
+    # seen by Python code. Because the regexp starts with a newline, re module
+    # does not try to match it at every char. Lnums are obtained by counting
+    # newlines between consecutive matches. If headlines do not depend on other
+    # lines (LINE_CONTEXT is 0), lines are joined in blocks of SCAN_BLOCK lines
+    # to avoid making a copy of the entire Body, otherwise all at once.
+    Z = len(blines)
+    tlines, bnodes, levels = [], [], []
+    S = VO.modeState
+    finditer = (S['HEADLINE_SCAN'] if S else VO.mModule.HEADLINE_SCAN).finditer
+    scan_headline = VO.mModule.hook_scanHeadline
+    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    N = SCAN_BLOCK if VO.lineContext==0 else max(Z, 1)
+    for i in xrange(0, Z, N):
+        text = '\n' + '\n'.join(blines[i:i+N])
+        count = text.count
+        lnum, pos = i, 0
+        for m in finditer(text):
+            s = m.start() + 1
+            lnum += count('\n', pos, s)
+            pos = s
+            h = scan_headline(VO, m)
+            if h:
+                levels_add(h[0])
+                tlines_add(h[1])
+                bnodes_add(lnum)
+        # A Body line that contains '\n' (e.g., NUL passed to Python as '\n'
+        # by some Vim versions) makes the joined text have more lines than
+        # blines: lnums are wrong, scan lines one by one.
+        if not lnum + count('\n', pos) == min(i+N, Z):
+            return VO.mModule.hook_makeOutline(VO, blines)
+    return (tlines, bnodes, levels)
+
+
+#--- make_head functions --- {{{2
+
+def make_head_html(bline,match):
+    s = bline[:match.start()].strip().strip('-=~').strip()
+    if s.endswith('<!'):
+        return s[:-2].strip()
+    else:
+        return s
+MAKE_HEAD['html'] = make_head_html
+
+#def make_head_vim(bline,match):
+#    return bline[:match.start()].lstrip().rstrip('" \t').strip('-=~').strip()
+#MAKE_HEAD['vim'] = make_head_vim
+
+#def make_head_py(bline,match):
+#    return bline[:match.start()].lstrip().rstrip('# \t').strip('-=~').strip()
+#for ft in 'python ruby perl tcl'.split():
+#    MAKE_HEAD[ft] = make_head_py
+
+
+def updateOutline(VO, workers=0): #{{{2
+    """Construct outline for VO.Body. Update lines in VO.Tree if needed.
+    VO.snLn is set to the last Tree lnum if it is larger than that.
+    workers -- number of processes, see makeOutlineChunks().
+    """
+    ### Construct outline.
+    #blines = VO.Body[:] # wasteful, see v3.0 notes
+    t = clock()
+    # node flags are not recorded by worker processes
+    flags = None
+    if workers > 1 and VO.lineContext >= 0:
+        tlines, bnodes, levels = makeOutlineChunks(VO, VO.Body[:], workers)
+    else:
+        tlines, bnodes, levels, flags = makeOutlineFlags(VO, VO.Body)
+    addTime(VO, 'makeOutline', clock()-t)
+    applyOutline(VO, tlines, bnodes, levels, flags)
+
+
+def applyOutline(VO, tlines, bnodes, levels, flags=None): #{{{2
+    """Set outline data from the result of VO.makeOutline(), draw Tree.
+    flags are node flags from makeOutlineFlags() or None.
+    """
+    shadow = VO.treeLines
+    tlines[0:0], bnodes[0:0], levels[0:0] = [VO.bname], [1], [1]
+    VO.bnodes, VO.levels = bnodes, levels
+    resetIndex(VO)
+    VO.nodeFlags = flags
+
+    ### Add the = mark.
+    # snLn got larger than the number of nodes because some nodes were
+    # deleted while editing the Body
+    if VO.snLn > len(bnodes):
+        VO.snLn = len(bnodes)
+    snLn = VO.snLn
+    tlines[snLn-1] = '=%s' %tlines[snLn-1][1:]
+
+    VO.treeDraw = drawTree(VO.Tree, tlines, shadow, VO)
+    VO.treeLines = tlines
+
+
+def drawTree(Tree, tlines, shadow=None, VO=None): #{{{2
+    """Make lines in Tree equal to tlines, write only changed hunks of lines.
+    shadow is list of lines in Tree if it is known, Tree is not read then.
+    Return (number of lines compared, number of lines written).
+    If outline VO is given, times of diffing and writing are added to its
+    counters, VO.levels must be levels of tlines.
+    """
+    # Reading and writing Tree buffer lines is much slower than comparing
+    # Python strings: Tree is read at most once, with one slice.
+    t = clock()
+    if shadow is None:
+        shadow = Tree[:]
+    hunks = []
+    compared = diffHunks(shadow, tlines, 0, len(shadow), 0, len(tlines), hunks, True)
+    t2 = clock()
+    # write from the end: hunks above are not shifted
+    written = 0
+    spliceTree = VO is not None and VO.spliceTree
+    for (a1, a2, b1, b2) in reversed(hunks):
+        if spliceTree:
+            spliceTree(VO, a1, a2, VO.levels[b1:b2])
+        Tree[a1:a2] = tlines[b1:b2]
+        written += b2-b1
+    if VO is not None:
+        addTime(VO, 'treeDiff', t2-t)
+        addTime(VO, 'treeWrite', clock()-t2)
+        addWritten(VO, 0, written)
+    return (compared, written)
+
+
+def diffHunks(a, b, a1, a2, b1, b2, hunks, anchor=False): #{{{2
+    """Append to hunks changed hunks of lines a[a1:a2] vs b[b1:b2]:
+    (old start, old end, new start, new end). Return number of lines compared.
+    anchor -- split lines at lines that occur only once in both lists first.
+    """
+    # Common lines at the start and at the end are skipped. Lines in between
+    # are compared with difflib if there are not too many of them. Otherwise,
+    # they are split at lines that are unique in old and new lines (usually
+    # headlines that were not changed), so that inserted and deleted nodes do
+    # not make all lines below them changed. The remaining hunks are compared
+    # line by line if the number of lines is the same.
+    compared = 0
+    while a1 < a2 and b1 < b2 and a[a1]==b[b1]:
+        a1+=1; b1+=1; compared+=1
+    while a1 < a2 and b1 < b2 and a[a2-1]==b[b2-1]:
+        a2-=1; b2-=1; compared+=1
+    if a1==a2 and b1==b2:
+        return compared
+
+    if (a2-a1) * (b2-b1) <= DIFF_MAX:
+        sm = difflib.SequenceMatcher(None, a[a1:a2], b[b1:b2], autojunk=False)
+        hunks.extend([(i1+a1, i2+a1, j1+b1, j2+b1) for (tag, i1, i2, j1, j2) in sm.get_opcodes() if not tag=='equal'])
+        return compared + a2-a1 + b2-b1
+
+    if anchor:
+        olds, news = a[a1:a2], b[b1:b2]
+        unique = set([l for (l, n) in Counter(olds).items() if n==1])
+        unique.intersection_update([l for (l, n) in Counter(news).items() if n==1])
+        index = dict(zip(olds, xrange(a1, a2)))
+        # anchors: old index, new index of lines unique in both, in order
+        anchors = []
+        last = a1-1
+        for k in xrange(b1, b2):
+            if b[k] in unique:
+                i = index[b[k]]
+                if i > last:
+                    anchors.append((i, k))
+                    last = i
+        if anchors:
+            compared += a2-a1 + b2-b1
+            anchors.append((a2, b2))
+            for (i, k) in anchors:
+                if a1 < i or b1 < k:
+                    compared += diffHunks(a, b, a1, i, b1, k, hunks)
+                a1, b1 = i+1, k+1
+            return compared
+
+    if a2-a1 == b2-b1:
+        k = a1
+        d = b1-a1
+        while k < a2:
+            if a[k]==b[k+d]:
+                k+=1
+                continue
+            k1 = k
+            while k < a2 and not a[k]==b[k+d]:
+                k+=1
+            hunks.append((k1, k, k1+d, k+d))
+        compared += a2-a1
+    else:
+        hunks.append((a1, a2, b1, b2))
+    return compared
+
+
+def shiftBnodes(bnodes, i1, i2, delta): #{{{2
+    """Add delta to Body lnums bnodes[i1:i2]. i2 is None for all to the end.
+    This is faster than a loop over indexes.
+    """
+    bnodes[i1:i2] = [b+delta for b in bnodes[i1:i2]]
+
+
+def shiftBnodesMany(bnodes, shifts): #{{{2
+    """Same as shiftBnodes(bnodes, i, None, delta) for each (i, delta) in list
+    shifts, but with one pass over bnodes. shifts is sorted in place.
+    """
+    shifts.sort()
+    delta = 0
+    for k in xrange(len(shifts)):
+        i1, d = shifts[k]
+        delta += d
+        i2 = shifts[k+1][0] if k+1 < len(shifts) else None
+        if delta and not i1==i2:
+            shiftBnodes(bnodes, i1, i2, delta)
+
+
+# LINE_CONTEXT is defined by markup modes in which headline status of a Body
+# line depends only on lines near it: the number of lines above and below that
+# must be parsed with it, 0 if it does not depend on other lines. Outline of
+# such mode can be updated by reparsing only the changed lines plus context,
+# see updateOutlineRegion(), and can be made in parallel chunks, see
+# makeOutlineChunks(). Other modes must reparse the whole Body. It is
+# VO.lineContext, -1 if not defined.
+
+def updateOutlineRegion(VO, lnum1, lnum2, delta): #{{{2
+    """As updateOutline(), but Body lines lnum1-lnum2 are the only lines that
+    were changed since the last update, and delta lines were added (deleted if
+    delta < 0). lnum2 is lnum1-1 if lines were only deleted. Only the changed
+    lines plus VO.lineContext lines around them are parsed.
+    Markup mode must define LINE_CONTEXT.
+    """
+    Body, bnodes, levels = VO.Body, VO.bnodes, VO.levels
+    c = VO.lineContext
+    Zb = len(Body)
+    # Body lines a-b can have different headlines now.
+    a, b = max(lnum1-c, 1), min(lnum2+c, Zb)
+    # Parse them together with c lines of context on both sides.
+    w = max(a-c, 1)
+    t = clock()
+    tlines_, bnodes_, levels_ = VO.makeOutline(VO, Body[w-1:b+c])
+    tlines, bnodes2, levels2 = [], [], []
+    for k in xrange(len(bnodes_)):
+        bln = bnodes_[k] + w - 1
+        if a <= bln <= b:
+            tlines.append(tlines_[k])
+            bnodes2.append(bln)
+            levels2.append(levels_[k])
+
+    ### Replace old nodes i1 to i2-1 (Body lines a to b-delta before the change).
+    i1 = bisect.bisect_left(bnodes, a, 1)
+    i2 = bisect.bisect_right(bnodes, b-delta, 1)
+    if delta:
+        shiftBnodes(bnodes, i2, None, delta)
+    bnodes[i1:i2] = bnodes2
+    levels[i1:i2] = levels2
+    resetIndex(VO)
+
+    t2 = clock()
+    addTime(VO, 'makeOutline', t2-t)
+
+    ### Draw changed Tree lines. The = mark stays on line snLn, as in updateOutline().
+    Tree = VO.Tree
+    n = len(tlines)
+    written = n
+    snLn = VO.snLn
+    Z = len(bnodes)
+    if snLn > Z:
+        snLn = Z
+    k = snLn-1-i1
+    if 0 <= k < n:
+        tlines[k] = '=%s' %tlines[k][1:]
+    if VO.spliceTree:
+        VO.spliceTree(VO, i1, i2, levels2)
+    if n == i2-i1:
+        written = 0
+        for k in xrange(n):
+            if not tlines[k]==Tree[i1+k]:
+                Tree[i1+k] = tlines[k]
+                written += 1
+    else:
+        Tree[i1:i2] = tlines
+        # line with the old = mark has moved
+        s = VO.snLn-1
+        if s >= i2:
+            s += n-i2+i1
+            Tree[s] = ' %s' %Tree[s][1:]
+    if not Tree[snLn-1].startswith('='):
+        Tree[snLn-1] = '=%s' %Tree[snLn-1][1:]
+    VO.snLn = snLn
+    addTime(VO, 'treeWrite', clock()-t2)
+    addWritten(VO, 0, written)
+
+
+#---Counters----------------------------------{{{1
+# Each outline counts run times of outline construction, Tree drawing, outline
+# operations, and the numbers of Body and Tree lines written. Counters are
+# always on, an update is a few list operations. They are shown by :Voominfo
+# and returned by voom#Stats().
+
+
+def addTime(VO, name, t): #{{{2
+    """Add run time t (seconds) of name to VO.stats:
+    {name: [count, total, max, list of the last STAT_SAMPLES times], ...}.
+    """
+    stats = VO.stats
+    if stats is None:
+        stats = VO.stats = {}
+    stat = stats.get(name)
+    if stat is None:
+        stats[name] = [1, t, t, [t]]
+        return
+    stat[0]+=1
+    stat[1]+=t
+    if t > stat[2]:
+        stat[2] = t
+    samples = stat[3]
+    samples.append(t)
+    if len(samples) > STAT_SAMPLES:
+        del samples[0]
+
+
+def addWritten(VO, blines=0, tlines=0): #{{{2
+    """Add numbers of Body and Tree lines written (inserted or changed) to
+    VO.written. Lines changed only by moving the = mark are not counted.
+    """
+    b, t = VO.written
+    VO.written = (b+blines, t+tlines)
+
+
+def getStats(VO): #{{{2
+    """Return dict with counters and sizes of outline VO, times are in ms:
+        {'makeOutline': {'count': 3, 'total': 9.5, 'max': 4.1, 'p95': 4.1},
+         ...,
+         'bodyLines': 100, 'headlines': 9, 'bodyWritten': 0, 'treeWritten': 12}
+    p95 is computed from the last STAT_SAMPLES times.
+    """
+    d = {}
+    for name, (count, total, tmax, samples) in (VO.stats or {}).items():
+        samples = sorted(samples)
+        p95 = samples[(95*len(samples)+99)//100 - 1]
+        d[name] = {'count': count, 'total': total*1000, 'max': tmax*1000, 'p95': p95*1000}
+    d['bodyLines'] = len(VO.Body)
+    d['headlines'] = max(len(VO.bnodes)-1, 0)
+    d['bodyWritten'], d['treeWritten'] = VO.written
+    return d
+
+
+#---Background Parsing----------------------{{{1
+# Outline of a large Body can be constructed in a worker thread, see
+# voom_vim.updateTree(). ParseJob copies Body lines and outline data when it
+# is created. The thread never touches Vim, VO, or Body. The result is applied
+# by parseApply() if Body has not changed in the meantime.
+# Markup mode whose hook_makeOutline() can call Vim defines ASYNC_PARSE = 0.
+
+
+class ParseJob(threading.Thread): #{{{2
+    """Construct outline of VO.Body in a worker thread. tick identifies the
+    state of Body (b:changedtick in Vim).
+    When the thread is done: job.outline is (tlines, bnodes, levels, flags)
+    from makeOutlineFlags() and job.time is run time of makeOutline(), or
+    job.error is traceback string.
+    """
+    def __init__(self, VO, tick):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tick = tick
+        self.outline = self.error = None
+        self.time = 0
+        # hook_makeOutline() can set mode-specific attributes: use a copy of VO
+        self.VO = copy.copy(VO)
+        self.VO.Body = VO.Body[:]
+        self.attrs = dict(self.VO.__dict__)
+
+    def run(self):
+        VO = self.VO
+        t = clock()
+        try:
+            self.outline = makeOutlineFlags(VO, VO.Body)
+            self.time = clock()-t
+        except Exception:
+            self.error = traceback.format_exc()
+
+
+def parseApply(VO, job): #{{{2
+    """Apply outline constructed by finished ParseJob job. Body must be
+    unchanged since the job was created.
+    """
+    attrs = changedAttrs(job.VO, job.attrs)
+    for k in attrs:
+        setattr(VO, k, attrs[k])
+    addTime(VO, 'makeOutline', job.time)
+    tlines, bnodes, levels, flags = job.outline
+    applyOutline(VO, tlines, bnodes, levels, flags)
+
+
+def changedAttrs(VO, attrs): #{{{2
+    """Return dict of attributes of VO that are not in dict attrs or have
+    other values: attributes set by hook_makeOutline() after
+    attrs = dict(VO.__dict__).
+    """
+    d = {}
+    for k in VO.__dict__:
+        v = VO.__dict__[k]
+        if k not in attrs or v is not attrs[k]:
+            d[k] = v
+    return d
+
+
+#---Parallel Parsing--------------------------{{{1
+# Outline of a very large Body can be constructed by several worker processes,
+# each parses a chunk of Body lines, see makeOutlineChunks(). This is possible
+# if headline status of a line depends only on VO.lineContext lines around it
+# (markup mode defines LINE_CONTEXT >= 0). Workers are forked: they get VO and
+# Body lines from the parent process, only results are sent back. Outline is
+# constructed by one process if fork() is not available (Windows).
+
+# outline parsed by worker processes, set only while they are running
+CHUNK_VO = None
+
+
+def forkContext(): #{{{2
+    """Return multiprocessing context that uses fork(), or None."""
+    import multiprocessing
+    if not hasattr(multiprocessing, 'get_context'): # Python 2
+        return multiprocessing if os.name=='posix' else None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def cpuCount(): #{{{2
+    """Return the number of CPUs, 1 if not known."""
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def makeOutlineChunks(VO, blines, workers): #{{{2
+    """As VO.makeOutline(VO, blines), but use workers processes.
+    blines must be a list. VO.lineContext must be >= 0.
+    """
+    global CHUNK_VO
+    Z = len(blines)
+    mp = forkContext()
+    if mp is None or workers < 2 or Z < workers:
+        return VO.makeOutline(VO, blines)
+    # several chunks per worker: chunks are not parsed equally fast
+    n = (Z + workers*4 - 1) // (workers*4)
+    chunks = [(i, min(i+n, Z)) for i in xrange(0, Z, n)]
+    CHUNK_VO = copy.copy(VO)
+    CHUNK_VO.Body = blines
+    try:
+        pool = mp.Pool(workers)
+        try:
+            results = pool.map(chunkOutline, chunks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        CHUNK_VO = None
+    tlines, bnodes, levels = [], [], []
+    for (tlines_, bnodes_, levels_) in results:
+        tlines.extend(tlines_)
+        bnodes.extend(bnodes_)
+        levels.extend(levels_)
+    return (tlines, bnodes, levels)
+
+
+def chunkOutline(chunk): #{{{2
+    """Run by worker process. Return outline of lines CHUNK_VO.Body[i1:i2]
+    with Body lnums, chunk is (i1, i2).
+    """
+    i1, i2 = chunk
+    VO = CHUNK_VO
+    c = VO.lineContext
+    # parse with c lines of context on both sides, drop nodes in the context
+    w = max(i1-c, 0)
+    tlines, bnodes, levels = VO.makeOutline(VO, VO.Body[w:i2+c])
+    k1 = bisect.bisect_right(bnodes, i1-w)
+    k2 = bisect.bisect_right(bnodes, i2-w)
+    return (tlines[k1:k2], [b+w for b in bnodes[k1:k2]], levels[k1:k2])
+
+
+#---Outline Cache-----------------------------{{{1
+# Outline of a Body read from a file can be saved in a cache directory and
+# loaded instead of parsing Body when the same file is outlined again, see
+# updateOutlineCached(). There is one cache file for each file path. It
+# contains key made by cacheKey() and marshal-ed outline data.
+
+CACHE_VERSION = 2
+
+
+def cacheKey(VO, path, extra=()): #{{{2
+    """Return cache key for outline of VO.Body read from file path: file
+    size, mtime and content hash; markup mode and its settings. extra is
+    tuple of other things Body lines depend on, e.g. file encoding.
+    Raise OSError or IOError if the file cannot be read.
+    """
+    st = os.stat(path)
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(1048576)
+            if not chunk:
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    mFile = getattr(VO.mModule, '__file__', '')
+    mTime = mFile and int(os.stat(mFile).st_mtime) or 0
+    return (CACHE_VERSION, tuple(sys.version_info[:2]), path,
+            st.st_size, int(st.st_mtime), h.hexdigest(),
+            VO.mmode, mTime, VO.modeKey, VO.filetype, VO.enc,
+            getattr(VO, 'marker', ''), getattr(VO, 'rstrip_chars', '')) + tuple(extra)
+
+
+def cacheFile(cacheDir, path): #{{{2
+    """Return path of cache file for file path."""
+    name = hashlib.sha1(path.encode('utf-8', 'replace') if not IS_PY2 else path).hexdigest()
+    return os.path.join(cacheDir, 'voom_%s.cache' %name)
+
+
+def updateOutlineCached(VO, cacheDir, path, extra=()): #{{{2
+    """As updateOutline(), but VO.Body is the unmodified contents of file
+    path. Load outline from cache if it is valid, else construct it and save
+    it in cacheDir. Return False if the cache file could not be written.
+    """
+    try:
+        key = cacheKey(VO, path, extra)
+    except (IOError, OSError):
+        updateOutline(VO)
+        return True
+    cFile = cacheFile(cacheDir, path)
+    Z = len(VO.Body)
+
+    ### Load.
+    try:
+        f = open(cFile, 'rb')
+        try:
+            key_, z, outline, attrs, flags = marshal.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        key_ = None
+    # Body may differ from file if the file was changed after it was read.
+    if key_ == key and z == Z:
+        for k in attrs:
+            setattr(VO, k, attrs[k])
+        tlines, bnodes, levels = outline
+        applyOutline(VO, tlines, bnodes, levels, flags is not None and bytearray(flags) or None)
+        return True
+
+    ### Construct and save.
+    attrs = dict(VO.__dict__)
+    t = clock()
+    tlines, bnodes, levels, flags = makeOutlineFlags(VO, VO.Body)
+    t = clock()-t
+    attrs = changedAttrs(VO, attrs)
+    addTime(VO, 'makeOutline', t)
+    try:
+        data = marshal.dumps((key, Z, (tlines, bnodes, levels), attrs,
+                flags is not None and bytes(flags) or None))
+    except ValueError: # mode attribute that cannot be marshal-ed
+        data = None
+    applyOutline(VO, tlines, bnodes, levels, flags)
+    if data is None:
+        return True
+    try:
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        f = open(cFile, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+    return True
+
+
+#---Outline Traversal-------------------------{{{1
+# Functions for getting node's parents, children, ancestors, etc.
+# Nodes here are Tree buffer lnums.
+# All we do is traverse VO.levels.
+#
+# Index (VO.subtreeEnds, VO.parents) is used when available. It is made by
+# functions that do many lookups (Grep, deep sort) and is kept until the
+# outline changes. It is not made during outline update: that would make each
+# update of a large outline slower by up to 20%. UNLs are cached in VO.unls.
+# Functions that change VO.levels or Tree headlines must call resetIndex().
+# It also discards node flags of "fmr" modes (VO.nodeFlags), they are made
+# again from Body headlines when needed.
+
+
+def makeIndex(VO): #{{{2
+    """Make index for outline traversal. For node at Tree line lnum:
+    VO.subtreeEnds[lnum-1] is Tree lnum of the last subnode, or lnum if no
+    subnodes; VO.parents[lnum-1] is Tree lnum of the parent, or 0 if none.
+    Return VO.subtreeEnds.
+    """
+    levels = VO.levels
+    z = len(levels)
+    ends = list(range(1,z+1))
+    parents = [0]*z
+    # open nodes (ancestors of current node): indexes and levels
+    stack, stack_levs = [], []
+    for i in xrange(1,z):
+        lev = levels[i]
+        while stack_levs and stack_levs[-1] >= lev:
+            stack_levs.pop()
+            ends[stack.pop()] = i
+        if stack:
+            parents[i] = stack[-1]+1
+        stack.append(i)
+        stack_levs.append(lev)
+    for i in stack:
+        ends[i] = z
+    VO.subtreeEnds, VO.parents = ends, parents
+    return ends
+
+
+def getIndex(VO): #{{{2
+    """Return VO.subtreeEnds, make it if needed."""
+    return VO.subtreeEnds or makeIndex(VO)
+
+
+def resetIndex(VO): #{{{2
+    """Discard index, cached UNLs and node flags. Must be called after
+    VO.levels or Tree headlines are changed. Lines in Tree are not known
+    anymore.
+    """
+    VO.subtreeEnds = VO.parents = VO.unls = None
+    VO.treeLines = None
+    VO.nodeFlags = None
+
+
+def makeNodeFlags(VO): #{{{2
+    """Make node flags of "fmr" mode outline from Body headlines.
+    Return VO.nodeFlags.
+    """
+    marker_re_search = VO.marker_re.search
+    flags = bytearray(1)
+    for bline in getLines(VO.Body, VO.bnodes[1:]):
+        flags.append(markerFlags(bline, marker_re_search(bline)))
+    VO.nodeFlags = flags
+    return flags
+
+
+def getNodeFlags(VO): #{{{2
+    """Return VO.nodeFlags, make it if needed. "fmr" modes only.
+    VO.nodeFlags[lnum-1] is flags of node at Tree line lnum, see
+    markerFlags(). They are recorded when the outline is constructed and
+    changed by functions that change x, o, = marks in Body headlines.
+    """
+    return VO.nodeFlags or makeNodeFlags(VO)
+
+
+def nodeHasChildren(VO, lnum): #{{{2
+    """Determine if node at Tree line lnum has children."""
+    levels = VO.levels
+    if lnum==1 or lnum==len(levels): return False
+    elif levels[lnum-1] < levels[lnum]: return True
+    else: return False
+
+
+def nodeSubnodes(VO, lnum): #{{{2
+    """Number of all subnodes for node at Tree line lnum."""
+    ends = VO.subtreeEnds
+    if ends:
+        return ends[lnum-1] - lnum
+    levels = VO.levels
+    z = len(levels)
+    if lnum==1 or lnum==z: return 0
+    lev = levels[lnum-1]
+    for i in xrange(lnum,z):
+        if levels[i]<=lev:
+            return i-lnum
+    return z-lnum
+
+
+def nodeParent(VO, lnum): #{{{2
+    """Return lnum of closest parent of node at Tree line lnum."""
+    parents = VO.parents
+    if parents:
+        return parents[lnum-1] or None
+    levels = VO.levels
+    lev = levels[lnum-1]
+    if lev==1: return None
+    for i in xrange(lnum-2,0,-1):
+        if levels[i] < lev: return i+1
+
+
+def nodeAncestors(VO, lnum): #{{{2
+    """Return lnums of ancestors of node at Tree line lnum."""
+    parents = VO.parents
+    if parents:
+        ancestors = []
+        p = parents[lnum-1]
+        while p:
+            ancestors.append(p)
+            p = parents[p-1]
+        ancestors.reverse()
+        return ancestors
+    levels = VO.levels
+    lev = levels[lnum-1]
+    if lev==1: return []
+    ancestors = []
+    for i in xrange(lnum-2,0,-1):
+        levi = levels[i]
+        if levi < lev:
+            lev = levi
+            ancestors.append(i+1)
+            if lev==1:
+                ancestors.reverse()
+                return ancestors
+    # we get here if there are no nodes at level 1 (wiki mode)
+    ancestors.reverse()
+    return ancestors
+
+
+def nodeUNL(VO, lnum): #{{{2
+    """Compute UNL of node at Tree line lnum.
+    Return list of headlines.
+    """
+    Tree = VO.Tree
+    if lnum==1: return ['top-of-buffer']
+    unls = VO.unls
+    if unls is None:
+        unls = VO.unls = {}
+    # nodes without cached UNL: lnum and its ancestors, up to one with UNL
+    lnums = []
+    ln = lnum
+    while ln and not ln in unls:
+        lnums.append(ln)
+        ln = nodeParent(VO,ln)
+    heads = unls[ln] if ln else ()
+    for ln in reversed(lnums):
+        heads = heads + (Tree[ln-1].split('|',1)[1],)
+        unls[ln] = heads
+    return list(heads)
+
+
+def nodeSiblings(VO, lnum): #{{{2
+    """Return lnums of siblings for node at Tree line lnum.
+    These are nodes with the same parent and level as lnum node. Sorted in
+    ascending order. lnum itself is included. First node (line 1) is never
+    included, that is minimum lnum in results is 2.
+    """
+    levels = VO.levels
+    lev = levels[lnum-1]
+    siblings = []
+    # scan back
+    for i in xrange(lnum-1,0,-1):
+        levi = levels[i]
+        if levi < lev:
+            break
+        elif levi==lev:
+            siblings[0:0] = [i+1]
+    # scan forward
+    ends = VO.subtreeEnds
+    if ends:
+        # skip subnodes
+        z = len(levels)
+        n = ends[lnum-1]+1
+        while n <= z:
+            levn = levels[n-1]
+            if levn < lev:
+                break
+            elif levn==lev:
+                siblings.append(n)
+            n = ends[n-1]+1
+        return siblings
+    for i in xrange(lnum,len(levels)):
+        levi = levels[i]
+        if levi < lev:
+            break
+        elif levi==lev:
+            siblings.append(i+1)
+    return siblings
+
+
+def rangeSiblings(VO, lnum1, lnum2): #{{{2
+    """Return lnums of siblings for nodes in Tree range lnum1,lnum2.
+    These are nodes with the same parent and level as lnum1 node.
+    First node (first Tree line) is never included, that is minimum lnum in results is 2.
+    Return None if range is ivalid.
+    """
+    if lnum1==1: lnum1 = 2
+    if lnum1 > lnum2: return None
+    levels = VO.levels
+    lev = levels[lnum1-1]
+    siblings = [lnum1]
+    for i in xrange(lnum1,lnum2):
+        levi = levels[i]
+        # invalid range
+        if levi < lev:
+            return None
+        elif levi==lev:
+            siblings.append(i+1)
+    return siblings
+
+
+def getSiblingsGroups(VO, siblings): #{{{2
+    """Return list of groups of siblings in the region defined by 'siblings'
+    group, which is list of siblings in ascending order (Tree lnums).
+    Siblings in each group are nodes with the same parent and level.
+    Siblings in each group are in ascending order.
+    List of groups is reverse-sorted by level of siblings and by parent lnum:
+        from RIGHT TO LEFT and from BOTTOM TO TOP.
+    """
+    if not siblings: return []
+    levels = VO.levels
+    ends = getIndex(VO)
+    lnum1, lnum2 = siblings[0], siblings[-1]
+    lnum2 = ends[lnum2-1]
+
+    # get all parents (nodes with children) in the range
+    parents = [i for i in xrange(lnum1,lnum2) if levels[i-1]<levels[i]]
+    if not parents:
+        return [siblings]
+
+    # get children for each parent
+    results_dec = [(levels[lnum1-1], 0, siblings)]
+    for p in parents:
+        sibs = [p+1]
+        lev = levels[p] # level of siblings of this parent
+        # skip subnodes of siblings
+        n = ends[p]+1
+        while n <= lnum2:
+            levn = levels[n-1]
+            if levn==lev:
+                sibs.append(n)
+            elif levn < lev:
+                break
+            n = ends[n-1]+1
+        results_dec.append((lev, p, sibs))
+
+    results_dec.sort()
+    results_dec.reverse()
+    results = [i[2] for i in results_dec]
+    assert len(parents)+1 == len(results)
+    return results
+
+
+def nodesBodyRange(VO, ln1, ln2, withSubnodes=False): #{{{2
+    """Return Body start and end lnums (bln1, bln2) corresponding to nodes at
+    Tree lnums ln1 to ln2. Include ln2's subnodes if withSubnodes."""
+    bln1 = VO.bnodes[ln1-1]
+    if withSubnodes:
+        ln2 += nodeSubnodes(VO,ln2)
+    if ln2 < len(VO.bnodes):
+        bln2 = VO.bnodes[ln2]-1
+    else:
+        bln2 = len(VO.Body)
+    return (bln1,bln2)
+    # (bln1,bln2) can be (1,0), see voom_TreeSelect()
+    # this is what we want: getbufline(body,1,0)==[]
+
+
+#---Outline Operations------------------------{{{1
+# These change Body, Tree and outline data. Caller checks that the operation
+# is valid: Tree lnums are within range, etc.
+# Argument fromBody is called after Body has been modified and before Tree is
+# modified. This is when Vim adapter goes back from Body to Tree.
+
+
+def errorMsg(*msgs): #{{{2
+    """Report error messages msgs (strings) of outline operation or markup
+    mode, see ERROR_MSG.
+    """
+    if ERROR_MSG is None:
+        ERROR_MSGS.extend(msgs)
+        del ERROR_MSGS[:-ERROR_MSGS_MAX]
+    else:
+        ERROR_MSG(msgs)
+
+
+def setLevTreeLines(tlines, levels, j): #{{{2
+    """Set level of each Tree line in tlines to corresponding level from levels.
+    levels should be VO.levels.
+    j is index of the first item in levels.
+    """
+    results = []
+    i = 0
+    for t in tlines:
+        results.append('%s%s%s' %(t[:2], '. '*(levels[j+i]-1), t[t.index('|'):]))
+        i+=1
+    return results
+
+
+def changeLevBodyHead(VO, h, levDelta): #{{{2
+    """Increase or decrease level number of Body headline by levDelta.
+    NOTE: markup modes can replace this function with hook_changeLevBodyHead.
+    """
+    if levDelta==0: return h
+    m = VO.marker_re.search(h)
+    level = int(m.group(1))
+    return '%s%s%s' %(h[:m.start(1)], level+levDelta, h[m.end(1):])
+
+
+def changeLevBodyHeads(VO, ln1, ln2, levDelta): #{{{2
+    """Change levels of Body headlines of nodes at Tree lnums ln1 to ln2 by
+    levDelta with VO.changeLevBodyHead(). Return number of lines written.
+    """
+    f = VO.changeLevBodyHead
+    if not (f and levDelta):
+        return 0
+    blns = VO.bnodes[ln1-1:ln2]
+    edits = LineEdits(VO.Body)
+    for bln, bline in zip(blns, getLines(VO.Body, blns)):
+        edits[bln] = f(VO, bline, levDelta)
+    return edits.apply()
+
+
+def newHeadline(VO, level, blnum, ln): #{{{2
+    """Return (tree_head, bodyLines).
+    tree_head is new headline string in Tree buffer (text after |).
+    bodyLines is list of lines to insert in Body buffer.
+    """
+    tree_head = 'NewHeadline'
+    bodyLines = ['---%s--- %s%s' %(tree_head, VO.marker, level), '']
+    return (tree_head, bodyLines)
+
+
+def copyNodes(VO, ln1, ln2): #{{{2
+    """Return Body lines of nodes at Tree lnums ln1 to ln2."""
+    bln1, bln2 = nodesBodyRange(VO, ln1, ln2)
+    return VO.Body[bln1-1:bln2]
+
+
+def cutNodes(VO, ln1, ln2, lnUp1, fromBody=None): #{{{2
+    """Delete nodes at Tree lnums ln1 to ln2, select node lnUp1.
+    Return blnShow: Body lnum of node lnUp1.
+    """
+    Body, Tree = VO.Body, VO.Tree
+    bnodes, levels = VO.bnodes, VO.levels
+
+    # diagram {{{
+    # .............. blnUp1-1
+    # ============== blnUp1=bnodes[lnUp1-1]
+    # ..............
+    # ============== bln1=bnodes[ln1-1]
+    # range being
+    # deleted
+    # .............. bln2=bnodes[ln2]-1, or last Body line
+    # ==============
+    # .............. }}}
+
+    ### delete body lines
+    bln1, bln2 = nodesBodyRange(VO, ln1, ln2)
+    Body[bln1-1:bln2] = []
+
+    blnShow = bnodes[lnUp1-1] # does not change
+
+    ### update bnodes
+    # decrement lnums after deleted range
+    delta = bln2-bln1+1
+    shiftBnodes(bnodes, ln2, None, -delta)
+    # cut
+    bnodes[ln1-1:ln2] = []
+
+    ### delete range in levels (same as in Tree)
+    levels[ln1-1:ln2] = []
+    resetIndex(VO)
+
+    if VO.hook_doBodyAfterOop:
+        VO.hook_doBodyAfterOop(VO, 'cut', 0,  None, None,  None, None,  bln1-1, ln1-1)
+
+    ### ---go back to Tree---
+    if fromBody: fromBody(blnShow)
+
+    ### remove = mark before modifying Tree
+    snLn = VO.snLn
+    Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
+    ### delete range in Tree (same as in levels))
+    if VO.spliceTree:
+        VO.spliceTree(VO, ln1-1, ln2, [])
+    Tree[ln1-1:ln2] = []
+
+    ### add snLn mark
+    Tree[lnUp1-1] = '=' + Tree[lnUp1-1][1:]
+    VO.snLn = lnUp1
+    return blnShow
+
+
+def checkNodes(pBnodes, pLevels): #{{{2
+    """Check outline of Body lines that are about to be pasted.
+    Return (error, warning): error message if the outline is invalid, warning
+    message if it is suspect, or ''.
+    """
+    ### verify that clipboard is a valid outline
+    if pBnodes==[] or pBnodes[0]!=1:
+        return ('first line is not a headline', '')
+    warning = ''
+    lev_ = pLevels[0]
+    for lev in pLevels:
+        # there is node with level smaller than that of the first node
+        if lev < pLevels[0]:
+            return ('root level error', '')
+        # level incremented by 2 or more
+        elif lev-lev_ > 1:
+            warning = 'inconsistent levels in clipboard--level incremented by >1'
+        lev_ = lev
+    return ('', warning)
+
+
+def pasteNodes(VO, ln, folded, pBlines, pTlines, pBnodes, pLevels, fromBody=None): #{{{2
+    """Paste Body lines pBlines after node at Tree lnum ln. If that node is
+    folded, paste after its subnodes. pTlines, pBnodes, pLevels is the outline
+    of pBlines, it must pass checkNodes(). pBlines and pBnodes are modified.
+    Return (ln1, ln2, blnShow): Tree lnums of pasted nodes, Body lnum of ln1.
+    """
+    Body, Tree = VO.Body, VO.Tree
+    levels, bnodes = VO.levels, VO.bnodes
+
+    ### compute where to insert and at what level
+    # insert nodes after node at ln at level lev
+    # if node is folded, insert after the end of node's tree
+    lev = levels[ln-1] # default level
+    # after first Tree line: use level of next node in case min level is not 1 (wiki mode)
+    if ln==1:
+        if len(levels)>1: lev = levels[1]
+        else: lev=1
+    # after last Tree line, same level
+    elif ln==len(levels): pass
+    # node has children, it can be folded
+    elif lev < levels[ln]:
+        # folded: insert after current node's branch, same level
+        if folded: ln += nodeSubnodes(VO,ln)
+        # not folded, insert as child
+        else: lev+=1
+
+    ### adjust levels of nodes being inserted
+    levDelta = lev - pLevels[0]
+    if levDelta:
+        pLevels = [(lev+levDelta) for lev in pLevels]
+        f = VO.changeLevBodyHead
+        if f:
+            for bl in pBnodes:
+                pBlines[bl-1] = f(VO, pBlines[bl-1], levDelta)
+
+    ### insert body lines in Body
+    # bln is Body lnum after which to insert
+    if ln < len(bnodes): bln = bnodes[ln]-1
+    else: bln = len(Body)
+    Body[bln:bln] = pBlines
+    blnShow = bln+1
+
+    ### update bnodes
+    # increment bnodes being pasted
+    shiftBnodes(pBnodes, 0, None, bln)
+    # increment bnodes after pasted region
+    delta = len(pBlines)
+    shiftBnodes(bnodes, ln, None, delta)
+    # insert pBnodes after ln
+    bnodes[ln:ln] = pBnodes
+
+    ### insert new levels in levels
+    levels[ln:ln] = pLevels
+    resetIndex(VO)
+
+    ### start and end lnums of inserted region
+    ln1 = ln+1
+    ln2 = ln+len(pBnodes)
+
+    if VO.hook_doBodyAfterOop:
+        VO.hook_doBodyAfterOop(VO, 'paste', levDelta,
+                    blnShow, ln1,
+                    blnShow+len(pBlines)-1, ln2,
+                    None, None)
+
+    ### ---go back to Tree---
+    if fromBody: fromBody(blnShow)
+
+    # remove = mark before modifying Tree
+    snLn = VO.snLn
+    Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
+    ### adjust levels of new headlines, insert them in Tree
+    if levDelta:
+        pTlines = setLevTreeLines(pTlines, levels, ln1-1)
+    if VO.spliceTree:
+        VO.spliceTree(VO, ln, ln, levels[ln:ln2])
+    Tree[ln:ln] = pTlines
+    addWritten(VO, len(pBlines), len(pTlines))
+
+    # set snLn to first headline of inserted nodes
+    Tree[ln1-1] = '=' + Tree[ln1-1][1:]
+    VO.snLn = ln1
+    return (ln1, ln2, blnShow)
+
+
+#--- Line Edits --- {{{2
+# Operations that change single lines here and there (marks, levels of
+# headlines) collect changes in LineEdits and write them at once. Each write
+# to a Vim buffer has a cost that does not depend on the number of lines: undo
+# entry, folds, syntax, redraw. Nearby lines are read and written as slices.
+
+
+def lineRuns(lnums, gap=EDIT_GAP): #{{{3
+    """Split sorted list of lnums into runs: yield (i1, i2) such that lines
+    lnums[i1:i2] are separated by at most gap other lines.
+    """
+    i1 = 0
+    for i in xrange(1, len(lnums)):
+        if lnums[i]-lnums[i-1] > gap+1:
+            yield (i1, i)
+            i1 = i
+    if lnums:
+        yield (i1, len(lnums))
+
+
+def getLines(buf, lnums): #{{{3
+    """Return list of lines lnums (sorted) of buffer buf, Vim buffer object
+    or list. Runs of nearby lines are read as slices.
+    """
+    lines = []
+    for i1, i2 in lineRuns(lnums):
+        a = lnums[i1]
+        chunk = buf[a-1:lnums[i2-1]]
+        lines.extend([chunk[ln-a] for ln in lnums[i1:i2]])
+    return lines
+
+
+class LineEdits: #{{{3
+    """New lines for buffer buf, Vim buffer object or list of lines:
+        edits = LineEdits(buf); edits[lnum] = line; ...; edits.apply()
+    apply() writes runs of nearby lines as slices, unchanged lines in between
+    are written too. It counts writes to buf in edits.writes and lines written
+    in edits.written.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.lines = {}
+        self.writes = self.written = 0
+
+    def __setitem__(self, lnum, line):
+        self.lines[lnum] = line
+
+    def __len__(self):
+        return len(self.lines)
+
+    def apply(self):
+        """Write and forget new lines. Return number of lines written."""
+        buf, lines = self.buf, self.lines
+        lnums = sorted(lines)
+        written = 0
+        for i1, i2 in lineRuns(lnums):
+            a, b = lnums[i1], lnums[i2-1]
+            if i2-i1 == b-a+1:
+                chunk = [lines[ln] for ln in lnums[i1:i2]]
+            else:
+                chunk = buf[a-1:b]
+                for ln in lnums[i1:i2]:
+                    chunk[ln-a] = lines[ln]
+            buf[a-1:b] = chunk
+            self.writes += 1
+            written += b-a+1
+        self.written += written
+        self.lines = {}
+        return written
+
+
+#--- Sort Operations --- {{{2
+# 1) Sort siblings of the current node.
+# - Get list of siblings of the current node (as Tree lnums).
+#   Two nodes are siblings if they have the same parent and the same level.
+# - Construct list of corresponding Tree headlines. Decorate with indexes and
+#   Tree lnums. Sort by headline text.
+# - Construct new Body region from nodes in sorted order. Replace the region.
+#   IMPORTANT: this does not change outline data (Tree, VO.levels, VO.bnodes)
+#   for nodes with smaller levels or for nodes outside of the siblings region.
+#   Thus, recursive sort is possible.
+#
+# 2) Deep (recursive) sort: sort siblings of the current node and siblings in
+# all subnodes. Sort as above for all groups of siblings in the affected
+# region, starting from the most deeply nested.
+# - Construct list of groups of all siblings: top to bottom, decorate each
+#   siblings group with level and parent lnum.
+# - Reverse sort the list by levels.
+# - Do sort for each group of siblings in the list: from right to left and from
+#   bottom to top.
+#
+# 3) We modify only the Body buffer. We then do global outline update to redraw
+# the Tree and to update outline data. Performing targeted update as in other
+# outline operations is too tedious.
+
+
+def sortNodes(VO, siblings, oDeep=False, oIgnorecase=0, oBytes=0, oEnc='utf-8', oReverse=0, oFlip=0, oShuffle=0): #{{{3
+    """Sort siblings (list of Tree lnums in ascending order) and, if oDeep,
+    siblings in all their subnodes. Only Body is modified. Outline must be
+    updated afterwards, e.g. with updateOutline().
+    Return progress flags (flag1,flag2): (got >1 siblings, order changed after sort)
+    """
+    if oShuffle:
+        global shuffle
+        if shuffle is None: from random import shuffle
+    D = {'oIgnorecase':oIgnorecase, 'oBytes':oBytes, 'oEnc':oEnc, 'oReverse':oReverse, 'oFlip':oFlip, 'oShuffle':oShuffle}
+    flag1,flag2 = 0,0
+    if not oDeep:
+        flag1,flag2 = sortSiblings(VO, siblings, **D)
+    else:
+        siblings_groups = getSiblingsGroups(VO,siblings)
+        for group in siblings_groups:
+            m, n = sortSiblings(VO, group, **D)
+            flag1+=m; flag2+=n
+    return (flag1,flag2)
+
+
+def sortSiblings(VO, siblings, oIgnorecase, oBytes, oEnc, oReverse, oFlip, oShuffle): #{{{3
+    """Sort sibling nodes. 'siblings' is list of Tree lnums in ascending order.
+    This only modifies Body buffer. Outline data are not updated.
+    Return progress flags (flag1,flag2), see voom_OopSort().
+    """
+    sibs = siblings
+    if len(sibs) < 2:
+        return (0,0)
+    Body, Tree = VO.Body, VO.Tree
+    bnodes = VO.bnodes
+    z, Z = len(sibs), len(bnodes)
+
+    sibs_dec = [] # list of siblings for sorting
+    if oFlip or oShuffle: # flip or shuffle: Tree headlines don't matter
+        # make list of siblings for sorting
+        #       [(0, index, lnum), ...]
+        for i in xrange(z):
+            sib = sibs[i]
+            sibs_dec.append((0, i, sib))
+        if oFlip:
+            sibs_dec.reverse()
+        elif oShuffle:
+            shuffle(sibs_dec)
+    else: # sort, reverse sort: according to Tree headlines
+        # make list of siblings for sorting, decorate with headline text
+        #       [(Tree headline text, index, lnum), ...]
+        for i in xrange(z):
+            sib = sibs[i]
+            head = Tree[sib-1].split('|',1)[1]
+            if IS_PY2:
+                if not oBytes:
+                    head = unicode(head, oEnc, 'replace')
+            else:
+                if oBytes:
+                    head = bytes(head, oEnc, 'replace')
+            if oIgnorecase:
+                head = head.lower()
+            sibs_dec.append((head, i, sib))
+        if oReverse: # reverse sort
+            sibs_dec.sort(key=lambda x: x[0], reverse=True)
+        else: # sort
+            sibs_dec.sort()
+
+    sibs_sorted = [i[2] for i in sibs_dec]
+    #print(sibs_dec); print(sibs_sorted)
+    # don't sort if already sorted (can happen with shuffle)
+    if sibs==sibs_sorted:
+        return (1,0)
+
+    ### blnum1, blnum2: first and last Body lnums of the affected region
+    blnum1 = bnodes[sibs[0]-1]
+    n = sibs[-1] + nodeSubnodes(VO,sibs[-1])
+    if n < Z:
+        blnum2 = bnodes[n]-1
+    else:
+        blnum2 = len(Body)
+
+    ### construct new Body region
+    blines = []
+    for i in xrange(z):
+        sib = sibs[i]
+        j = sibs_dec[i][1] # index into sibs that points to new sib
+        sib_new = sibs[j]
+
+        # get Body region for sib_new branch
+        bln1 = bnodes[sib_new-1]
+        if j+1 < z:
+            sib_next = sibs[j+1]
+            bln2 = bnodes[sib_next-1]-1
+        else:
+            node_last = sib_new + nodeSubnodes(VO,sib_new)
+            if node_last < Z:
+                bln2 = bnodes[node_last]-1
+            else:
+                bln2 = len(Body)
+
+        blines.extend(Body[bln1-1:bln2])
+
+    ### replace Body region with the new, sorted region
+    body_len = len(Body)
+    Body[blnum1-1:blnum2] = blines
+    assert body_len == len(Body)
+    addWritten(VO, len(blines))
+
+    return (1,1)
+
+
+#---Clipboard---------------------------------{{{1
+# Copy and Cut add copied nodes to CLIPS, a ring of Clip objects. A Clip keeps
+# Body lines and their outline, so Paste does not have to read them back from
+# the clipboard register and parse them again. The Vim adapter knows which Clip
+# is in the register by the register's fingerprint.
+
+# number of Clips kept in CLIPS
+CLIP_RING = 4
+CLIPS = [] # [clip, ...], the most recent first
+
+
+class Clip: #{{{2
+    """Copied nodes.
+    clip.blines -- Body lines.
+    clip.key, clip.outline -- outlineKey() of outline with which blines were
+        parsed and (tlines, bnodes, levels) of blines. None if not parsed.
+    clip.fp -- fingerprint of clipboard register that holds blines, set by
+        the caller. Empty if unknown.
+    clip.pending -- True if blines have not been written to the register.
+    """
+    key = None
+    outline = None
+    fp = ''
+    pending = False
+
+    def __init__(self, blines):
+        self.blines = blines
+
+
+def outlineKey(VO): #{{{2
+    """Return key of what makeOutline() results depend on: markup mode and its
+    settings, see cacheKey().
+    """
+    return (VO.mmode, VO.modeKey, VO.filetype,
+            getattr(VO, 'marker', ''), getattr(VO, 'rstrip_chars', ''))
+
+
+def addClip(clip): #{{{2
+    """Add clip to CLIPS, forget the oldest Clip if there are too many."""
+    CLIPS[0:0] = [clip]
+    del CLIPS[CLIP_RING:]
+    return clip
+
+
+def findClip(fp): #{{{2
+    """Return the most recent Clip with fingerprint fp, or None."""
+    if not fp:
+        return None
+    for clip in CLIPS:
+        if clip.fp == fp:
+            return clip
+    return None
+
+
+def clipNodes(VO, ln1, ln2): #{{{2
+    """Return new Clip with nodes at Tree lnums ln1 to ln2, add it to CLIPS.
+    If markup mode parses each Body line alone (LINE_CONTEXT is 0), outline of
+    the copied lines is taken from VO.
+    """
+    clip = Clip(copyNodes(VO, ln1, ln2))
+    if VO.lineContext == 0:
+        bnodes = VO.bnodes[ln1-1:ln2]
+        shiftBnodes(bnodes, 0, None, 1-bnodes[0])
+        tlines = [' %s' %t[1:] for t in VO.Tree[ln1-1:ln2]]
+        clip.key = outlineKey(VO)
+        clip.outline = (tlines, bnodes, VO.levels[ln1-1:ln2])
+    return addClip(clip)
+
+
+def clipOutline(VO, clip): #{{{2
+    """Return (pBlines, pTlines, pBnodes, pLevels) for pasteNodes() of clip
+    in outline VO. clip.blines are parsed unless they were parsed in the same
+    markup mode with the same settings.
+    """
+    key = outlineKey(VO)
+    if clip.outline is None or not clip.key == key:
+        clip.outline = VO.makeOutline(VO, clip.blines)
+        clip.key = key
+    tlines, bnodes, levels = clip.outline
+    # pasteNodes() modifies pBlines and pBnodes
+    return (clip.blines[:], tlines, bnodes[:], levels)
+
+
+#---Script Execution--------------------------{{{1
+# :Voomexec executes Python script: Body lines bln1-bln2. The script is
+# compiled from AST with line numbers shifted to buffer lnums, tracebacks
+# show buffer lnums. Code objects are cached: an unchanged script is not
+# parsed and compiled again.
+
+# compileScript(): max number of cached code objects
+EXEC_CACHE_SIZE = 32
+# {(buffer number, bln1, bln2): (hash of source, code object), ...}
+EXEC_CACHE = {}
+
+
+def compileScript(blines, bln1, bln2, bnr=0, enc='utf-8'): #{{{2
+    """Return code object for Python script blines, lines bln1-bln2 of buffer
+    number bnr. enc is script encoding (Python 2 str lines). Line numbers in
+    code and SyntaxError are buffer lnums. Filename is '<string>', as exec().
+    """
+    # encoding line, see pep-0263; script starts on line 2
+    src = '# -*- coding: %s -*-\n%s\n' %(enc, '\n'.join(blines))
+    h = hashlib.sha1(src if IS_PY2 else src.encode('utf-8', 'surrogatepass')).digest()
+    key = (bnr, bln1, bln2)
+    cached = EXEC_CACHE.get(key)
+    if cached and cached[0]==h:
+        return cached[1]
+    try:
+        tree = compile(src, '<string>', 'exec', ast.PyCF_ONLY_AST)
+    except SyntaxError:
+        e = sys.exc_info()[1]
+        if e.lineno:
+            e.lineno += bln1-2
+        if getattr(e, 'end_lineno', None):
+            e.end_lineno += bln1-2
+        # "... statement on line 2"
+        if e.msg:
+            e.msg = re.sub(r'\bline (\d+)', lambda m: 'line %s' %(int(m.group(1))+bln1-2), e.msg)
+        # Python 2 traceback module gets lineno from args
+        if IS_PY2 and e.lineno:
+            e.args = (e.msg, (e.filename, e.lineno, e.offset, e.text))
+        raise
+    ast.increment_lineno(tree, bln1-2)
+    code = compile(tree, '<string>', 'exec')
+    if len(EXEC_CACHE) >= EXEC_CACHE_SIZE:
+        EXEC_CACHE.clear()
+    EXEC_CACHE[key] = (h, code)
+    return code
+
+
+def scriptTraceback(bln1, bln2): #{{{2
+    """Return traceback string of exception being handled, raised by script
+    lines bln1-bln2 compiled by compileScript(). Frames of the caller are
+    skipped. Return None if traceback cannot be formatted.
+    """
+    out = None
+    # like traceback.format_exc()
+    try:
+        etype, value, tb = sys.exc_info()
+        # skip frames of the caller and compileScript(), script is '<string>'
+        while tb and tb.tb_frame.f_code.co_filename != '<string>':
+            tb = tb.tb_next
+        out = traceback.format_exception(etype, value, tb)
+    finally:
+        etype = value = tb = None
+    if not out: return None
+    info = '  ...exception executing script (%s-%s)...\n' %(bln1,bln2)
+    # no frames: SyntaxError
+    if not out[0].startswith('Traceback'):
+        out[0:0] = ['Traceback (most recent call last):\n']
+    out[1:1] = [info]
+    return ''.join(out)
+
+
+# :Voomexecbg runs the script in a worker thread, see ScriptJob. The script
+# gets a snapshot of Body lines, not the vim module: it must not touch Vim.
+# Output goes to sys.stdout, which must be thread-safe (PyLog).
+
+
+class ScriptCancelled(BaseException): #{{{2
+    """Raised in the thread of ScriptJob by ScriptJob.cancel()."""
+
+
+class ScriptJob(threading.Thread): #{{{2
+    """Execute code object from compileScript(), script lines bln1-bln2, in a
+    worker thread with globals dict globs. The script can call cancelled() to
+    check if the job was cancelled.
+    When the thread is done: job.error is traceback string or None and
+    job.time is run time.
+    """
+    def __init__(self, code, globs, bln1, bln2):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.code, self.globs = code, globs
+        self.bln1, self.bln2 = bln1, bln2
+        self.error = None
+        self.time = 0
+        self.cancelled = False
+        globs['cancelled'] = lambda: self.cancelled
+
+    def run(self):
+        t = clock()
+        try:
+            exec(self.code, self.globs)
+        except ScriptCancelled:
+            self.error = '  ...script (%s-%s) was cancelled...\n' %(self.bln1,self.bln2)
+        except:
+            self.error = scriptTraceback(self.bln1, self.bln2) or \
+                    'ERROR: Voomexecbg failed to format Python traceback\n'
+        self.time = clock()-t
+
+    def cancel(self):
+        """Cancel the job: set job.cancelled and raise ScriptCancelled in its
+        thread (CPython). A blocking call such as time.sleep() is not
+        interrupted, the exception is raised when it returns.
+        """
+        self.cancelled = True
+        if not self.is_alive(): return
+        try:
+            import ctypes
+            tid = (ctypes.c_long if sys.version_info < (3,7) else ctypes.c_ulong)(self.ident)
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(tid, ctypes.py_object(ScriptCancelled))
+        except (ImportError, AttributeError):
+            pass
+
+
+#---Search (Voomgrep)-------------------------{{{1
+# Vim patterns are translated into Python regexps so that the whole Body can
+# be searched at once. Only patterns with an exact equivalent are translated:
+# magic mode, no multi-line items, no items that depend on Vim options other
+# than 'ignorecase' and 'smartcase'. For all other patterns compileVimRegex()
+# returns None and the caller must use Vim's search().
+# grepNodes() finds the same matches as repeated search() in voom#GrepSearch(),
+# see searchit() in Vim's search.c: with default 'cpoptions' (flag "c") the
+# next search in a line starts at the end of the previous match, one character
+# after an empty match; only the first match is found at the end of line.
+
+
+# Vim character class items: Python equivalent
+VIM_CLASSES = {
+        's': '[ \\t]',          'S': '[^ \\t\\n]',
+        'd': '[0-9]',           'D': '[^0-9\\n]',
+        'w': '[0-9A-Za-z_]',    'W': '[^0-9A-Za-z_\\n]',
+        'h': '[A-Za-z_]',       'H': '[^A-Za-z_\\n]',
+        'a': '[A-Za-z]',        'A': '[^A-Za-z\\n]',
+        'l': '[a-z]',           'L': '[^a-z\\n]',
+        'u': '[A-Z]',           'U': '[^A-Z\\n]',
+        'x': '[0-9A-Fa-f]',     'X': '[^0-9A-Fa-f\\n]',
+        'o': '[0-7]',           'O': '[^0-7\\n]',
+        }
+# Vim escaped characters: Python equivalent
+VIM_CHARS = {'e': '\\x1b', 't': '\\t', 'r': '\\r', 'b': '\\x08'}
+# characters that must be escaped in Python regexp, inside and outside []
+RE_SPECIAL = '.^$*+?{}[]()|\\'
+RE_SPECIAL_SET = '[]^\\-&~|'
+# \< and \> are translated only if text does not match this
+NON_ASCII_RE = re.compile('[^\x00-\x7f]')
+
+
+def compileVimRegex(patt, ignorecase=False, smartcase=False, keyword=True): #{{{2
+    """Translate Vim pattern patt ('magic' is on) into Python regexp and
+    compile it. Matches never span lines.
+    ignorecase, smartcase -- values of Vim options.
+    keyword -- Python \\b is the same as Vim's keyword boundary: 'iskeyword'
+    is the default and the text is ASCII. \\< and \\> can be translated.
+    Return None if patt cannot be translated.
+    """
+    res = []
+    # parse state: 0 at start of branch, 1 after ^ at start of branch,
+    # 2 after atom, 3 after multi
+    state = 0
+    depth = 0 # nesting level of groups
+    # Vim and Python repeat empty matches differently: there must be no multi
+    # after an item that can match empty text. For the top level and each
+    # open group: [all branches have width, branch has width, piece has width]
+    widths = [[True, False, False]]
+    def atom(width):
+        w = widths[-1]
+        w[1] = w[1] or w[2]
+        w[2] = width
+    caseFlag = '' # 'c' or 'C' if there is \c or \C
+    hasUpper = False
+    i, z = 0, len(patt)
+    while i < z:
+        ch = patt[i]
+        i+=1
+        if ch == '\\':
+            if i == z:
+                return None
+            ch = patt[i]
+            i+=1
+            if ch in '(%':
+                if ch == '%':
+                    if patt[i:i+1] != '(':
+                        return None
+                    i+=1
+                    res.append('(?:')
+                else:
+                    res.append('(')
+                depth+=1
+                atom(False)
+                widths.append([True, False, False])
+                state = 0
+            elif ch == ')':
+                depth-=1
+                if depth < 0 or state == 0:
+                    return None
+                res.append(')')
+                w = widths.pop()
+                widths[-1][2] = w[0] and (w[1] or w[2])
+                state = 2
+            elif ch == '|':
+                res.append('|')
+                w = widths[-1]
+                w[0] = w[0] and (w[1] or w[2])
+                w[1] = w[2] = False
+                state = 0
+            elif ch in '+=?{':
+                if state != 2 or not widths[-1][2]:
+                    return None
+                if ch in '=?':
+                    widths[-1][2] = False
+                if ch == '+':
+                    res.append('+')
+                elif ch != '{':
+                    res.append('?')
+                else:
+                    j = patt.find('}', i)
+                    if j < 0:
+                        return None
+                    q = patt[i:j]
+                    i = j+1
+                    if q.endswith('\\'):
+                        q = q[:-1]
+                    lazy = q.startswith('-')
+                    if lazy:
+                        q = q[1:]
+                    if not re.match(r'^(\d*)(,\d*)?$', q):
+                        return None
+                    if not q.split(',')[0].strip('0'):
+                        widths[-1][2] = False
+                    if not q or q == ',':
+                        q = '*'
+                    elif q.startswith(','):
+                        q = '{0%s}' %q
+                    else:
+                        q = '{%s}' %q
+                    if lazy:
+                        q+='?'
+                    res.append(q)
+                state = 3
+            elif ch in '<>':
+                if not keyword:
+                    return None
+                # one atom: a multi applies to all of it
+                res.append(ch == '<' and r'(?:\b(?=\w))' or r'(?:\b(?<=\w))')
+                atom(False)
+                state = 2
+            elif ch in VIM_CLASSES:
+                if ignorecase and ch in 'lLuU':
+                    return None
+                res.append(VIM_CLASSES[ch])
+                atom(True)
+                state = 2
+            elif ch in VIM_CHARS:
+                res.append(VIM_CHARS[ch])
+                atom(True)
+                state = 2
+            elif ch in '123456789':
+                res.append('\\' + ch)
+                atom(False)
+                state = 2
+            elif ch in 'cC':
+                # \c wins if there are both \c and \C
+                if caseFlag != 'c':
+                    caseFlag = ch
+            elif ch == 'm':
+                pass
+            elif ch.isalnum() or ch in '_@&~':
+                # \n \_x \zs \@= \& \v \V etc.
+                return None
+            else:
+                res.append(re.escape(ch))
+                atom(True)
+                state = 2
+        elif ch == '^':
+            if state == 0:
+                res.append('^')
+                state = 1
+            else:
+                res.append('\\^')
+                atom(True)
+                state = 2
+        elif ch == '$':
+            if i == z or patt[i:i+2] in ('\\|', '\\)'):
+                res.append('$')
+                atom(False)
+            else:
+                res.append('\\$')
+                atom(True)
+            state = 2
+        elif ch == '*':
+            if state < 2:
+                res.append('\\*')
+                atom(True)
+                state = 2
+            elif state == 3 or not widths[-1][2]:
+                return None
+            else:
+                res.append('*')
+                widths[-1][2] = False
+                state = 3
+        elif ch == '.':
+            res.append('.')
+            atom(True)
+            state = 2
+        elif ch == '~':
+            return None
+        elif ch == '[':
+            j, coll = parseVimCollection(patt, i)
+            if j < 0:
+                return None
+            if coll is None:
+                # no closing ], [ is literal
+                res.append('\\[')
+            else:
+                res.append(coll)
+                i = j
+                hasUpper = hasUpper or bool(re.search('[A-Z]', coll))
+            atom(True)
+            state = 2
+        else:
+            if ch in RE_SPECIAL:
+                res.append('\\' + ch)
+            else:
+                res.append(ch)
+            hasUpper = hasUpper or ch.isupper()
+            atom(True)
+            state = 2
+    if depth:
+        return None
+
+    if caseFlag:
+        ignorecase = caseFlag == 'c'
+    elif ignorecase and smartcase and hasUpper:
+        ignorecase = False
+    flags = re.M
+    if ignorecase:
+        flags |= re.I
+    try:
+        return re.compile(''.join(res), flags)
+    except (re.error, OverflowError):
+        return None
+
+
+def parseVimCollection(patt, i): #{{{2
+    """Parse Vim collection [] in pattern patt, i is index after "[".
+    Return (index after "]", Python regexp), (i, None) if there is no
+    closing "]", (-1, None) if collection cannot be translated.
+    """
+    res = []
+    z = len(patt)
+    negate = patt[i:i+1] == '^'
+    if negate:
+        i+=1
+    # "]" is literal if it's first
+    if patt[i:i+1] == ']':
+        res.append('\\]')
+        i+=1
+    while i < z:
+        ch = patt[i]
+        i+=1
+        if ch == ']':
+            if negate:
+                res.append('\\n')
+            return i, '[%s%s]' %(negate and '^' or '', ''.join(res))
+        elif ch == '[':
+            # [:alpha:] [=a=] [.a.]
+            if patt[i:i+1] in ':=.':
+                return -1, None
+            res.append('\\[')
+        elif ch == '\\':
+            c = patt[i:i+1]
+            if c in ('\\', ']', '^', '-'):
+                res.append('\\' + c)
+                i+=1
+            elif c and c in VIM_CHARS:
+                res.append(VIM_CHARS[c])
+                i+=1
+            elif c and c in 'ndoxuU':
+                # \n, character codes
+                return -1, None
+            else:
+                # backslash is literal
+                res.append('\\\\')
+        elif ch in RE_SPECIAL_SET and ch != '-':
+            res.append('\\' + ch)
+        else:
+            res.append(ch)
+    return i, None
+
+
+def grepNodes(VO, text, regex): #{{{2
+    """Search Body text (Body lines joined with '\\n') with regexp compiled by
+    compileVimRegex(), find matches like voom#GrepSearch().
+    Return (number of matches, {tlnum: [number of matches in node, Body lnum
+    of first match], ...}). Body lnums of matches are mapped to nodes in one
+    pass over VO.bnodes.
+    """
+    bnodes = VO.bnodes
+    z = len(bnodes)
+    nodes = {}
+    n = 0
+    lnum, pos = 1, 0 # Body lnum at text position pos
+    tln = 0 # Tree lnum of node with Body line lnum
+    bnNext = bnodes[0] if z else 0 # Body lnum of the next node
+    L = None
+    m = regex.search(text)
+    # search() from cursor at 1,1 skips empty match at end of line 1 if
+    # line 1 has one char
+    if m and m.start() == 1 and text[:1] != '\n' and text[1:2] in ('\n', ''):
+        m = regex.search(text, 2) if len(text) > 1 else None
+    while m:
+        s = m.start()
+        lnum += text.count('\n', pos, s)
+        pos = s
+        n+=1
+        if lnum >= bnNext > 0:
+            while tln < z and bnodes[tln] <= lnum:
+                tln+=1
+            bnNext = bnodes[tln] if tln < z else 0
+            L = nodes[tln] = [1, lnum]
+        elif L is not None:
+            L[0]+=1
+        # next search: from end of match, after empty match, next line
+        eol = text.find('\n', s)
+        if eol < 0:
+            eol = len(text)
+        e = m.end()
+        if e == s:
+            e+=1
+        if e >= eol:
+            if eol == len(text):
+                break
+            e = eol+1
+        m = regex.search(text, e)
+    return (n, nodes)
+
+
+# modelines {{{1
+# vim:fdm=marker:fdl=0:
+# vim:foldtext=getline(v\:foldstart).'...'.(v\:foldend-v\:foldstart):
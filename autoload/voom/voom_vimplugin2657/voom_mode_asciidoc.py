@@ -23,12 +23,10 @@ See |voom-mode-asciidoc|,   ../../../doc/voom.txt#*voom-mode-asciidoc*
 
 try:
     import vim
-    if vim.eval('exists("g:voom_asciidoc_do_blanks")')=='1' and vim.eval("g:voom_asciidoc_do_blanks")=='0':
-        DO_BLANKS = False
-    else:
-        DO_BLANKS = True
 except ImportError:
-    DO_BLANKS = True
+    vim = None
+
+import voom_vimplugin2657.voom_core as voom_core
 
 import sys
 if sys.version_info[0] > 2:
@@ -63,11 +61,21 @@ for k in BLOCK_CHARS:
     CHARS[k] = 0
 #---------------------------------------------------------------------
 
+# Vim variable g:voom_asciidoc_do_blanks, see voom_core.setModeState()
+SETTINGS = {'asciidoc_do_blanks': 1}
+
+
+def makeState(settings):
+    """Return VO.modeState for settings, see SETTINGS."""
+    return {'DO_BLANKS': str(settings['asciidoc_do_blanks']) != '0'}
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
     """
     ENC = VO.enc
+    DO_BLANKS = VO.modeState['DO_BLANKS']
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
@@ -255,6 +263,7 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
     Z = len(Body)
     bnodes, levels = VO.bnodes, VO.levels
     ENC = VO.enc
+    DO_BLANKS = VO.modeState['DO_BLANKS']
 
     # blnum1 blnum2 is first and last lnums of Body region pasted, inserted
     # during up/down, or promoted/demoted.
@@ -318,6 +327,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
     #            L3            L3             Body[bln+1]
 
     if levDelta or oop=='paste':
+        # Bnodes below node i are not used in this loop: update them after it.
+        shifts = []
         for i in xrange(tlnum2, tlnum1-1, -1):
             # required level (VO.levels has been updated)
             lev = levels[i-1]
@@ -404,7 +415,7 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                 Body[bln-1] = L1
                 # insert underline
                 Body[bln:bln] = [LEVELS_ADS[lev] * len_u(L1, ENC)]
-                update_bnodes(VO, i+1, 1)
+                shifts.append((i, 1))
                 b_delta+=1
             # remove underline, insert ='s
             elif useOne and not hasOne:
@@ -414,8 +425,9 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                     Body[bln-1] = '%s %s' %('='*lev, theHead.strip())
                 # delete underline
                 Body[bln:bln+1] = []
-                update_bnodes(VO, i+1, -1)
+                shifts.append((i, -1))
                 b_delta-=1
+        voom_core.shiftBnodesMany(bnodes, shifts)
 
     ### Make sure first headline is preceded by a blank line.
     blnum1 = bnodes[tlnum1-1]
@@ -439,7 +451,6 @@ def update_bnodes(VO, tlnum, delta):
     starting with bnode at tlnum and to the end.
     """
     bnodes = VO.bnodes
-    for i in xrange(tlnum, len(bnodes)+1):
-        bnodes[i-1] += delta
+    bnodes[tlnum-1:] = [b+delta for b in bnodes[tlnum-1:]]
 
 
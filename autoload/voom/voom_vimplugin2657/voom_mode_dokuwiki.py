@@ -14,7 +14,9 @@ See |voom-mode-dokuwiki|,  ../../../doc/voom.txt#*voom-mode-dokuwiki*
 try:
     import vim
 except ImportError:
-    pass
+    vim = None
+
+import voom_vimplugin2657.voom_core as voom_core
 
 import sys
 if sys.version_info[0] > 2:
@@ -23,12 +25,18 @@ if sys.version_info[0] > 2:
 import re
 
 headline_match = re.compile(r'^( ?| \t[ \t]*)(={2,})(.+?)(={2,})[ \t]*$').match
+# The same regexp for all Body lines joined, see voom_core.makeOutlineScan().
+HEADLINE_SCAN = re.compile(r'\n( ?| \t[ \t]*)(={2,})(.+?)(={2,})[ \t]*$', re.M)
 # Marker character that denotes a headline in the regexp above.
 CHAR = '='
 # The maximum possible level.
 # The number of leading marker characters for level 1 headline is MAX+1 or more.
 MAX = 5
 
+
+LINE_CONTEXT = 0
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
@@ -56,6 +64,17 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m."""
+    n = len(m.group(2))
+    if n > MAX:
+        lev = 1
+    else:
+        lev = MAX - n + 2
+    head = m.group(3).strip()
+    return (lev, '  %s|%s' %('. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
@@ -130,8 +149,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
 
     ### --- the end ---
     if invalid_levs:
-        vim.command("call voom#ErrorMsg('VOoM (dokuwiki): Disallowed levels have been corrected after ''%s''')" %oop)
+        voom_core.errorMsg("VOoM (dokuwiki): Disallowed levels have been corrected after '%s'" %oop)
         invalid_levs = ', '.join(['%s' %i for i in invalid_levs])
-        vim.command("call voom#ErrorMsg('     level set to maximum (%s) for nodes: %s')" %(MAX, invalid_levs))
+        voom_core.errorMsg('     level set to maximum (%s) for nodes: %s' %(MAX, invalid_levs))
 
 
@@ -14,4 +14,5 @@ This is the default or "fmr" mode. This module changes absolutely nothing.
 # Define this mode as an 'fmr' mode.
 MTYPE = 0
 
+LINE_CONTEXT = 0
 
@@ -17,6 +17,8 @@ some text
 more text
 """
 
+import voom_vimplugin2657.voom_core as voom_core
+
 import sys
 if sys.version_info[0] > 2:
     xrange = range
@@ -24,16 +26,25 @@ if sys.version_info[0] > 2:
 # Define this mode as an 'fmr' mode.
 MTYPE = 0
 
+# hook_makeOutline() takes argument flags, see voom_core.makeOutlineFlags().
+FLAGS_ARG = True
+
+
+LINE_CONTEXT = 0
+
 
-def hook_makeOutline(VO, blines):
+def hook_makeOutline(VO, blines, flags=None):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
+    Node flags are appended to bytearray flags if it is given.
     """
     marker = VO.marker
     marker_re_search = VO.marker_re.search
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    flags_add = flags is not None and flags.append
+    marker_flags = voom_core.markerFlags
     #c = VO.rstrip_chars
     for i in xrange(Z):
         if not marker in blines[i]: continue
@@ -53,6 +64,8 @@ def hook_makeOutline(VO, blines):
         tlines_add(tline)
         bnodes_add(i+1)
         levels_add(lev)
+        if flags_add:
+            flags_add(marker_flags(bline, m))
     return (tlines, bnodes, levels)
 
 
@@ -25,6 +25,11 @@ CHAR = '#'
 
 # Use this if whitespace after marker chars is optional.
 headline_match = re.compile(r'^(%s+)' %re.escape(CHAR)).match
+# Regexp for all Body lines joined, see voom_core.makeOutlineScan().
+HEADLINE_SCAN = re.compile(r'\n(%s+).*' %re.escape(CHAR))
+
+LINE_CONTEXT = 0
+
 
 # Use this if a whitespace is required after marker chars (as in org-mode).
 #headline_match = re.compile(r'^(%s+)\s' %re.escape(CHAR)).match
@@ -54,6 +59,13 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m."""
+    lev = len(m.group(1))
+    head = m.group(0)[1+lev:].strip()
+    return (lev, '  %s|%s' %('. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
@@ -28,6 +28,9 @@ headline_search = re.compile(r'<\s*h(\d+).*?>(.*?)</h(\1)\s*>', re.IGNORECASE).s
 html_tag_sub = re.compile('<.*?>').sub
 
 
+LINE_CONTEXT = 0
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
@@ -20,6 +20,7 @@ module-level constants CHAR and MAX below.
 You can also change them by adding options to .vimrc:
     let g:voom_inverseAtx_char = '^'
     let g:voom_inverseAtx_max = 5
+or for one Body with buffer variables b:voom_inverseAtx_char, etc.
 
 """
 
@@ -30,12 +31,10 @@ MAX = 3
 
 try:
     import vim
-    if vim.eval('exists("g:voom_inverseAtx_char")')=='1':
-        CHAR = vim.eval("g:voom_inverseAtx_char")
-    if vim.eval('exists("g:voom_inverseAtx_max")')=='1':
-        MAX = int(vim.eval("g:voom_inverseAtx_max"))
 except ImportError:
-    pass
+    vim = None
+
+import voom_vimplugin2657.voom_core as voom_core
 
 import sys
 if sys.version_info[0] > 2:
@@ -43,11 +42,24 @@ if sys.version_info[0] > 2:
 
 import re
 
-# Use this if whitespace after marker chars is optional.
-headline_match = re.compile(r'^(%s+)' %re.escape(CHAR)).match
+# Vim variables g:voom_inverseAtx_char, etc., see voom_core.setModeState()
+SETTINGS = {'inverseAtx_char': CHAR, 'inverseAtx_max': MAX}
+
+
+def makeState(settings):
+    """Return VO.modeState for settings, see SETTINGS."""
+    char = settings['inverseAtx_char']
+    S = {'CHAR': char, 'MAX': int(settings['inverseAtx_max'])}
+    # Use this if whitespace after marker chars is optional.
+    S['headline_match'] = re.compile(r'^(%s+)' %re.escape(char)).match
+    # Use this if a whitespace is required after marker chars.
+    #S['headline_match'] = re.compile(r'^(%s+)\s' %re.escape(char)).match
+    # Regexp for all Body lines joined, see voom_core.makeOutlineScan().
+    S['HEADLINE_SCAN'] = re.compile(r'\n(%s+).*' %re.escape(char))
+    return S
+
 
-# Use this if a whitespace is required after marker chars.
-#headline_match = re.compile(r'^(%s+)\s' %re.escape(CHAR)).match
+LINE_CONTEXT = 0
 
 
 # based on voom_mode_hashes.py
@@ -55,6 +67,8 @@ def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
     """
+    S = VO.modeState
+    CHAR, MAX, headline_match = S['CHAR'], S['MAX'], S['headline_match']
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
@@ -80,12 +94,26 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m."""
+    S = VO.modeState
+    MAX = S['MAX']
+    n = len(m.group(1))
+    if n >= MAX:
+        lev = 1
+    else:
+        lev = MAX - n + 1
+    head = m.group(0)[1:].lstrip(S['CHAR']).strip()
+    return (lev, '  %s|%s' %('. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
     bodyLines is list of lines to insert in Body buffer.
     """
     tree_head = 'NewHeadline'
+    CHAR, MAX = VO.modeState['CHAR'], VO.modeState['MAX']
     if level >= MAX:
         n = 1
     else:
@@ -120,6 +148,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
     Body = VO.Body
     Z = len(Body)
     bnodes, levels = VO.bnodes, VO.levels
+    S = VO.modeState
+    CHAR, MAX, headline_match = S['CHAR'], S['MAX'], S['headline_match']
 
     # blnum1 blnum2 is first and last lnums of Body region pasted, inserted
     # during up/down, or promoted/demoted.
@@ -167,8 +197,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
 
     ### --- the end ---
     if invalid_levs:
-        vim.command("call voom#ErrorMsg('VOoM (inverseAtx): Disallowed levels have been corrected after ''%s''')" %oop)
+        voom_core.errorMsg("VOoM (inverseAtx): Disallowed levels have been corrected after '%s'" %oop)
         invalid_levs = ', '.join(['%s' %i for i in invalid_levs])
-        vim.command("call voom#ErrorMsg('     level set to maximum (%s) for nodes: %s')" %(MAX, invalid_levs))
+        voom_core.errorMsg('     level set to maximum (%s) for nodes: %s' %(MAX, invalid_levs))
 
 
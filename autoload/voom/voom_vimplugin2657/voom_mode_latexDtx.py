@@ -28,6 +28,7 @@ See |voom-mode-latexDtx|,  ../../../doc/voom.txt#*voom-mode-latexDtx*
 #   g:voom_latexdtx_sections
 #   g:voom_latexdtx_elements
 #   g:voom_latexdtx_verbatims
+# Buffer variables b:voom_latexdtx_sections, etc., override them for one Body.
 #
 # SECTIONS defines sectioning commands, in order of increasing level:
 #     \part{A Heading}
@@ -67,14 +68,10 @@ VERBATIMS = ['verbatim', 'comment', 'macrocode']
 
 try:
     import vim
-    if vim.eval('exists("g:voom_latexdtx_sections")')=='1':
-        SECTIONS = vim.eval("g:voom_latexdtx_sections")
-    if vim.eval('exists("g:voom_latexdtx_elements")')=='1':
-        ELEMENTS = vim.eval("g:voom_latexdtx_elements")
-    if vim.eval('exists("g:voom_latexdtx_verbatims")')=='1':
-        VERBATIMS = vim.eval("g:voom_latexdtx_verbatims")
 except ImportError:
-    pass
+    vim = None
+
+import voom_vimplugin2657.voom_core as voom_core
 
 import sys
 if sys.version_info[0] > 2:
@@ -82,36 +79,55 @@ if sys.version_info[0] > 2:
 
 import re
 
-# \section{head}  or  \section*{head}  or  \section[optionaltitle]{head}
-# NOTE: match leading whitespace to preserve it during outline operations
-#                 m.group()    1      2                    3
-SECTS_RE = re.compile(r'^[\s%%]*\\(%s)\s*(\*|\[[^]{]*\])?\s*\{(.*)' %('|'.join(SECTIONS))).match
+# Vim variables g:voom_latexdtx_sections, etc., see voom_core.setModeState()
+SETTINGS = {'latexdtx_sections': SECTIONS,
+            'latexdtx_elements': ELEMENTS,
+            'latexdtx_verbatims': VERBATIMS}
 
-if ELEMENTS:
-    ELEMS_RE = re.compile(ELEMENTS).match
-else:
-    ELEMS_RE = 0
 
-if VERBATIMS:
-    # NOTE: leading whitespace and % must be lstripped before matching
-    VERBS_RE = re.compile(r'^\\begin\s*\{(%s)\}' %('|'.join(VERBATIMS))).match
-else:
-    VERBS_RE = 0
+def makeState(settings):
+    """Return dict with compiled regexps and sections for settings, see
+    SETTINGS. It is VO.modeState.
+    """
+    sections = settings['latexdtx_sections']
+    elements = settings['latexdtx_elements']
+    verbatims = settings['latexdtx_verbatims']
+    S = {}
+
+    # \section{head}  or  \section*{head}  or  \section[optionaltitle]{head}
+    # NOTE: match leading whitespace to preserve it during outline operations
+    #                 m.group()    1      2                    3
+    S['SECTS_RE'] = re.compile(r'^[\s%%]*\\(%s)\s*(\*|\[[^]{]*\])?\s*\{(.*)' %('|'.join(sections))).match
+
+    if elements:
+        S['ELEMS_RE'] = re.compile(elements).match
+    else:
+        S['ELEMS_RE'] = 0
 
-SECTIONS = ['\\'+s for s in SECTIONS]
-SECTS_LEVS = {} # {section: its default level, ...}
-LEVS_SECTS = {} # {level: its default section, ...}
-i = 1
-for s in SECTIONS:
-    SECTS_LEVS[s] = i
-    LEVS_SECTS[i] = s
-    i+=1
+    if verbatims:
+        # NOTE: leading whitespace and % must be lstripped before matching
+        S['VERBS_RE'] = re.compile(r'^\\begin\s*\{(%s)\}' %('|'.join(verbatims))).match
+    else:
+        S['VERBS_RE'] = 0
+
+    S['SECTIONS'] = ['\\'+s for s in sections]
+    S['SECTS_LEVS'] = {} # {section: its default level, ...}
+    S['LEVS_SECTS'] = {} # {level: its default section, ...}
+    i = 1
+    for s in S['SECTIONS']:
+        S['SECTS_LEVS'][s] = i
+        S['LEVS_SECTS'][i] = s
+        i+=1
+    return S
 
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
     """
+    S = VO.modeState
+    SECTS_RE, ELEMS_RE, VERBS_RE = S['SECTS_RE'], S['ELEMS_RE'], S['VERBS_RE']
+    SECTS_LEVS = S['SECTS_LEVS']
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
@@ -207,10 +223,10 @@ def hook_newHeadline(VO, level, blnum, tlnum):
     bodyLines is list of lines to insert in Body buffer.
     """
     tree_head = 'NewHeadline'
-    (sect, lev) = get_sect_for_lev(VO._levs_sects, level)
+    (sect, lev) = get_sect_for_lev(VO.modeState, VO._levs_sects, level)
     assert lev <= level
     if not lev==level:
-        vim.command("call voom#ErrorMsg('VOoM (latexDtx): MAXIMUM LEVEL EXCEEDED')")
+        voom_core.errorMsg('VOoM (latexDtx): MAXIMUM LEVEL EXCEEDED')
 
     bodyLines = ['%% %s{%s}' %(sect, tree_head), '%']  # dtx-specific (insert %)
     return (tree_head, bodyLines)
@@ -256,6 +272,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
     #   use 1 for fixed elements at level >1
     invalid_sects, invalid_elems = [], [] # tree lnums of nodes with disallowed levels
     levs_sects = VO._levs_sects
+    S = VO.modeState
+    SECTS_RE, ELEMS_RE = S['SECTS_RE'], S['ELEMS_RE']
     #for i in xrange(tlnum2, tlnum1-1, -1):
     for i in xrange(tlnum1, tlnum2+1):
         # required level based on new VO.levels, can be disallowed
@@ -276,7 +294,7 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
         # current section
         sect_ = '\\' + m.group(1)
         # required section and its actual level
-        (sect, lev) = get_sect_for_lev(levs_sects, lev_)
+        (sect, lev) = get_sect_for_lev(S, levs_sects, lev_)
         # change section (NOTE: SECTS_RE matches after \, thus -1)
         if not sect == sect_:
             Body[bln-1] = '%s%s%s' %(L[:m.start(1)-1], sect, L[m.end(1):])
@@ -290,20 +308,21 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
 
     ### --- the end ---
     if invalid_elems or invalid_sects:
-        vim.command("call voom#ErrorMsg('VOoM (latexDtx): Disallowed levels have been corrected after ''%s''')" %oop)
+        voom_core.errorMsg("VOoM (latexDtx): Disallowed levels have been corrected after '%s'" %oop)
         if invalid_elems:
             invalid_elems = ', '.join(['%s' %i for i in invalid_elems])
-            vim.command("call voom#ErrorMsg('              level set to 1 for nodes: %s')" %invalid_elems)
+            voom_core.errorMsg('              level set to 1 for nodes: %s' %invalid_elems)
         if invalid_sects:
             invalid_sects = ', '.join(['%s' %i for i in invalid_sects])
-            vim.command("call voom#ErrorMsg('              level set to maximum for nodes: %s')" %invalid_sects)
+            voom_core.errorMsg('              level set to maximum for nodes: %s' %invalid_sects)
 
 
-def get_sect_for_lev(levs_sects, level):
+def get_sect_for_lev(S, levs_sects, level):
     """Return (section, actual level) corresponding to the desired level.
-    levs_sects contains all sections currently in use.
+    S is VO.modeState. levs_sects contains all sections currently in use.
     If level exceeds the maximum, return section for maximum possible level and max level.
     """
+    SECTIONS, SECTS_LEVS = S['SECTIONS'], S['SECTS_LEVS']
 
     if level in levs_sects:
         return (levs_sects[level], level)
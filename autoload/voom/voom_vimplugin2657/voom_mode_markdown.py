@@ -10,6 +10,8 @@ VOoM markup mode for Markdown headers.
 See |voom-mode-markdown|,   ../../../doc/voom.txt#*voom-mode-markdown*
 """
 
+import voom_vimplugin2657.voom_core as voom_core
+
 import sys
 if sys.version_info[0] > 2:
     xrange = range
@@ -204,6 +206,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
     #            L3            L3             Body[bln+1]
 
     if levDelta or oop=='paste':
+        # Bnodes below node i are not used in this loop: update them after it.
+        shifts = []
         for i in xrange(tlnum2, tlnum1-1, -1):
             # required level (VO.levels has been updated)
             lev = levels[i-1]
@@ -280,7 +284,7 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                 Body[bln-1] = L
                 # insert underline
                 Body[bln:bln] = [LEVELS_ADS[lev] * len_u(L, ENC)]
-                update_bnodes(VO, i+1, 1)
+                shifts.append((i, 1))
                 b_delta+=1
             # remove underline, insert hashes
             elif useHash and not hasHash:
@@ -304,8 +308,9 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                 # no: delete underline
                 else:
                     Body[bln:bln+1] = []
-                    update_bnodes(VO, i+1, -1)
+                    shifts.append((i, -1))
                     b_delta-=1
+        voom_core.shiftBnodesMany(bnodes, shifts)
 
     ### Make sure first headline is preceded by a blank line.
     blnum1 = bnodes[tlnum1-1]
@@ -329,7 +334,6 @@ def update_bnodes(VO, tlnum, delta):
     starting with bnode at tlnum and to the end.
     """
     bnodes = VO.bnodes
-    for i in xrange(tlnum, len(bnodes)+1):
-        bnodes[i-1] += delta
+    bnodes[tlnum-1:] = [b+delta for b in bnodes[tlnum-1:]]
 
 
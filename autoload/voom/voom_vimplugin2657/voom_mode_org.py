@@ -16,6 +16,11 @@ if sys.version_info[0] > 2:
 
 import re
 headline_match = re.compile(r'^(\*+)\s').match
+# the same for all Body lines joined, see voom_core.makeOutlineScan()
+HEADLINE_SCAN = re.compile(r'\n(\*+)[^\S\n].*')
+
+
+LINE_CONTEXT = 0
 
 
 def hook_makeOutline(VO, blines):
@@ -41,6 +46,13 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m."""
+    lev = len(m.group(1))
+    head = m.group(0)[1+lev:].strip()
+    return (lev, '  %s|%s' %('. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
@@ -26,6 +26,9 @@ if sys.version_info[0] > 2:
 MTYPE = 2
 
 
+LINE_CONTEXT = 1 # headline status of a line depends on the line above it
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
@@ -135,8 +138,7 @@ def update_bnodes(VO, tlnum, delta):
     starting with bnode at tlnum and to the end.
     """
     bnodes = VO.bnodes
-    for i in xrange(tlnum, len(bnodes)+1):
-        bnodes[i-1] += delta
+    bnodes[tlnum-1:] = [b+delta for b in bnodes[tlnum-1:]]
 
 
 
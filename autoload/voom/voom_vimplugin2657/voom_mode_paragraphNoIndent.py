@@ -22,6 +22,10 @@ MTYPE = 2
 
 whitespace = ('\t', ' ')
 
+
+LINE_CONTEXT = 0
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
@@ -20,6 +20,8 @@ http://docs.python.org/documenting/rest.html#sections
 Python recommended styles:   ##  **  =  -  ^  "
 """
 
+import voom_vimplugin2657.voom_core as voom_core
+
 import sys
 if sys.version_info[0] > 2:
     xrange = range
@@ -240,6 +242,8 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                 ad = get_new_ad(levels_ads, ads_levels, lev)
                 levels_ads[lev] = ad
                 ads_levels[ad] = lev
+        # Bnodes below node i are not used in this loop: update them after it.
+        shifts = []
         for i in xrange(tlnum2, tlnum1-1, -1):
             # required level (VO.levels has been updated)
             lev = levels[i-1]
@@ -271,7 +275,7 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                     Body[bln] = ad[0]*len(L2)
                 # insert overline; current bnode doesn't change
                 Body[bln-1:bln-1] = [ad[0]*len(L2)]
-                update_bnodes(VO, i+1, 1)
+                shifts.append((i, 1))
                 b_delta+=1
             elif len(ad_)==2 and len(ad)==1:
                 # change underline if different
@@ -289,13 +293,14 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
                 # delete overline; current bnode doesn't change
                 if not L0:
                     Body[bln-1:bln] = []
-                    update_bnodes(VO, i+1, -1)
+                    shifts.append((i, -1))
                     b_delta-=1
                 # there is no blank before overline
                 # change overline to blank; only current bnode needs updating
                 else:
                     Body[bln-1] = ''
                     bnodes[i-1]+=1
+        voom_core.shiftBnodesMany(bnodes, shifts)
 
     ### Prevent loss of first headline: make sure it is preceded by a blank line
     blnum1 = bnodes[tlnum1-1]
@@ -319,8 +324,7 @@ def update_bnodes(VO, tlnum, delta):
     starting with bnode at tlnum and to the end.
     """
     bnodes = VO.bnodes
-    for i in xrange(tlnum, len(bnodes)+1):
-        bnodes[i-1] += delta
+    bnodes[tlnum-1:] = [b+delta for b in bnodes[tlnum-1:]]
 
 
 def get_new_ad(levels_ads, ads_levels, level):
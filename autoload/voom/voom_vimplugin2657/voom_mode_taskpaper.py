@@ -18,6 +18,10 @@ import re
 # match for Project line, as in syntax/taskpaper.vim
 project_match = re.compile(r'^.+:(\s+@[^ \t(]+(\([^)]*\))?)*$').match
 
+
+LINE_CONTEXT = 0
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
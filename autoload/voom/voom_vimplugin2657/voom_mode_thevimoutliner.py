@@ -24,6 +24,9 @@ if sys.version_info[0] > 2:
 # Body lines start with these chars
 BODY_CHARS = {'|':0,}
 
+LINE_CONTEXT = 0
+
+
 # ------ the rest is identical to voom_mode_vimoutliner.py -------------------
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
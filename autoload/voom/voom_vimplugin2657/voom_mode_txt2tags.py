@@ -25,6 +25,11 @@ headline1_match = re.compile(r'^ *(=+)([^=].*[^=]|[^=])(\1)(\[[\w-]*\])?\s*$').m
 # +++ headline +++[optional-label]
 headline2_match = re.compile(r'^ *(\++)([^+].*[^+]|[^+])(\1)(\[[\w-]*\])?\s*$').match
 
+# Regexp for all Body lines joined, see voom_core.makeOutlineScan(). Matches
+# either an Area (Verbatim/Raw/Tagged/Comment) with its closing tag, or to the
+# end of Body if there is none, or a line that can be a headline.
+HEADLINE_SCAN = re.compile(r'\n(?:(```|"""|\'\'\'|%%%)[^\S\n]*$(?:\n.*)*?(?:\n\1[^\S\n]*$|\Z)| *[=+].*)', re.M)
+
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
@@ -71,6 +76,24 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m or None."""
+    if m.group(1):
+        return None
+    bline = m.group(0)[1:].lstrip(' ')
+    if bline.startswith('='):
+        m = headline1_match(bline)
+        X = ' '
+    else:
+        m = headline2_match(bline)
+        X = '+'
+    if not m:
+        return None
+    lev = len(m.group(1))
+    head = m.group(2).strip()
+    return (lev, ' %s%s|%s' %(X, '. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
@@ -22,6 +22,9 @@ if sys.version_info[0] > 2:
 BODY_CHARS = {':':0, ';':0, '|':0, '<':0, '>':0,}
 
 
+LINE_CONTEXT = 0
+
+
 #-------------copy/pasted from voom_mode_thevimoutliner.py -------------------
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
@@ -24,6 +24,12 @@ if sys.version_info[0] > 2:
 
 import re
 headline_match = re.compile(r'^\s*(=+).+(\1)\s*$').match
+# Lines that can be headlines in all Body lines joined, see
+# voom_core.makeOutlineScan(). They are checked with headline_match().
+HEADLINE_SCAN = re.compile(r'\n[^\S\n]*=.*')
+
+
+LINE_CONTEXT = 0
 
 
 def hook_makeOutline(VO, blines):
@@ -50,6 +56,17 @@ def hook_makeOutline(VO, blines):
     return (tlines, bnodes, levels)
 
 
+def hook_scanHeadline(VO, m):
+    """Return (level, Tree line) for HEADLINE_SCAN match m or None."""
+    bline = m.group(0)[1:].strip()
+    m = headline_match(bline)
+    if not m:
+        return None
+    lev = len(m.group(1))
+    head = bline[lev:-lev].strip()
+    return (lev, '  %s|%s' %('. '*(lev-1), head))
+
+
 def hook_newHeadline(VO, level, blnum, tlnum):
     """Return (tree_head, bodyLines).
     tree_head is new headline string in Tree buffer (text after |).
@@ -9,16 +9,27 @@
 """This module is meant to be imported by voom.vim ."""
 
 import vim
-import sys, os, re
+import sys, os
 import traceback
 import bisect
-# lazy imports
-shuffle = None # random.shuffle
+import threading, collections
+
+# Outline data and operations that don't need Vim are in voom_core.py.
+# Names are imported here for add-ons and for backward compatibility.
+import voom_vimplugin2657.voom_core as voom_core
+from voom_vimplugin2657.voom_core import MAKE_HEAD, MARKER, MARKER_RE, \
+        makeOutline, makeOutlineH, \
+        nodeHasChildren, nodeSubnodes, nodeParent, nodeAncestors, nodeUNL, \
+        nodeSiblings, rangeSiblings, getSiblingsGroups, nodesBodyRange, \
+        setLevTreeLines, changeLevBodyHead, newHeadline, sortSiblings, \
+        LineEdits, getLines, markerFlags, getNodeFlags, \
+        FLAG_MARKED, FLAG_OPENED, FLAG_STARTUP
 
 PY_VERSION = sys.version_info[0]
 IS_PY2 = PY_VERSION==2
 if PY_VERSION > 2:
     xrange = range
+    basestring, long = str, int
 
 #Vim = sys.modules['__main__']
 
@@ -33,13 +44,6 @@ if PY_VERSION > 2:
 # VOOMS is created in autoload/voom.vim: less disruption if this module is reloaded.
 #VOOMS = {} # {body: VO, ...}
 
-# {filetype: make_head_<filetype> function, ...}
-MAKE_HEAD = {}
-
-# default start fold marker string and regexp
-MARKER = '{{{'                            #}}}
-MARKER_RE = re.compile(r'{{{(\d*[1-9]\d*)(x?)')   #}}}
-
 # {'markdown': 'markdown', 'tex': 'latex', ...}
 if vim.eval("exists('g:voom_ft_modes')")=='1':
     FT_MODES = vim.eval('g:voom_ft_modes')
@@ -66,17 +70,172 @@ else:
     ALWAYS_ALLOW_MOVE_LEFT = False
 
 
+#---Vim Calls--------------------------------{{{1
+# Each vim.eval() and vim.command() is a round trip to Vim. Python code for Vim
+# functions gets all Vim variables it needs with one vimGet() and sets all
+# result variables with one vimLet().
+#
+# VIM_CALLS counts runs and Vim calls (vimEval(), vimCommand()) of voom_*()
+# functions called from Vim: {function name: [runs, Vim calls], ...}.
+# It is shown by ":Voominfo all".
+#
+# Run times of voom_Oop*() functions and voom_Grep() are added to counters of
+# the outline, see voom_core.addTime().
+#
+# PROFILING is set by ":Voomprofile start" and reset by ":Voomprofile stop".
+# While it is set, the outermost voom_*() function is run under cProfile and
+# stats are added to PROFILES, see profileCall().
+
+VIM_CALLS = {}
+# total number of Vim calls, number of voom_*() functions being executed,
+# Body bufnr got by vimGet() in the outermost function (see callerBody())
+_vimCalls = [0, 0, '0']
+PROFILING = False
+# {(markup mode, function name): [runs, pstats.Stats], ...}
+PROFILES = {}
+
+
+def vimEval(expr): #{{{2
+    _vimCalls[0]+=1
+    return vim.eval(expr)
+
+
+def vimCommand(*cmds): #{{{2
+    """Execute Vim commands with one vim.command(). The commands are joined
+    with "|" and thus must not include :normal.
+    """
+    _vimCalls[0]+=1
+    vim.command(' | '.join(cmds))
+
+
+def vimGet(*exprs): #{{{2
+    """Evaluate Vim expressions, usually names of Vim variables, with one
+    vim.eval(). Return list of values: strings, lists, dicts.
+    """
+    _vimCalls[0]+=1
+    values = vim.eval('[%s]' %','.join(exprs))
+    if exprs[0] in ('l:body', 'a:body'):
+        _vimCalls[2] = values[0]
+    return values
+
+
+def vimLet(**kwargs): #{{{2
+    """Set Vim local variables with one vim.command():
+        vimLet(blnShow=5, pyOK=1)
+    Values are ints, strings, or lists of them.
+    """
+    names = sorted(kwargs)
+    vimCommand('let [%s]=[%s]' %(','.join(['l:'+n for n in names]),
+            ','.join([vimLiteral(kwargs[n]) for n in names])))
+
+
+def vimLiteral(v): #{{{2
+    """Return Vim literal for Python int, float, string, list, or dict.
+    True and False are 1 and 0. Raise TypeError for None and other types.
+    """
+    if isinstance(v, bool):
+        return v and '1' or '0'
+    elif v is None:
+        raise TypeError('vimLiteral(): no Vim literal for None')
+    elif isinstance(v, (list, tuple)):
+        return '[%s]' %','.join([vimLiteral(i) for i in v])
+    elif isinstance(v, dict):
+        return '{%s}' %','.join(['%s:%s' %(vimLiteral(k), vimLiteral(v[k])) for k in sorted(v)])
+    elif isinstance(v, float):
+        return '%.6f' %v
+    elif isinstance(v, (int, long)):
+        return '%s' %v
+    elif not isinstance(v, basestring):
+        raise TypeError('vimLiteral(): no Vim literal for %s' %type(v).__name__)
+    return "'%s'" %v.replace("'", "''")
+
+
+def errorMsgs(msgs): #{{{2
+    """Show error messages of markup modes, see voom_core.errorMsg()."""
+    vimCommand(*['call voom#ErrorMsg(%s)' %vimLiteral(m) for m in msgs])
+
+voom_core.ERROR_MSG = errorMsgs
+
+
+def countVimCalls(f): #{{{2
+    """Decorator for voom_*() functions called from Vim: count runs and Vim
+    calls in VIM_CALLS. Calls of nested voom_*() functions are counted only
+    for the outermost function.
+    """
+    name = f.__name__
+    timed = name.startswith('voom_Oop') or name=='voom_Grep'
+    def wrapper(*args, **kwargs):
+        if _vimCalls[1]:
+            return f(*args, **kwargs)
+        n = _vimCalls[0]
+        _vimCalls[1] = 1
+        _vimCalls[2] = '0'
+        t = voom_core.clock()
+        try:
+            if PROFILING:
+                return profileCall(f, args, kwargs)
+            return f(*args, **kwargs)
+        finally:
+            _vimCalls[1] = 0
+            stat = VIM_CALLS.setdefault(name, [0, 0])
+            stat[0]+=1
+            stat[1]+= _vimCalls[0]-n
+            if timed:
+                t = voom_core.clock()-t
+                VO = VOOMS.get(callerBody(args))
+                if VO:
+                    voom_core.addTime(VO, name[5:], t)
+    wrapper.__name__ = name
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+
+
+def callerBody(args): #{{{2
+    """Return Body bufnr for voom_*() function called with args: the first
+    argument or l:body or a:body got by the function with vimGet(), 0 if
+    unknown. Call after the function. Functions that get l:body or a:body
+    with vimGet() must get it first.
+    """
+    if args and type(args[0]) is int:
+        return args[0]
+    return int(_vimCalls[2])
+
+
+def profileCall(f, args, kwargs): #{{{2
+    """Run voom_*() function f under cProfile, add stats to PROFILES.
+    Stats are keyed by markup mode of the Body and by function name.
+    """
+    import cProfile, pstats
+    VO = VOOMS.get(args[0]) if args and type(args[0]) is int else None # voom_UnVoom() deletes it
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(f, *args, **kwargs)
+    finally:
+        VO = VO or VOOMS.get(callerBody(args)) # voom_Init() creates it
+        key = (VO.mmode if VO else '-', f.__name__)
+        stat = PROFILES.get(key)
+        if stat is None:
+            PROFILES[key] = [1, pstats.Stats(prof)]
+        else:
+            stat[0]+=1
+            stat[1].add(prof)
+
+
 #---Outline Construction----------------------{{{1o
 
 
-class VoomOutline: #{{{2
+class VoomOutline(voom_core.VoomOutline): #{{{2
     """Outline data for one Body buffer.
     Instantiated from Body by voom#Init().
+    VO.treeLevels -- levels of Tree lines, see Tree Fold Levels.
     """
+    treeLevels = None
+
     def __init__(self,body):
-        assert body == int(vim.eval("bufnr('')"))
+        assert body == int(vimEval("bufnr('')"))
 
 
+@countVimCalls
 def voom_Init(body): #{{{2
     VO = VoomOutline(body)
     VO.bnodes = [] # Body lnums of headlines
@@ -86,109 +245,85 @@ def voom_Init(body): #{{{2
     VO.tree = None # will set later
     VO.Tree = None # will set later
     VO.snLn = 1 # will change later if different
+    VO.spliceTree = spliceTreeLevels
     # first Tree line is Body buffer name and path
-    VO.bname = vim.eval('l:firstLine')
-    # Body &filetype
-    VO.filetype = vim.eval('&filetype')
-    VO.enc = get_vim_encoding()
+    # Body &filetype, &enc, l:qargs is markup mode's name
+    VO.bname, VO.filetype, enc, qargs, scan = vimGet('l:firstLine', '&filetype', '&enc', 'l:qargs',
+            'g:voom_scan_outline')
+    VO.enc = get_vim_encoding(enc)
 
 
-    ### get markup mode, l:qargs is mode's name ###
-    mmode = vim.eval('l:qargs').strip() or FT_MODES.get(VO.filetype, DEFAULT_MODE)
-    mName = 'voom_vimplugin2657.voom_mode_%s' %mmode
+    ### get markup mode ###
+    mmode = qargs.strip() or FT_MODES.get(VO.filetype, DEFAULT_MODE)
     try:
-        __import__(mName)
-        mModule = sys.modules[mName]
+        mModule = voom_core.loadMode(mmode)
     except ImportError:
-        vim.command("call voom#ErrorMsg('VOoM: cannot import Python module: %s')" %mName.replace("'","''"))
+        mName = 'voom_vimplugin2657.voom_mode_%s' %mmode
+        vimCommand("call voom#ErrorMsg('VOoM: cannot import Python module: %s')" %mName.replace("'","''"))
         return
         # no need to catch other import errors -- Vim code will check l:MTYPE
 
-    VO.mModule = mModule
-    VO.mmode = mmode
     VO.bname += ', %s' %mmode
-    vim.command("let l:mmode='%s'" %mmode.replace("'","''"))
 
-    ### define mode-specific methods ###
-    VO.MTYPE = getattr(mModule, 'MTYPE', 1)
     # "fmr" mode, markup mode for fold markers
-    if VO.MTYPE == 0:
-        f = getattr(mModule, 'hook_makeOutline', 0)
-        if f:
-            VO.makeOutline = f
-        else:
-            if VO.filetype in MAKE_HEAD:
-                VO.makeOutline = makeOutlineH
-            else:
-                VO.makeOutline = makeOutline
-        VO.newHeadline = getattr(mModule, 'hook_newHeadline', 0) or newHeadline
-        VO.changeLevBodyHead = changeLevBodyHead
-        VO.hook_doBodyAfterOop = 0
-
-        # start fold marker string and regexp ("fmr" modes)
-        marker = vim.eval('&foldmarker').split(',')[0]
-        VO.marker = marker
-        if marker==MARKER:
-            VO.marker_re = MARKER_RE
-        else:
-            VO.marker_re = re.compile(re.escape(marker) + r'(\d*[1-9]\d*)(x?)')
-
+    if getattr(mModule, 'MTYPE', 1) == 0:
+        # start fold marker string ("fmr" modes)
         # chars to strip from right side of Tree headlines ("fmr" modes)
-        if vim.eval("exists('g:voom_rstrip_chars_{&ft}')")=="1":
-            VO.rstrip_chars = vim.eval("g:voom_rstrip_chars_{&ft}")
+        fmr, hasChars, chars = vimGet('&foldmarker', "exists('g:voom_rstrip_chars_{&ft}')",
+                "exists('g:voom_rstrip_chars_{&ft}') ? g:voom_rstrip_chars_{&ft} : &commentstring")
+        VO.marker = fmr.split(',')[0]
+        if hasChars=="1":
+            VO.rstrip_chars = chars
         else:
-            VO.rstrip_chars = vim.eval("&commentstring").split('%s')[0].strip() + " \t"
+            VO.rstrip_chars = chars.split('%s')[0].strip() + " \t"
 
-    # not an "fmr" markup mode: not for fold markers
-    else:
-        VO.makeOutline = getattr(mModule, 'hook_makeOutline', 0) or makeOutline
-        VO.newHeadline = getattr(mModule, 'hook_newHeadline', 0) or newHeadline
-        # These must be False if not defined by the markup mode.
-        VO.changeLevBodyHead = getattr(mModule, 'hook_changeLevBodyHead', 0)
-        VO.hook_doBodyAfterOop = getattr(mModule, 'hook_doBodyAfterOop', 0)
+    ### markup mode settings, if any ###
+    names, exprs = settingsExprs(body, mModule)
+    settings = None
+    if exprs:
+        settings = settingsDict(names, vimGet(*exprs))
+
+    ### define mode-specific methods ###
+    voom_core.setMode(VO, mmode, mModule, settings, scan=='1')
 
     ### the end ###
     # if we don't get here because of error, l:MTYPE is not set and Vim code bails out
-    vim.command('let l:MTYPE=%s' %VO.MTYPE)
+    vimLet(mmode=mmode, MTYPE=VO.MTYPE)
     VOOMS[body] = VO
 
 
+@countVimCalls
 def voom_TreeCreate(): #{{{2
     """This is part of voom#TreeCreate(), called from Tree."""
-    body = int(vim.eval('a:body'))
-    blnr = int(vim.eval('a:blnr')) # Body cursor lnum
+    # blnr is Body cursor lnum
+    body, blnr = [int(i) for i in vimGet('a:body', 'a:blnr')]
     VO = VOOMS[body]
 
     # VO.MTYPE other than 0 means it is not an "fmr" mode
     if VO.MTYPE:
         computeSnLn(body, blnr)
         # reST, wiki files often have most headlines at level >1
-        vim.command('setl fdl=2')
+        vimCommand('setl fdl=2')
         return
 
     bnodes = VO.bnodes
-    Body = VO.Body
     z = len(bnodes)
 
     ### compute snLn, create Tree folding
 
     # find bnode marked with '='
     # find bnodes marked with 'o'
+    # Flags were recorded when the outline was constructed.
+    flags = getNodeFlags(VO)
     snLn = 0
-    marker_re = VO.marker_re
-    marker_re_search = marker_re.search
     oFolds = []
     for i in xrange(1,z):
-        bline = Body[bnodes[i]-1]
-        # part of Body headline after marker+level+'x'
-        bline2 = bline[marker_re_search(bline).end():]
-        if not bline2: continue
-        if bline2[0]=='=':
-            snLn = i+1
-        elif bline2[0]=='o':
+        f = flags[i]
+        if not f & (FLAG_OPENED|FLAG_STARTUP): continue
+        if f & FLAG_OPENED:
             oFolds.append(i+1)
-            if bline2[1:] and bline2[1]=='=':
-                snLn = i+1
+        if f & FLAG_STARTUP:
+            snLn = i+1
 
     # create Tree folding
     if oFolds:
@@ -196,151 +331,217 @@ def voom_TreeCreate(): #{{{2
         foldingCreate(2,z,cFolds)
 
     if snLn:
-        vim.command('call voom#SetSnLn(%s,%s)' %(body,snLn))
+        vimCommand('call voom#SetSnLn(%s,%s)' %(body,snLn))
         VO.snLn = snLn
         # set blnShow if Body cursor is on or before the first headline
         if z > 1 and blnr <= bnodes[1]:
-            vim.command('let l:blnShow=%s' %bnodes[snLn-1])
+            vimCommand('let l:blnShow=%s' %bnodes[snLn-1])
     else:
         # no Body headline is marked with =
         # select current Body node
         computeSnLn(body, blnr)
 
 
-def makeOutline(VO, blines): #{{{2
-    """Return (tlines, bnodes, levels) for Body lines blines.
-    blines is either Vim buffer object (Body) or list of buffer lines.
-    """
-    # blines is usually Body. It is list of clipboard lines during Paste.
-    # This function is slower when blines is Vim buffer object instead of
-    # Python list. But overall time to do outline update is the same and memory
-    # usage is less because we don't create new list (see v3.0 notes)
-
-    # Optimized for buffers in which most lines don't have fold markers.
-
-    # NOTE: duplicate code with makeOutlineH(), only head construction is different
-    marker = VO.marker
-    marker_re_search = VO.marker_re.search
-    Z = len(blines)
-    tlines, bnodes, levels = [], [], []
-    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
-    c = VO.rstrip_chars
-    for i in xrange(Z):
-        if not marker in blines[i]: continue
-        bline = blines[i]
-        m = marker_re_search(bline)
-        if not m: continue
-        lev = int(m.group(1))
-        head = bline[:m.start()].lstrip().rstrip(c).strip('-=~').strip()
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
-        tlines_add(tline)
-        bnodes_add(i+1)
-        levels_add(lev)
-    return (tlines, bnodes, levels)
-
-
-def makeOutlineH(VO, blines): #{{{2
-    """Identical to makeOutline(), duplicate code. The only difference is that
-    a custom function is used to construct Tree headline text.
-    """
-    # NOTE: duplicate code with makeOutline(), only head construction is different
-    marker = VO.marker
-    marker_re_search = VO.marker_re.search
-    Z = len(blines)
-    tlines, bnodes, levels = [], [], []
-    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
-    h = MAKE_HEAD[VO.filetype]
-    for i in xrange(Z):
-        if not marker in blines[i]: continue
-        bline = blines[i]
-        m = marker_re_search(bline)
-        if not m: continue
-        lev = int(m.group(1))
-        head = h(bline,m)
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
-        tlines_add(tline)
-        bnodes_add(i+1)
-        levels_add(lev)
-    return (tlines, bnodes, levels)
-
-
-#--- make_head functions --- {{{2
-
-def make_head_html(bline,match):
-    s = bline[:match.start()].strip().strip('-=~').strip()
-    if s.endswith('<!'):
-        return s[:-2].strip()
-    else:
-        return s
-MAKE_HEAD['html'] = make_head_html
-
-#def make_head_vim(bline,match):
-#    return bline[:match.start()].lstrip().rstrip('" \t').strip('-=~').strip()
-#MAKE_HEAD['vim'] = make_head_vim
-
-#def make_head_py(bline,match):
-#    return bline[:match.start()].lstrip().rstrip('# \t').strip('-=~').strip()
-#for ft in 'python ruby perl tcl'.split():
-#    MAKE_HEAD[ft] = make_head_py
-
-
+@countVimCalls
 def updateTree(body,tree): #{{{2
     """Construct outline for Body body.
     Update lines in Tree buffer if needed.
     This can be run from any buffer as long as Tree is set to ma.
+    If l:parsing exists, outline of a large Body can be constructed in
+    background: l:parsing is set to 1, see voom#TreeParsing().
+    Outline of a huge Body can be constructed by several processes, see
+    g:voom_parallel_lines.
     """
-    ### Construct outline.
     VO = VOOMS[body]
     assert VO.tree == tree
-    #blines = VO.Body[:] # wasteful, see v3.0 notes
-    tlines, bnodes, levels  = VO.makeOutline(VO, VO.Body)
-    tlines[0:0], bnodes[0:0], levels[0:0] = [VO.bname], [1], [1]
-    VO.bnodes, VO.levels = bnodes, levels
-
-    ### Add the = mark.
     snLn = VO.snLn
-    Z = len(bnodes)
+
+    ### Reparse only the changed part of Body if the markup mode allows it.
+    # Changed Body lines are recorded by voom#BodyListener().
+    # Markup mode settings are checked too: all of Body is parsed after a
+    # change.
+    names, exprs = settingsExprs(body, VO.mModule)
+    # Outline is being created: use outline cache if Body is an unmodified file.
+    cache = '[]'
+    if not VO.bnodes:
+        cache = ("g:voom_cache_dir!=#'' && !getbufvar(%s,'&mod') && filereadable(expand('#%s:p')) ? "
+                "[expand(g:voom_cache_dir), expand('#%s:p'), getbufvar(%s,'&fenc'), getbufvar(%s,'&ff'), getbufvar(%s,'&bomb')] : []"
+                %((body,)*6))
+    # VO.treeLines is valid if Tree was not changed after the last update.
+    values = vimGet("exists('l:parsing') && has('timers') ? g:voom_async_lines : 0",
+            "getbufvar(%s,'changedtick')" %body,
+            VO.lineContext >= 0 and 'voom#BodyDirty(%s)' %body or '[-1]',
+            cache, TREE_TICK %(tree, tree), 'g:voom_parallel_lines', 'g:voom_parallel_workers',
+            TREE_FDL_LEN %tree, *exprs)
+    asyncLines, tick, cache = int(values[0]), values[1], values[3]
+    parallelLines, workers = int(values[5]), int(values[6])
+    dirty = [int(i) for i in values[2]]
+    if not values[4]=='1':
+        VO.treeLines = None
+    checkTreeLevels(VO, values[7])
+    if names and voom_core.setModeState(VO, settingsDict(names, values[8:])):
+        dirty = [-1]
+    cmds = ['let l:ok=1', SET_TREE_TICK %(tree, tree)]
+    if dirty[0] > 0:
+        VO.parseJob = None
+        voom_core.updateOutlineRegion(VO, dirty[0], dirty[1], dirty[2])
+    elif cache:
+        VO.parseJob = None
+        if not voom_core.updateOutlineCached(VO, cache[0], cache[1], tuple(cache[2:])):
+            cmds.append("call voom#ErrorMsg('VOoM: cannot write outline cache file in g:voom_cache_dir')")
+    elif 0 < asyncLines <= len(VO.Body) and getattr(VO.mModule, 'ASYNC_PARSE', 1):
+        # Parse in background, voom_ParsePoll() will draw Tree. Body has not
+        # changed if the job was started earlier with the same tick.
+        job = VO.parseJob
+        if job is None or job.tick != tick:
+            job = VO.parseJob = voom_core.ParseJob(VO, tick)
+            job.start()
+        vimLet(parsing=1)
+        return
+    elif 0 < parallelLines <= len(VO.Body) and VO.lineContext >= 0:
+        # Parse chunks of Body in several processes.
+        VO.parseJob = None
+        voom_core.updateOutline(VO, workers or voom_core.cpuCount())
+    else:
+        VO.parseJob = None
+        voom_core.updateOutline(VO)
+
     # snLn got larger than the number of nodes because some nodes were
     # deleted while editing the Body
-    if snLn > Z:
-        snLn = Z
-        vim.command('call voom#SetSnLn(%s,%s)' %(body,snLn))
-        VO.snLn = snLn
-    tlines[snLn-1] = '=%s' %tlines[snLn-1][1:]
+    if not VO.snLn==snLn:
+        cmds.insert(0, 'call voom#SetSnLn(%s,%s)' %(body,VO.snLn))
+    syncTreeLevels(VO, cmds)
+    vimCommand(*cmds)
+    # why l:ok is needed:  VOoM**voom_notes.txt#id_20110213212708
 
-    ### Compare Tree lines, draw as needed.
-    # Draw all Tree lines only when needed. This is optimization for large
-    # outlines, e.g. >1000 Tree lines. Drawing all lines is slower than
-    # comparing all lines and then drawing nothing or just one line.
 
-    Tree = VO.Tree
-    #tlines_ = Tree[:]
-    if not len(Tree)==len(tlines):
-        Tree[:] = tlines
-        vim.command('let l:ok=1')
+@countVimCalls
+def voom_ParsePoll(): #{{{2
+    """Timer callback voom#TreeParsePoll(): draw outline constructed in
+    background if it is ready. This can be run from any buffer as long as Tree
+    is set to ma. Set l:status:
+        'running' -- not ready yet;
+        'done' -- Tree has been updated, l:tick is b:changedtick of Body;
+        'stale' -- Body has changed, the result was discarded;
+        'error' -- exception in markup mode, traceback is printed;
+        'none' -- there is nothing to do.
+    """
+    body, tick, treeTick, fdlLen = vimGet('a:body', "getbufvar(a:body,'changedtick')",
+            TREE_TICK %('l:tree', 'l:tree'), TREE_FDL_LEN %'l:tree')
+    body = int(body)
+    VO = VOOMS[body]
+    job = VO.parseJob
+    if job is None:
+        vimLet(status='none')
+        return
+    if job.is_alive():
+        vimLet(status='running')
         return
+    VO.parseJob = None
+    if job.error:
+        print(job.error)
+        vimLet(status='error')
+        return
+    if not job.tick == tick:
+        vimLet(status='stale')
+        return
+    snLn = VO.snLn
+    if not treeTick=='1':
+        VO.treeLines = None
+    checkTreeLevels(VO, fdlLen)
+    voom_core.parseApply(VO, job)
+    cmds = [SET_TREE_TICK %(VO.tree, VO.tree)]
+    if not VO.snLn==snLn:
+        cmds.append('call voom#SetSnLn(%s,%s)' %(body,VO.snLn))
+    syncTreeLevels(VO, cmds)
+    vimCommand(*cmds)
+    vimLet(status='done', tick=int(tick))
 
-    # If only one line is modified, draw that line only. This ensures that
-    # editing (and inserting) a single headline in a large outline is fast.
-    # If more than one line is modified, draw all lines from first changed line
-    # to the end of buffer.
-    draw_one = False
-    for i in xrange(len(tlines)):
-        if not tlines[i]==Tree[i]:
-            if draw_one==False:
-                draw_one = True
-                diff = i
-            else:
-                Tree[diff:] = tlines[diff:]
-                vim.command('let l:ok=1')
-                return
-    if draw_one:
-        Tree[diff] = tlines[diff]
 
-    vim.command('let l:ok=1')
-    # why l:ok is needed:  VOoM**voom_notes.txt#id_20110213212708
+# Tree b:voom_tick is its b:changedtick after the last outline update.
+TREE_TICK = "getbufvar(%s,'voom_tick')==getbufvar(%s,'changedtick')"
+SET_TREE_TICK = "call setbufvar(%s,'voom_tick',getbufvar(%s,'changedtick'))"
+
+
+#---Tree Fold Levels--------------------------{{{1o
+# Tree b:voom_fdl is the list of fold levels of Tree lines in the format of
+# 'foldexpr'. Tree 'foldexpr' looks up b:voom_fdl when its length is the number
+# of Tree lines and calls voom#TreeFoldexpr() otherwise, see voom#TreeConfigWin().
+# VO.treeLevels is a copy of levels of Tree lines (level of line 1 is 0).
+# Operations that change Tree lines call VO.spliceTree() before changing Tree:
+# Vim updates folds as soon as lines are changed.
+
+TREE_FDL_LEN = "len(getbufvar(%s,'voom_fdl'))"
+
+
+def treeFoldLevels(tlevels, i1, i2): #{{{2
+    """Return fold levels of Tree lines i1 to i2-1 (0-based) for b:voom_fdl.
+    tlevels are levels of all Tree lines.
+    """
+    nlevels = tlevels[i1+1:i2+1]
+    if len(nlevels) < i2-i1:
+        nlevels.append(0)
+    return [(nlev > lev and '>%s' %lev or lev-1) for lev, nlev in zip(tlevels[i1:i2], nlevels)]
+
+
+def spliceTreeLevels(VO, i1, i2, levels): #{{{2
+    """VO.spliceTree(): Tree lines i1 to i2-1 (0-based) are about to be
+    replaced with headlines at levels levels. Update b:voom_fdl.
+    """
+    tlevels = VO.treeLevels
+    if tlevels is None:
+        return
+    if i1==0 and levels:
+        levels = [0] + levels[1:]
+    if tlevels[i1:i2] == levels:
+        return
+    z = len(tlevels)
+    tlevels[i1:i2] = levels
+    # fold level of line before i1 depends on level of line i1
+    j1 = max(i1-1, 0)
+    vimCommand('call voom#TreeFdl(%s,%s,%s,%s,%s)'
+            %(VO.tree, z, j1, i2, vimLiteral(treeFoldLevels(tlevels, j1, i1+len(levels)))))
+
+
+def checkTreeLevels(VO, fdlLen): #{{{2
+    """Forget VO.treeLevels if b:voom_fdl has wrong length fdlLen."""
+    if VO.treeLevels is not None and not int(fdlLen) == len(VO.treeLevels):
+        VO.treeLevels = None
+
+
+def syncTreeLevels(VO, cmds): #{{{2
+    """Tree was updated. If VO.treeLevels is unknown, add Vim command that
+    sets b:voom_fdl to cmds.
+    """
+    if VO.treeLevels is not None:
+        return
+    VO.treeLevels = tlevels = [0] + VO.levels[1:]
+    cmds.append("call setbufvar(%s,'voom_fdl',%s)"
+            %(VO.tree, vimLiteral(treeFoldLevels(tlevels, 0, len(tlevels)))))
+
+
+def settingsExprs(body, mModule): #{{{2
+    """Return names of settings of markup mode module mModule and list of Vim
+    expressions to get their values for Body body, see
+    voom_core.setModeState(). Buffer variable b:voom_{name} overrides global
+    variable g:voom_{name}. Each expression evaluates to [value] or [].
+    """
+    names = sorted(getattr(mModule, 'SETTINGS', ()))
+    exprs = ["has_key(getbufvar(%s,''),'voom_%s') ? [getbufvar(%s,'voom_%s')] : exists('g:voom_%s') ? [g:voom_%s] : []"
+            %(body, n, body, n, n, n) for n in names]
+    return names, exprs
+
+
+def settingsDict(names, values): #{{{2
+    """Return dict of settings that are set in Vim, see settingsExprs()."""
+    settings = {}
+    for n, v in zip(names, values):
+        if v:
+            settings[n] = v[0]
+    return settings
 
 
+@countVimCalls
 def computeSnLn(body, blnr): #{{{2
     """Compute Tree lnum for node at line blnr in Body body.
     Assign Vim and Python snLn vars.
@@ -348,17 +549,19 @@ def computeSnLn(body, blnr): #{{{2
     # snLn should be 1 if blnr is before the first node, top of Body
     VO = VOOMS[body]
     snLn = bisect.bisect_right(VO.bnodes, blnr)
-    vim.command('call voom#SetSnLn(%s,%s)' %(body,snLn))
+    vimCommand('call voom#SetSnLn(%s,%s)' %(body,snLn))
     VO.snLn = snLn
 
 
+@countVimCalls
 def voom_UnVoom(body): #{{{2
     if body in VOOMS: del VOOMS[body]
 
 
+@countVimCalls
 def voom_Voominfo(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    vimvars = vim.eval('l:vimvars')
+    body, tree, vimvars = vimGet('l:body', 'l:tree', 'l:vimvars')
+    body, tree = int(body), int(tree)
     print('%s CURRENT VOoM OUTLINE %s' %('-'*10, '-'*18))
     if not tree:
         print('current buffer %s is not a VOoM buffer' %body)
@@ -371,9 +574,19 @@ def voom_Voominfo(): #{{{2
         print('markup mode file: "%s"' % (os.path.abspath(VO.mModule.__file__)))
         if VO.MTYPE==0:
             print('headline markers: %s1, %s2, %s3, ...' % (VO.marker, VO.marker, VO.marker))
+        print('last Tree update: %s lines compared, %s lines written' % VO.treeDraw)
+        stats = voom_core.getStats(VO)
+        print('Body lines: %s, headlines: %s, lines written to Body: %s, to Tree: %s'
+                % (stats.pop('bodyLines'), stats.pop('headlines'), stats.pop('bodyWritten'), stats.pop('treeWritten')))
+        if stats:
+            print('run times (ms):      count      total        max        p95')
+            for name in sorted(stats):
+                d = stats[name]
+                print('    %-15s %6s %10.1f %10.1f %10.1f' %(name, d['count'], d['total'], d['max'], d['p95']))
     print('%s VOoM INTERNALS %s' %('-'*10, '-'*24))
     print('Python version: %s' % (sys.version))
-    print('s:PYCMD = %s' % repr((vim.eval('s:PYCMD'))))
+    print('s:PYCMD = %s' % repr((vimEval('s:PYCMD'))))
+    print('profiling (:Voomprofile): %s, %s profiles' % (('off','on')[PROFILING], len(PROFILES)))
     if vimvars:
         print("_VOoM2657.FT_MODES = %s" % repr(FT_MODES))
         print("_VOoM2657.DEFAULT_MODE = %s" % repr(DEFAULT_MODE))
@@ -381,8 +594,70 @@ def voom_Voominfo(): #{{{2
         print("_VOoM2657.ALWAYS_ALLOW_MOVE_LEFT = %s" % repr(ALWAYS_ALLOW_MOVE_LEFT))
         print('_VOoM2657 :     "%s"' % (os.path.abspath(sys.modules['voom_vimplugin2657.voom_vim'].__file__)))
         print(vimvars)
+        print('_VOoM2657.VIM_CALLS: runs, Vim calls, Vim calls per run')
+        for name in sorted(VIM_CALLS):
+            runs, calls = VIM_CALLS[name]
+            print('    %-25s %6s %8s %6.1f' %(name, runs, calls, float(calls)/runs))
+
+
+@countVimCalls
+def voom_Stats(): #{{{2
+    body, = vimGet('l:body')
+    VO = VOOMS[int(body)]
+    vimLet(stats=voom_core.getStats(VO))
+
+
+# Not decorated: profiling control must not be profiled.
+def voom_Profile(): #{{{2
+    """Python code for :Voomprofile start|stop|report [file]."""
+    global PROFILING
+    action, fname = vimGet('l:action', 'l:fname')
+    if action=='start':
+        PROFILES.clear()
+        PROFILING = True
+        print('VOoM: profiling started')
+    elif action=='stop':
+        PROFILING = False
+        print('VOoM: profiling stopped')
+    elif action=='report':
+        report = profileReport()
+        if fname:
+            fOut = open(fname, 'w')
+            try:
+                fOut.write(report)
+            finally:
+                fOut.close()
+            print('VOoM: profile report written to "%s"' %fname)
+        else:
+            print(report.rstrip())
 
 
+def profileReport(limit=20): #{{{2
+    """Return text of profile report: for each markup mode and voom_*()
+    function, sorted by total time, top functions sorted by cumulative time.
+    """
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    if not PROFILES:
+        return 'VOoM: no profile data, use ":Voomprofile start"\n'
+    out = StringIO()
+    totals = [(stat[1].total_tt, key) for key, stat in PROFILES.items()]
+    totals.sort(reverse=True)
+    out.write('%s VOoM PROFILE %s\n' %('-'*10, '-'*26))
+    out.write('markup mode, function, runs, total seconds\n')
+    for total, (mmode, name) in totals:
+        out.write('    %-12s %-25s %6s %9.3f\n' %(mmode, name, PROFILES[(mmode, name)][0], total))
+    for total, (mmode, name) in totals:
+        runs, stats = PROFILES[(mmode, name)]
+        out.write('\n%s %s, %s: %s runs, %.3f s %s\n' %('='*10, mmode, name, runs, total, '='*10))
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+@countVimCalls
 def voom_ReloadAllPre(): #{{{2
     if IS_PY2:
         sys.exc_clear()
@@ -393,219 +668,39 @@ def voom_ReloadAllPre(): #{{{2
             del sys.modules[k]
 
 
-#---Outline Traversal-------------------------{{{1
-# Functions for getting node's parents, children, ancestors, etc.
-# Nodes here are Tree buffer lnums.
-# All we do is traverse VO.levels.
-
-
-def nodeHasChildren(VO, lnum): #{{{2
-    """Determine if node at Tree line lnum has children."""
-    levels = VO.levels
-    if lnum==1 or lnum==len(levels): return False
-    elif levels[lnum-1] < levels[lnum]: return True
-    else: return False
-
-
-def nodeSubnodes(VO, lnum): #{{{2
-    """Number of all subnodes for node at Tree line lnum."""
-    levels = VO.levels
-    z = len(levels)
-    if lnum==1 or lnum==z: return 0
-    lev = levels[lnum-1]
-    for i in xrange(lnum,z):
-        if levels[i]<=lev:
-            return i-lnum
-    return z-lnum
-
-
-def nodeParent(VO, lnum): #{{{2
-    """Return lnum of closest parent of node at Tree line lnum."""
-    levels = VO.levels
-    lev = levels[lnum-1]
-    if lev==1: return None
-    for i in xrange(lnum-2,0,-1):
-        if levels[i] < lev: return i+1
-
-
-def nodeAncestors(VO, lnum): #{{{2
-    """Return lnums of ancestors of node at Tree line lnum."""
-    levels = VO.levels
-    lev = levels[lnum-1]
-    if lev==1: return []
-    ancestors = []
-    for i in xrange(lnum-2,0,-1):
-        levi = levels[i]
-        if levi < lev:
-            lev = levi
-            ancestors.append(i+1)
-            if lev==1:
-                ancestors.reverse()
-                return ancestors
-    # we get here if there are no nodes at level 1 (wiki mode)
-    ancestors.reverse()
-    return ancestors
-
-
-def nodeUNL(VO, lnum): #{{{2
-    """Compute UNL of node at Tree line lnum.
-    Return list of headlines.
-    """
-    Tree = VO.Tree
-    levels = VO.levels
-    if lnum==1: return ['top-of-buffer']
-    parents = nodeAncestors(VO,lnum)
-    parents.append(lnum)
-    heads = [Tree[ln-1].split('|',1)[1] for ln in parents]
-    return heads
-
-
-def nodeSiblings(VO, lnum): #{{{2
-    """Return lnums of siblings for node at Tree line lnum.
-    These are nodes with the same parent and level as lnum node. Sorted in
-    ascending order. lnum itself is included. First node (line 1) is never
-    included, that is minimum lnum in results is 2.
-    """
-    levels = VO.levels
-    lev = levels[lnum-1]
-    siblings = []
-    # scan back
-    for i in xrange(lnum-1,0,-1):
-        levi = levels[i]
-        if levi < lev:
-            break
-        elif levi==lev:
-            siblings[0:0] = [i+1]
-    # scan forward
-    for i in xrange(lnum,len(levels)):
-        levi = levels[i]
-        if levi < lev:
-            break
-        elif levi==lev:
-            siblings.append(i+1)
-    return siblings
-
-
-def rangeSiblings(VO, lnum1, lnum2): #{{{2
-    """Return lnums of siblings for nodes in Tree range lnum1,lnum2.
-    These are nodes with the same parent and level as lnum1 node.
-    First node (first Tree line) is never included, that is minimum lnum in results is 2.
-    Return None if range is ivalid.
-    """
-    if lnum1==1: lnum1 = 2
-    if lnum1 > lnum2: return None
-    levels = VO.levels
-    lev = levels[lnum1-1]
-    siblings = [lnum1]
-    for i in xrange(lnum1,lnum2):
-        levi = levels[i]
-        # invalid range
-        if levi < lev:
-            return None
-        elif levi==lev:
-            siblings.append(i+1)
-    return siblings
-
-
-def getSiblingsGroups(VO, siblings): #{{{2
-    """Return list of groups of siblings in the region defined by 'siblings'
-    group, which is list of siblings in ascending order (Tree lnums).
-    Siblings in each group are nodes with the same parent and level.
-    Siblings in each group are in ascending order.
-    List of groups is reverse-sorted by level of siblings and by parent lnum:
-        from RIGHT TO LEFT and from BOTTOM TO TOP.
-    """
-    if not siblings: return []
-    levels = VO.levels
-    lnum1, lnum2 = siblings[0], siblings[-1]
-    lnum2 = lnum2 + nodeSubnodes(VO,lnum2)
-
-    # get all parents (nodes with children) in the range
-    parents = [i for i in xrange(lnum1,lnum2) if levels[i-1]<levels[i]]
-    if not parents:
-        return [siblings]
-
-    # get children for each parent
-    results_dec = [(levels[lnum1-1], 0, siblings)]
-    for p in parents:
-        sibs = [p+1]
-        lev = levels[p] # level of siblings of this parent
-        for i in xrange(p+1, lnum2):
-            levi = levels[i]
-            if levi==lev:
-                sibs.append(i+1)
-            elif levi < lev:
-                break
-        results_dec.append((lev, p, sibs))
-
-    results_dec.sort()
-    results_dec.reverse()
-    results = [i[2] for i in results_dec]
-    assert len(parents)+1 == len(results)
-    return results
-
-
-def nodesBodyRange(VO, ln1, ln2, withSubnodes=False): #{{{2
-    """Return Body start and end lnums (bln1, bln2) corresponding to nodes at
-    Tree lnums ln1 to ln2. Include ln2's subnodes if withSubnodes."""
-    bln1 = VO.bnodes[ln1-1]
-    if withSubnodes:
-        ln2 += nodeSubnodes(VO,ln2)
-    if ln2 < len(VO.bnodes):
-        bln2 = VO.bnodes[ln2]-1
-    else:
-        bln2 = len(VO.Body)
-    return (bln1,bln2)
-    # (bln1,bln2) can be (1,0), see voom_TreeSelect()
-    # this is what we want: getbufline(body,1,0)==[]
-
-
 #---Outline Navigation------------------------{{{1
 
 
+@countVimCalls
 def voom_TreeSelect(): #{{{2
     # Get first and last lnums of Body node for Tree line lnum.
-    lnum = int(vim.eval('l:lnum'))
-    body = int(vim.eval('l:body'))
+    lnum, body = [int(i) for i in vimGet('l:lnum', 'l:body')]
     VO = VOOMS[body]
     VO.snLn = lnum
-    vim.command('let l:blnum1=%s' %(VO.bnodes[lnum-1]))
     if lnum < len(VO.bnodes):
-        vim.command('let l:blnum2=%s' %(VO.bnodes[lnum]-1 or 1))
+        blnum2 = VO.bnodes[lnum]-1 or 1
     else:
-        vim.command("let l:blnum2=%s" %(len(VO.Body)+1))
+        blnum2 = len(VO.Body)+1
+    vimLet(blnum1=VO.bnodes[lnum-1], blnum2=blnum2)
     # "or 1" takes care of situation when:
     # lnum is 1 (first Tree line) and first Body line is a headline.
     # In that case VO.bnodes is [1, 1, ...] and (l:blnum1,l:blnum2) is (1,0)
 
 
+@countVimCalls
 def voom_TreeToStartupNode(): #{{{2
-    body = int(vim.eval('l:body'))
+    body = int(vimEval('l:body'))
     VO = VOOMS[body]
-    bnodes = VO.bnodes
-    Body = VO.Body
-    marker_re = VO.marker_re
-    z = len(bnodes)
+    flags = getNodeFlags(VO)
     # find Body headlines marked with '='
-    lnums = []
-    for i in xrange(1,z):
-        bline = Body[bnodes[i]-1]
-        # part of Body headline after marker+level+'x'+'o'
-        bline2 = bline[marker_re.search(bline).end():]
-        if not bline2: continue
-        if bline2[0]=='=':
-            lnums.append(i+1)
-        elif bline2[0]=='o':
-            if bline2[1:] and bline2[1]=='=':
-                lnums.append(i+1)
-    vim.command('let l:lnums=%s' %repr(lnums))
+    lnums = [i+1 for i in xrange(1,len(flags)) if flags[i] & FLAG_STARTUP]
+    vimLet(lnums=lnums)
 
 
+@countVimCalls
 def voom_EchoUNL(): #{{{2
-    bufType = vim.eval('l:bufType')
-    body = int(vim.eval('l:body'))
-    tree = int(vim.eval('l:tree'))
-    lnum = int(vim.eval('l:lnum'))
+    bufType, body, tree, lnum = vimGet('l:bufType', 'l:body', 'l:tree', 'l:lnum')
+    body, tree, lnum = int(body), int(tree), int(lnum)
 
     VO = VOOMS[body]
     assert VO.tree == tree
@@ -615,52 +710,85 @@ def voom_EchoUNL(): #{{{2
 
     heads = nodeUNL(VO,lnum)
     UNL = ' -> '.join(heads)
-    vim.command("let @n='%s'" %UNL.replace("'", "''"))
-    vim.command("echo ''") # prevent fusion with previous message
+    # echo '' prevents fusion with previous message
+    cmds = ["let @n=%s" %vimLiteral(UNL), "echo ''"]
     for h in heads[:-1]:
-        vim.command("echon '%s'" %(h.replace("'", "''")))
-        vim.command("echohl TabLineFill")
-        vim.command("echon ' -> '")
-        vim.command("echohl None")
-    vim.command("echon '%s'" %(heads[-1].replace("'", "''")))
+        cmds.extend(("echon %s" %vimLiteral(h), "echohl TabLineFill",
+                "echon ' -> '", "echohl None"))
+    cmds.append("echon %s" %vimLiteral(heads[-1]))
+    vimCommand(*cmds)
+
+
+@countVimCalls
+def voom_GrepScan(): #{{{2
+    """Search Body for all AND and NOT patterns in Python. Set l:pyGrep to 1
+    and l:countsAND, l:countsNOT to numbers of matches if all patterns could
+    be translated. Otherwise do nothing: search() must be used.
+    """
+    # Body lines are bytes in Python 2, leave them to search()
+    if IS_PY2:
+        return
+    body, magic, ic, scs, isk, pattsAND, pattsNOT = vimGet('l:body', '&magic',
+            '&ignorecase', '&smartcase', '&iskeyword', 'l:pattsAND1', 'l:pattsNOT1')
+    if magic=='0':
+        return
+    VO = VOOMS[int(body)]
+    ic, scs = ic=='1', scs=='1'
+    text = '\n'.join(VO.Body)
+    # default 'iskeyword' includes chars 192-255, Python \w is Unicode
+    keyword = isk=='@,48-57,_,192-255' and not voom_core.NON_ASCII_RE.search(text)
+    regexes = []
+    for patt in pattsAND + pattsNOT:
+        regex = voom_core.compileVimRegex(patt, ic, scs, keyword)
+        if regex is None:
+            return
+        regexes.append(regex)
+    results = [voom_core.grepNodes(VO, text, regex) for regex in regexes]
+    k = len(pattsAND)
+    VO.grepScan = ([r[1] for r in results[:k]], [r[1] for r in results[k:]])
+    vimLet(countsAND=[r[0] for r in results[:k]],
+            countsNOT=[r[0] for r in results[k:]], pyGrep=1)
 
 
+@countVimCalls
 def voom_Grep(): #{{{2
-    body = int(vim.eval('l:body'))
-    tree = int(vim.eval('l:tree'))
+    body, tree, pyGrep, inhAND, inhNOT = vimGet('l:body', 'l:tree', 'l:pyGrep',
+            'l:inhAND', 'l:inhNOT')
+    body, tree = int(body), int(tree)
     VO = VOOMS[body]
     assert VO.tree == tree
     bnodes = VO.bnodes
-    matchesAND, matchesNOT = vim.eval('l:matchesAND'), vim.eval('l:matchesNOT')
-    inhAND, inhNOT = vim.eval('l:inhAND'), vim.eval('l:inhNOT')
+    # for subnodes and UNLs of many nodes
+    voom_core.getIndex(VO)
+    # matches of each pattern: [{tlnum: [count, blnum of first match]}, ...]
+    if pyGrep=='1':
+        nodesAND, nodesNOT = VO.grepScan
+        del VO.grepScan
+    else:
+        matchesAND, matchesNOT = vimGet('l:matchesAND', 'l:matchesNOT')
+        nodesAND = [blnumsToNodes(bnodes, L) for L in matchesAND]
+        nodesNOT = [blnumsToNodes(bnodes, L) for L in matchesNOT]
 
-    # Convert blnums of mathes into tlnums, that is node numbers.
+    # Convert matches into tlnums, that is node numbers.
     tlnumsAND, tlnumsNOT = [], [] # lists of AND and NOT "tlnums" dicts
 
     # Process AND matches.
     counts = {} # {tlnum: count of all AND matches in this node, ...}
     blnums = {} # {tlnum: blnum of first AND match in this node, ...}
     inh_only = {} # tlnums of nodes added to an AND match by inheritance only
-    idx = 0 # index into matchesAND and inhAND
-    for L in matchesAND:
-        tlnums = {} # {tlnum of node with a match:0, ...}
-        for bln in L:
-            bln = int(bln)
-            tln = bisect.bisect_right(bnodes, bln)
-            tlnums[tln] = 0
-            if tln in counts:
-                counts[tln]+=1
-            else:
-                counts[tln] = 1
-            if not tln in blnums:
-                blnums[tln] = bln
-            elif blnums[tln] > bln or counts[tln]==1:
+    idx = 0 # index into nodesAND and inhAND
+    for nodes in nodesAND:
+        tlnums = {}.fromkeys(nodes, 0) # {tlnum of node with a match:0, ...}
+        for tln, (c, bln) in nodes.items():
+            # count is 0 if node was added by inheritance
+            c_ = counts.get(tln)
+            if not tln in blnums or not c_ or blnums[tln] > bln:
                 blnums[tln] = bln
+            counts[tln] = (c_ or 0) + c
         # inheritace: add subnodes for each node with a match
         if int(inhAND[idx]):
-            for t in list(tlnums.keys()):
-                subn = nodeSubnodes(VO,t)
-                for s in xrange(t+1,t+subn+1):
+            for t, tEnd in subtreeRanges(VO, tlnums):
+                for s in xrange(t+1,tEnd+1):
                     if not s in tlnums:
                         tlnums[s] = 0
                         counts[s] = 0
@@ -671,24 +799,19 @@ def voom_Grep(): #{{{2
         tlnumsAND.append(tlnums)
 
     # Process NOT matches.
-    idx = 0 # index into matchesNOT and inhNOT
-    for L in matchesNOT:
-        tlnums = {} # {tlnum of node with a match:0, ...}
-        for bln in L:
-            bln = int(bln)
-            tln = bisect.bisect_right(bnodes, bln)
-            tlnums[tln] = 0
+    idx = 0 # index into nodesNOT and inhNOT
+    for nodes in nodesNOT:
+        tlnums = {}.fromkeys(nodes, 0) # {tlnum of node with a match:0, ...}
         # inheritace: add subnodes for each node with a match
         if int(inhNOT[idx]):
-            for t in list(tlnums.keys()):
-                subn = nodeSubnodes(VO,t)
-                for s in xrange(t+1,t+subn+1):
+            for t, tEnd in subtreeRanges(VO, tlnums):
+                for s in xrange(t+1,tEnd+1):
                     tlnums[s] = 0
         idx+=1
         tlnumsNOT.append(tlnums)
 
     # There are only NOT patterns.
-    if not matchesAND:
+    if not nodesAND:
         tlnumsAND = [{}.fromkeys(xrange(1,len(bnodes)+1))]
 
     # Compute intersection.
@@ -701,7 +824,7 @@ def voom_Grep(): #{{{2
     max_size = 0
     for t in results:
         # there are only NOT patterns
-        if not matchesAND:
+        if not nodesAND:
             blnums[t] = bnodes[t-1]
             counts[t] = 0
             nNs[t] = 'n'
@@ -730,7 +853,37 @@ def voom_Grep(): #{{{2
         loclist .append(d)
     #print('\n'.join(loclist))
 
-    vim.command("call setqflist([%s],'a')" %(''.join(loclist)) )
+    vimCommand("call setqflist([%s],'a')" %(''.join(loclist)) )
+
+
+def blnumsToNodes(bnodes, blnums): #{{{2
+    """Map list of Body lnums of matches (ascending) to nodes. Return
+    {tlnum: [number of matches in node, Body lnum of first match], ...}.
+    """
+    nodes = {}
+    for bln in blnums:
+        bln = int(bln)
+        tln = bisect.bisect_right(bnodes, bln)
+        if tln in nodes:
+            nodes[tln][0]+=1
+        else:
+            nodes[tln] = [1, bln]
+    return nodes
+
+
+def subtreeRanges(VO, tlnums): #{{{2
+    """Return list of (tlnum, tlnum of last subnode) for nodes in tlnums
+    (dict or list of Tree lnums). Nodes inside a previous range are skipped:
+    their subnodes are already in that range.
+    """
+    ends = voom_core.getIndex(VO)
+    ranges = []
+    tEnd_ = 0
+    for t in sorted(tlnums):
+        if t <= tEnd_: continue
+        tEnd_ = ends[t-1]
+        ranges.append((t, tEnd_))
+    return ranges
 
 
 def intersectDicts(dictsAND, dictsNOT): #{{{2
@@ -770,43 +923,16 @@ def intersectDicts(dictsAND, dictsNOT): #{{{2
 # Subsequent VimScript code relies on l:blnShow.
 
 
-def setLevTreeLines(tlines, levels, j): #{{{2
-    """Set level of each Tree line in tlines to corresponding level from levels.
-    levels should be VO.levels.
-    j is index of the first item in levels.
-    """
-    results = []
-    i = 0
-    for t in tlines:
-        results.append('%s%s%s' %(t[:2], '. '*(levels[j+i]-1), t[t.index('|'):]))
-        i+=1
-    return results
-
-
-def changeLevBodyHead(VO, h, levDelta): #{{{2
-    """Increase or decrease level number of Body headline by levDelta.
-    NOTE: markup modes can replace this function with hook_changeLevBodyHead.
-    """
-    if levDelta==0: return h
-    m = VO.marker_re.search(h)
-    level = int(m.group(1))
-    return '%s%s%s' %(h[:m.start(1)], level+levDelta, h[m.end(1):])
+# Vim expression: fingerprint of clipboard register, see voom_core.Clip.
+CLIP_FP = "exists('*sha256') ? sha256(@%s) : ''"
 
 
-def newHeadline(VO, level, blnum, ln): #{{{2
-    """Return (tree_head, bodyLines).
-    tree_head is new headline string in Tree buffer (text after |).
-    bodyLines is list of lines to insert in Body buffer.
+def setClipboard(s, enc=None, clip=None): #{{{2
+    """Set Vim register CLIPBOARD (usually +) to string s. enc is Vim encoding.
+    If s are lines of Clip clip, set its fingerprint.
     """
-    tree_head = 'NewHeadline'
-    bodyLines = ['---%s--- %s%s' %(tree_head, VO.marker, level), '']
-    return (tree_head, bodyLines)
-
-
-def setClipboard(s): #{{{2
-    """Set Vim register CLIPBOARD (usually +) to string s."""
     # important: use '' for Vim string
-    vim.command("let @%s = '%s'" %(CLIPBOARD, s.replace("'", "''")))
+    vimCommand("let @%s = '%s'" %(CLIPBOARD, s.replace("'", "''")))
 
     # The above failed once: empty clipboard after copy/delete >5MB outline.
     # Could not reproduce after Windows restart. Probably stale system. Thus
@@ -817,25 +943,57 @@ def setClipboard(s): #{{{2
     if IS_PY2: # Python 2: s is bytes string
         len_s = len(s)
     else:      # Python 3: s is unicode string
-        len_s = len(s.encode(get_vim_encoding(), 'replace'))
-    if not vim.eval('len(@%s)' %CLIPBOARD) == '%s' % len_s:
-        vim.command("call voom#ErrorMsg('VOoM: error setting clipboard (Vim register %s)')" %CLIPBOARD)
+        len_s = len(s.encode(enc or get_vim_encoding(), 'replace'))
+    len_r, fp = vimGet('len(@%s)' %CLIPBOARD, CLIP_FP %CLIPBOARD)
+    if not len_r == '%s' % len_s:
+        vimCommand("call voom#ErrorMsg('VOoM: error setting clipboard (Vim register %s)')" %CLIPBOARD)
         # empty clipboard to prevent Paste with erroneous data
-        vim.command("let @%s=''" %CLIPBOARD)
+        vimCommand("let @%s=''" %CLIPBOARD)
         return -1
+    if clip:
+        clip.fp, clip.pending = fp, False
     return 0
 
 
+def clipToRegister(clip, enc, lazy): #{{{2
+    """Put lines of Clip clip in Vim register CLIPBOARD. If lazy, the register
+    is not changed: Paste uses clip while the register stays the same, it is
+    written by voom_ClipboardMirror(). Return -1 if there was an error.
+    """
+    if lazy:
+        # not possible without sha256()
+        clip.fp = vimEval(CLIP_FP %CLIPBOARD)
+        if clip.fp:
+            clip.pending = True
+            return 0
+    return setClipboard('\n'.join(clip.blines), enc, clip)
+
+
+@countVimCalls
+def voom_ClipboardMirror(): #{{{2
+    """Write lines of the last Copy or Cut to Vim register CLIPBOARD if that
+    was not done because of g:voom_clipboard_lazy and the register was not
+    changed since then.
+    """
+    clip = voom_core.CLIPS and voom_core.CLIPS[0]
+    if not (clip and clip.pending):
+        return
+    clip.pending = False
+    if vimEval(CLIP_FP %CLIPBOARD) == clip.fp:
+        setClipboard('\n'.join(clip.blines), clip=clip)
+
+
+@countVimCalls
 def voom_OopVerify(): #{{{2
-    body, tree = int(vim.eval('a:body')), int(vim.eval('a:tree'))
+    body, tree = [int(i) for i in vimGet('a:body', 'a:tree')]
     VO = VOOMS[body]
     assert VO.tree == tree
     ok = True
 
     tlines, bnodes, levels  = VO.makeOutline(VO, VO.Body)
     if not len(VO.Tree)==len(tlines)+1:
-        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree size')")
-        vim.command("call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
+        vimCommand("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree size')",
+                "call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
         ok = False
         return
     tlines[0:0], bnodes[0:0], levels[0:0] = [VO.bname], [1], [1]
@@ -843,20 +1001,21 @@ def voom_OopVerify(): #{{{2
     tlines[snLn-1] = '=%s' %tlines[snLn-1][1:]
 
     if not VO.bnodes == bnodes:
-        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong bnodes')")
-        vim.command("call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
+        vimCommand("call voom#ErrorMsg('VOoM: outline verification failed: wrong bnodes')",
+                "call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
         return
     if not VO.levels == levels:
         ok = False
-        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong levels')")
+        vimCommand("call voom#ErrorMsg('VOoM: outline verification failed: wrong levels')")
     if not VO.Tree[:] == tlines:
         ok = False
-        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree lines')")
+        vimCommand("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree lines')")
 
     if ok:
-        vim.command("let l:ok=1")
+        vimCommand("let l:ok=1")
 
 
+@countVimCalls
 def voom_OopSelEnd(): #{{{2
     """This is part of voom#Oop() checks.
     Selection in Tree starts at line ln1 and ends at line ln2.
@@ -864,8 +1023,7 @@ def voom_OopSelEnd(): #{{{2
     Return lnum of last node in the last sibling node's branch.
     Return 0 if selection is invalid.
     """
-    body = int(vim.eval('l:body'))
-    ln1, ln2  = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:ln1', 'l:ln2')]
     if ln1==1: return 0
     levels = VOOMS[body].levels
     z, lev0 = len(levels), levels[ln1-1]
@@ -878,18 +1036,19 @@ def voom_OopSelEnd(): #{{{2
     return z
 
 
+@countVimCalls
 def voom_OopSelectBodyRange(): # {{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     bln1, bln2 = nodesBodyRange(VO, ln1, ln2)
-    vim.command("let [l:bln1,l:bln2]=[%s,%s]" %(bln1,bln2))
+    vimLet(bln1=bln1, bln2=bln2)
 
 
+@countVimCalls
 def voom_OopEdit(): # {{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    lnum, op = int(vim.eval('l:lnum')), vim.eval('a:op')
+    body, tree, lnum, op = vimGet('l:body', 'l:tree', 'l:lnum', 'a:op')
+    body, tree, lnum = int(body), int(tree), int(lnum)
     VO = VOOMS[body]
     assert VO.tree == tree
     if op=='i':
@@ -899,12 +1058,13 @@ def voom_OopEdit(): # {{{2
             bLnr = VO.bnodes[lnum]-1
         else:
             bLnr = len(VO.Body)
-    vim.command("let l:bLnr=%s" %(bLnr))
+    vimCommand("let l:bLnr=%s" %(bLnr))
 
 
+@countVimCalls
 def voom_OopInsert(as_child=False): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln, ln_status = int(vim.eval('l:ln')), vim.eval('l:ln_status')
+    body, tree, ln, ln_status = vimGet('l:body', 'l:tree', 'l:ln', 'l:ln_status')
+    body, tree, ln = int(body), int(tree), int(ln)
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree, levels, snLn = VO.Body, VO.Tree, VO.levels, VO.snLn
@@ -940,221 +1100,103 @@ def voom_OopInsert(as_child=False): #{{{2
     tree_head, bodyLines = VO.newHeadline(VO,lev,bLnum,ln)
 
     treeLine = '= %s|%s' %('. '*(lev-1), tree_head)
+    spliceTreeLevels(VO, ln, ln, [lev])
     Tree[ln:ln] = [treeLine]
     Body[bLnum:bLnum] = bodyLines
-
-    vim.command('let l:bLnum=%s' %(bLnum+1))
+    voom_core.resetIndex(VO)
+    voom_core.addWritten(VO, len(bodyLines), 1)
 
     # write = mark and set snLn to new headline
     Tree[ln] = '=' + Tree[ln][1:]
     VO.snLn = ln+1
-    vim.command('call voom#SetSnLn(%s,%s)' %(body, ln+1))
+    vimCommand('let l:bLnum=%s' %(bLnum+1),
+            'call voom#SetSnLn(%s,%s)' %(body, ln+1))
 
 
+@countVimCalls
 def voom_OopCopy(): #{{{2
-    body = int(vim.eval('l:body'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, ln1, ln2, lazy = [int(i) for i in
+            vimGet('l:body', 'l:ln1', 'l:ln2', 'g:voom_clipboard_lazy')]
     VO = VOOMS[body]
-    Body, bnodes = VO.Body, VO.bnodes
 
     # body lines to copy
-    bln1 = bnodes[ln1-1]
-    if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
-    else: bln2 = len(Body)
-    blines = Body[bln1-1:bln2]
-    setClipboard('\n'.join(blines))
+    clip = voom_core.clipNodes(VO, ln1, ln2)
+    clipToRegister(clip, VO.enc, lazy)
 
-    vim.command('let l:pyOK=1')
+    vimCommand('let l:pyOK=1')
 
 
+@countVimCalls
 def voom_OopCut(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
-    lnUp1 = int(vim.eval('l:lnUp1'))
+    body, tree, ln1, ln2, lnUp1, lazy = [int(i) for i in
+            vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2', 'l:lnUp1', 'g:voom_clipboard_lazy')]
     VO = VOOMS[body]
     assert VO.tree == tree
-    Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
-
-    # diagram {{{
-    # .............. blnUp1-1
-    # ============== blnUp1=bnodes[lnUp1-1]
-    # ..............
-    # ============== bln1=bnodes[ln1-1]
-    # range being
-    # deleted
-    # .............. bln2=bnodes[ln2]-1, or last Body line
-    # ==============
-    # .............. }}}
 
-    ### copy and delete body lines
-    bln1 = bnodes[ln1-1]
-    if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
-    else: bln2 = len(Body)
-    blines = Body[bln1-1:bln2]
-    error = setClipboard('\n'.join(blines))
+    ### copy body lines
+    clip = voom_core.clipNodes(VO, ln1, ln2)
+    error = clipToRegister(clip, VO.enc, lazy)
     if error:
-        vim.command("call voom#ErrorMsg('VOoM (cut): outline operation aborted')")
-        vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-        vim.command('let l:pyOK=1')
+        vimCommand("call voom#ErrorMsg('VOoM (cut): outline operation aborted')",
+                "call voom#OopFromBody(%s,%s,-1)" %(body,tree),
+                'let l:pyOK=1')
         return
-    Body[bln1-1:bln2] = []
-
-    blnShow = bnodes[lnUp1-1] # does not change
-
-    ### update bnodes
-    # decrement lnums after deleted range
-    delta = bln2-bln1+1
-    for i in xrange(ln2,len(bnodes)):
-        bnodes[i]-=delta
-    # cut
-    bnodes[ln1-1:ln2] = []
-
-    ### delete range in levels (same as in Tree)
-    levels[ln1-1:ln2] = []
-
-    if VO.hook_doBodyAfterOop:
-        VO.hook_doBodyAfterOop(VO, 'cut', 0,  None, None,  None, None,  bln1-1, ln1-1)
 
-    ### ---go back to Tree---
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
-
-    ### remove = mark before modifying Tree
-    snLn = VO.snLn
-    Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
-    ### delete range in Tree (same as in levels))
-    Tree[ln1-1:ln2] = []
-
-    ### add snLn mark
-    Tree[lnUp1-1] = '=' + Tree[lnUp1-1][1:]
-    VO.snLn = lnUp1
+    ### delete nodes, go back to Tree after modifying Body
+    fromBody = lambda blnShow: vimCommand("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    blnShow = voom_core.cutNodes(VO, ln1, ln2, lnUp1, fromBody)
 
     # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    vimLet(blnShow=blnShow, pyOK=1)
 
 
+@countVimCalls
 def voom_OopPaste(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln, ln_status = int(vim.eval('l:ln')), vim.eval('l:ln_status')
+    body, tree, ln, ln_status, fp = vimGet('l:body', 'l:tree', 'l:ln', 'l:ln_status',
+            CLIP_FP %CLIPBOARD)
+    body, tree, ln = int(body), int(tree), int(ln)
     VO = VOOMS[body]
     assert VO.tree == tree
-    Body, Tree = VO.Body, VO.Tree
-    levels, bnodes = VO.levels, VO.bnodes
 
     ### clipboard
-    pText = vim.eval('@%s' %CLIPBOARD)
-    if not pText:
-        vim.command("call voom#ErrorMsg('VOoM (paste): clipboard is empty')")
-        vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-        vim.command('let l:pyOK=1')
-        return
-    pBlines = pText.split('\n') # Body lines to paste
-    pTlines, pBnodes, pLevels = VO.makeOutline(VO, pBlines)
+    # Register holds lines of a recent Copy or Cut: do not read and parse them.
+    clip = voom_core.findClip(fp)
+    if clip is None:
+        pText = vimEval('@%s' %CLIPBOARD)
+        if not pText:
+            vimCommand("call voom#ErrorMsg('VOoM (paste): clipboard is empty')",
+                    "call voom#OopFromBody(%s,%s,-1)" %(body,tree),
+                    'let l:pyOK=1')
+            return
+        clip = voom_core.addClip(voom_core.Clip(pText.split('\n')))
+        clip.fp = fp
+    # Body lines to paste and their outline
+    pBlines, pTlines, pBnodes, pLevels = voom_core.clipOutline(VO, clip)
 
     ### verify that clipboard is a valid outline
-    if pBnodes==[] or pBnodes[0]!=1:
-        vim.command("call voom#ErrorMsg('VOoM (paste): invalid clipboard--first line is not a headline')")
-        vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-        vim.command('let l:pyOK=1')
+    error, warning = voom_core.checkNodes(pBnodes, pLevels)
+    if error:
+        vimCommand("call voom#ErrorMsg('VOoM (paste): invalid clipboard--%s')" %error,
+                "call voom#OopFromBody(%s,%s,-1)" %(body,tree),
+                'let l:pyOK=1')
         return
-    lev_ = pLevels[0]
-    for lev in pLevels:
-        # there is node with level smaller than that of the first node
-        if lev < pLevels[0]:
-            vim.command("call voom#ErrorMsg('VOoM (paste): invalid clipboard--root level error')")
-            vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-            vim.command('let l:pyOK=1')
-            return
-        # level incremented by 2 or more
-        elif lev-lev_ > 1:
-            vim.command("call voom#WarningMsg('VOoM (paste): inconsistent levels in clipboard--level incremented by >1', ' ')")
-        lev_ = lev
-
-    ### compute where to insert and at what level
-    # insert nodes after node at ln at level lev
-    # if node is folded, insert after the end of node's tree
-    lev = levels[ln-1] # default level
-    # after first Tree line: use level of next node in case min level is not 1 (wiki mode)
-    if ln==1:
-        if len(levels)>1: lev = levels[1]
-        else: lev=1
-    # after last Tree line, same level
-    elif ln==len(levels): pass
-    # node has children, it can be folded
-    elif lev < levels[ln]:
-        # folded: insert after current node's branch, same level
-        if ln_status=='folded': ln += nodeSubnodes(VO,ln)
-        # not folded, insert as child
-        else: lev+=1
-
-    ### adjust levels of nodes being inserted
-    levDelta = lev - pLevels[0]
-    if levDelta:
-        pLevels = [(lev+levDelta) for lev in pLevels]
-        f = VO.changeLevBodyHead
-        if f:
-            for bl in pBnodes:
-                pBlines[bl-1] = f(VO, pBlines[bl-1], levDelta)
-
-    ### insert body lines in Body
-    # bln is Body lnum after which to insert
-    if ln < len(bnodes): bln = bnodes[ln]-1
-    else: bln = len(Body)
-    Body[bln:bln] = pBlines
-    blnShow = bln+1
-
-    ### update bnodes
-    # increment bnodes being pasted
-    for i in xrange(0,len(pBnodes)):
-        pBnodes[i]+=bln
-    # increment bnodes after pasted region
-    delta = len(pBlines)
-    for i in xrange(ln,len(bnodes)):
-        bnodes[i]+=delta
-    # insert pBnodes after ln
-    bnodes[ln:ln] = pBnodes
-
-    ### insert new levels in levels
-    levels[ln:ln] = pLevels
-
-    ### start and end lnums of inserted region
-    ln1 = ln+1
-    ln2 = ln+len(pBnodes)
-
-    if VO.hook_doBodyAfterOop:
-        VO.hook_doBodyAfterOop(VO, 'paste', levDelta,
-                    blnShow, ln1,
-                    blnShow+len(pBlines)-1, ln2,
-                    None, None)
-
-    ### ---go back to Tree---
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    if warning:
+        vimCommand("call voom#WarningMsg('VOoM (paste): %s', ' ')" %warning)
 
-    # remove = mark before modifying Tree
-    snLn = VO.snLn
-    Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
-    ### adjust levels of new headlines, insert them in Tree
-    if levDelta:
-        pTlines = setLevTreeLines(pTlines, levels, ln1-1)
-    Tree[ln:ln] = pTlines
+    ### insert nodes, go back to Tree after modifying Body
+    fromBody = lambda blnShow: vimCommand("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    ln1, ln2, blnShow = voom_core.pasteNodes(VO, ln, ln_status=='folded',
+            pBlines, pTlines, pBnodes, pLevels, fromBody)
 
     ### start and end lnums of inserted region
-    vim.command('let l:ln1=%s' %ln1)
-    vim.command('let l:ln2=%s' %ln2)
-    # set snLn to first headline of inserted nodes
-    Tree[ln1-1] = '=' + Tree[ln1-1][1:]
-    VO.snLn = ln1
-
-    # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    # set l:pyOK to tell vim script that there were no errors
+    vimLet(ln1=ln1, ln2=ln2, blnShow=blnShow, pyOK=1)
 
 
+@countVimCalls
 def voom_OopUp(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
-    lnUp1, lnUp2 = int(vim.eval('l:lnUp1')), int(vim.eval('l:lnUp2'))
+    body, tree, ln1, ln2, lnUp1, lnUp2 = [int(i) for i in
+            vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2', 'l:lnUp1', 'l:lnUp2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
@@ -1185,33 +1227,40 @@ def voom_OopUp(): #{{{2
         levNew = levels[lnUp2-1]
     levDelta = levNew-levOld
 
-    ### body lines to move
+    ### move body lines
+    # Moving range before which to move down instead of moving range up gives
+    # the same result. Move the smaller range.
     bln1 = bnodes[ln1-1]
     if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
     else: bln2 = len(Body)
-    blines = Body[bln1-1:bln2]
-    if levDelta:
-        f = VO.changeLevBodyHead
+    blnUp1 = bnodes[lnUp1-1]
+    blnShow = blnUp1
+    nMoved = bln2-bln1+1
+    f = levDelta and VO.changeLevBodyHead
+    if bln1-blnUp1 < nMoved:
+        # change levels in place, insert range before after range being moved, cut
+        bWritten = voom_core.changeLevBodyHeads(VO, ln1, ln2, levDelta)
+        blines = Body[blnUp1-1:bln1-1]
+        Body[bln2:bln2] = blines
+        Body[blnUp1-1:bln1-1] = []
+        bWritten += len(blines)
+    else:
+        blines = Body[bln1-1:bln2]
         if f:
             for bl in bnodes[ln1-1:ln2]:
                 blines[bl-bln1] = f(VO, blines[bl-bln1], levDelta)
-
-    ### move body lines: cut, then insert
-    # insert before line blnUp1, it will not change after bnodes update
-    blnUp1 = bnodes[lnUp1-1]
-    blnShow = blnUp1
-    Body[bln1-1:bln2] = []
-    Body[blnUp1-1:blnUp1-1] = blines
+        # cut, then insert before line blnUp1, it will not change after bnodes update
+        Body[bln1-1:bln2] = []
+        Body[blnUp1-1:blnUp1-1] = blines
+        bWritten = len(blines)
 
     ###update bnodes
     # increment lnums in the range before which the move is made
     delta = bln2-bln1+1
-    for i in xrange(lnUp1-1,ln1-1):
-        bnodes[i]+=delta
+    voom_core.shiftBnodes(bnodes, lnUp1-1, ln1-1, delta)
     # decrement lnums in the range which is being moved
     delta = bln1-blnUp1
-    for i in xrange(ln1-1,ln2):
-        bnodes[i]-=delta
+    voom_core.shiftBnodes(bnodes, ln1-1, ln2, -delta)
     # cut, insert
     nLines = bnodes[ln1-1:ln2]
     bnodes[ln1-1:ln2] = []
@@ -1219,46 +1268,66 @@ def voom_OopUp(): #{{{2
 
     ### update levels (same as for Tree)
     nLevels = levels[ln1-1:ln2]
+    upLevels = levels[lnUp1-1:ln1-1]
     if levDelta:
         nLevels = [(lev+levDelta) for lev in nLevels]
     # cut, then insert
     levels[ln1-1:ln2] = []
     levels[lnUp1-1:lnUp1-1] = nLevels
+    voom_core.resetIndex(VO)
 
     if VO.hook_doBodyAfterOop:
         VO.hook_doBodyAfterOop(VO, 'up', levDelta,
                     blnShow, lnUp1,
-                    blnShow+len(blines)-1, lnUp1+len(nLevels)-1,
-                    bln1-1+len(blines), ln1-1+len(nLevels))
+                    blnShow+nMoved-1, lnUp1+len(nLevels)-1,
+                    bln1-1+nMoved, ln1-1+len(nLevels))
 
     ### ---go back to Tree---
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    vimCommand("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
 
     ### remove snLn mark before modifying Tree
     snLn = VO.snLn
     Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
 
-    ### update Tree (same as for levels)
-    tlines = Tree[ln1-1:ln2]
-    if levDelta:
-        tlines = setLevTreeLines(tlines, levels, lnUp1-1)
-    # cut, then insert
-    Tree[ln1-1:ln2] = []
-    Tree[lnUp1-1:lnUp1-1] = tlines
+    ### update Tree (same as for Body)
+    if ln1-lnUp1 < len(nLevels):
+        tWritten = 0
+        if levDelta:
+            tlines = setLevTreeLines(Tree[ln1-1:ln2], levels, lnUp1-1)
+            spliceTreeLevels(VO, ln1-1, ln2, nLevels)
+            Tree[ln1-1:ln2] = tlines
+            tWritten = len(tlines)
+        tlines = Tree[lnUp1-1:ln1-1]
+        spliceTreeLevels(VO, ln2, ln2, upLevels)
+        Tree[ln2:ln2] = tlines
+        spliceTreeLevels(VO, lnUp1-1, ln1-1, [])
+        Tree[lnUp1-1:ln1-1] = []
+        tWritten += len(tlines)
+    else:
+        tlines = Tree[ln1-1:ln2]
+        if levDelta:
+            tlines = setLevTreeLines(tlines, levels, lnUp1-1)
+        # cut, then insert
+        spliceTreeLevels(VO, ln1-1, ln2, [])
+        Tree[ln1-1:ln2] = []
+        spliceTreeLevels(VO, lnUp1-1, lnUp1-1, nLevels)
+        Tree[lnUp1-1:lnUp1-1] = tlines
+        tWritten = len(tlines)
+    voom_core.addWritten(VO, bWritten, tWritten)
 
     ### add snLn mark
     Tree[lnUp1-1] = '=' + Tree[lnUp1-1][1:]
     VO.snLn = lnUp1
 
     # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    vimLet(blnShow=blnShow, pyOK=1)
 
 
+@countVimCalls
 def voom_OopDown(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
-    lnDn1, lnDn1_status = int(vim.eval('l:lnDn1')), vim.eval('l:lnDn1_status')
+    body, tree, ln1, ln2, lnDn1, lnDn1_status = vimGet('l:body', 'l:tree',
+            'l:ln1', 'l:ln2', 'l:lnDn1', 'l:lnDn1_status')
+    body, tree, ln1, ln2, lnDn1 = int(body), int(tree), int(ln1), int(ln2), int(lnDn1)
     # note: lnDn1 == ln2+1
     VO = VOOMS[body]
     assert VO.tree == tree
@@ -1295,31 +1364,39 @@ def voom_OopDown(): #{{{2
             levNew+=1
     levDelta = levNew-levOld
 
-    ### body lines to move
+    ### move body lines
+    # Moving range after which to move up instead of moving range down gives
+    # the same result. Move the smaller range.
     bln1 = bnodes[ln1-1]
     bln2 = bnodes[ln2]-1
-    blines = Body[bln1-1:bln2]
-    if levDelta:
-        f = VO.changeLevBodyHead
+    if lnIns < len(bnodes): blnIns = bnodes[lnIns]-1
+    else: blnIns = len(Body)
+    nMoved = bln2-bln1+1
+    f = levDelta and VO.changeLevBodyHead
+    if blnIns-bln2 < nMoved:
+        # change levels in place, cut range after which to move, insert it before range being moved
+        bWritten = voom_core.changeLevBodyHeads(VO, ln1, ln2, levDelta)
+        blines = Body[bln2:blnIns]
+        Body[bln2:blnIns] = []
+        Body[bln1-1:bln1-1] = blines
+        bWritten += len(blines)
+    else:
+        blines = Body[bln1-1:bln2]
         if f:
             for bl in bnodes[ln1-1:ln2]:
                 blines[bl-bln1] = f(VO, blines[bl-bln1], levDelta)
-
-    ### move body lines: insert, then cut
-    if lnIns < len(bnodes): blnIns = bnodes[lnIns]-1
-    else: blnIns = len(Body)
-    Body[blnIns:blnIns] = blines
-    Body[bln1-1:bln2] = []
+        # insert, then cut
+        Body[blnIns:blnIns] = blines
+        Body[bln1-1:bln2] = []
+        bWritten = len(blines)
 
     ### update bnodes
     # increment lnums in the range which is being moved
     delta = blnIns-bln2
-    for i in xrange(ln1-1,ln2):
-        bnodes[i]+=delta
+    voom_core.shiftBnodes(bnodes, ln1-1, ln2, delta)
     # decrement lnums in the range after which the move is made
     delta = bln2-bln1+1
-    for i in xrange(ln2,lnIns):
-        bnodes[i]-=delta
+    voom_core.shiftBnodes(bnodes, ln2, lnIns, -delta)
     # insert, cut
     nLines = bnodes[ln1-1:ln2]
     bnodes[lnIns:lnIns] = nLines
@@ -1329,49 +1406,67 @@ def voom_OopDown(): #{{{2
     snLn_ = VO.snLn
     snLn = lnIns+1-(ln2-ln1+1)
     VO.snLn = snLn
-    vim.command('let snLn=%s' %snLn)
 
     blnShow = bnodes[snLn-1] # must compute after bnodes update
 
     ### update levels (same as for Tree)
     nLevels = levels[ln1-1:ln2]
+    dnLevels = levels[ln2:lnIns]
     if levDelta:
         nLevels = [(lev+levDelta) for lev in nLevels]
     # insert, then cut
     levels[lnIns:lnIns] = nLevels
     levels[ln1-1:ln2] = []
+    voom_core.resetIndex(VO)
 
     if VO.hook_doBodyAfterOop:
         VO.hook_doBodyAfterOop(VO, 'down', levDelta,
                     blnShow, snLn,
-                    blnShow+len(blines)-1, snLn+len(nLevels)-1,
+                    blnShow+nMoved-1, snLn+len(nLevels)-1,
                     bln1-1, ln1-1)
 
     ### ---go back to Tree---
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    vimCommand("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
 
     ### remove snLn mark before modifying Tree
     Tree[snLn_-1] = ' ' + Tree[snLn_-1][1:]
 
-    ### update Tree (same as for levels)
-    tlines = Tree[ln1-1:ln2]
-    if levDelta:
-        tlines = setLevTreeLines(tlines, levels, snLn-1)
-    # insert, then cut
-    Tree[lnIns:lnIns] = tlines
-    Tree[ln1-1:ln2] = []
+    ### update Tree (same as for Body)
+    if lnIns-ln2 < len(nLevels):
+        tWritten = 0
+        if levDelta:
+            tlines = setLevTreeLines(Tree[ln1-1:ln2], levels, snLn-1)
+            spliceTreeLevels(VO, ln1-1, ln2, nLevels)
+            Tree[ln1-1:ln2] = tlines
+            tWritten = len(tlines)
+        tlines = Tree[ln2:lnIns]
+        spliceTreeLevels(VO, ln2, lnIns, [])
+        Tree[ln2:lnIns] = []
+        spliceTreeLevels(VO, ln1-1, ln1-1, dnLevels)
+        Tree[ln1-1:ln1-1] = tlines
+        tWritten += len(tlines)
+    else:
+        tlines = Tree[ln1-1:ln2]
+        if levDelta:
+            tlines = setLevTreeLines(tlines, levels, snLn-1)
+        # insert, then cut
+        spliceTreeLevels(VO, lnIns, lnIns, nLevels)
+        Tree[lnIns:lnIns] = tlines
+        spliceTreeLevels(VO, ln1-1, ln2, [])
+        Tree[ln1-1:ln2] = []
+        tWritten = len(tlines)
+    voom_core.addWritten(VO, bWritten, tWritten)
 
     ### add snLn mark
     Tree[snLn-1] = '=' + Tree[snLn-1][1:]
 
     # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    vimLet(blnShow=blnShow, snLn=snLn, pyOK=1)
 
 
+@countVimCalls
 def voom_OopRight(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
@@ -1386,19 +1481,16 @@ def voom_OopRight(): #{{{2
     # move right is not allowed
     elif VO.MTYPE > 1:
         cannotmove = True
-        vim.command("call voom#ErrorMsg('VOoM: operation ''Move Right'' is not available in this markup mode')")
+        vimCommand("call voom#ErrorMsg('VOoM: operation ''Move Right'' is not available in this markup mode')")
     if cannotmove:
-        vim.command("let &fdm=b_fdm")
-        vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-        vim.command('let l:doverif=0')
-        vim.command('let l:pyOK=1')
+        vimCommand("let &fdm=b_fdm",
+                "call voom#OopFromBody(%s,%s,-1)" %(body,tree),
+                'let l:doverif=0',
+                'let l:pyOK=1')
         return
 
     ### change levels of Body headlines
-    f = VO.changeLevBodyHead
-    if f:
-        for bln in bnodes[ln1-1:ln2]:
-            Body[bln-1] = f(VO, Body[bln-1], 1)
+    bWritten = voom_core.changeLevBodyHeads(VO, ln1, ln2, 1)
 
     # new snLn will be set to ln1
     blnShow = bnodes[ln1-1]
@@ -1407,6 +1499,7 @@ def voom_OopRight(): #{{{2
     nLevels = levels[ln1-1:ln2]
     nLevels = [(lev+1) for lev in nLevels]
     levels[ln1-1:ln2] = nLevels
+    voom_core.resetIndex(VO)
 
     if VO.hook_doBodyAfterOop:
         if ln2 < len(bnodes): blnum2 = bnodes[ln2]-1
@@ -1414,13 +1507,15 @@ def voom_OopRight(): #{{{2
         VO.hook_doBodyAfterOop(VO, 'right', 1, blnShow, ln1, blnum2, ln2, None, None)
 
     ### ---go back to Tree---
-    vim.command("let &fdm=b_fdm")
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    vimCommand("let &fdm=b_fdm",
+            "call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
 
     ### change levels of Tree lines (same as for VO.levels)
     tlines = Tree[ln1-1:ln2]
     tlines = setLevTreeLines(tlines, levels, ln1-1)
+    spliceTreeLevels(VO, ln1-1, ln2, nLevels)
     Tree[ln1-1:ln2] = tlines
+    voom_core.addWritten(VO, bWritten, len(tlines))
 
     ### set snLn to ln1
     snLn = VO.snLn
@@ -1431,13 +1526,12 @@ def voom_OopRight(): #{{{2
         VO.snLn = snLn
 
     # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    vimLet(blnShow=blnShow, pyOK=1)
 
 
+@countVimCalls
 def voom_OopLeft(): #{{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
@@ -1455,19 +1549,16 @@ def voom_OopLeft(): #{{{2
     # move left is not allowed
     elif VO.MTYPE > 1:
         cannotmove = True
-        vim.command("call voom#ErrorMsg('VOoM: operation ''Move Left'' is not available in this markup mode')")
+        vimCommand("call voom#ErrorMsg('VOoM: operation ''Move Left'' is not available in this markup mode')")
     if cannotmove:
-        vim.command("let &fdm=b_fdm")
-        vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
-        vim.command('let l:doverif=0')
-        vim.command('let l:pyOK=1')
+        vimCommand("let &fdm=b_fdm",
+                "call voom#OopFromBody(%s,%s,-1)" %(body,tree),
+                'let l:doverif=0',
+                'let l:pyOK=1')
         return
 
     ### change levels of Body headlines
-    f = VO.changeLevBodyHead
-    if f:
-        for bln in bnodes[ln1-1:ln2]:
-            Body[bln-1] = f(VO, Body[bln-1], -1)
+    bWritten = voom_core.changeLevBodyHeads(VO, ln1, ln2, -1)
 
     # new snLn will be set to ln1
     blnShow = bnodes[ln1-1]
@@ -1476,6 +1567,7 @@ def voom_OopLeft(): #{{{2
     nLevels = levels[ln1-1:ln2]
     nLevels = [(lev-1) for lev in nLevels]
     levels[ln1-1:ln2] = nLevels
+    voom_core.resetIndex(VO)
 
     if VO.hook_doBodyAfterOop:
         if ln2 < len(bnodes): blnum2 = bnodes[ln2]-1
@@ -1483,13 +1575,15 @@ def voom_OopLeft(): #{{{2
         VO.hook_doBodyAfterOop(VO, 'left', -1, blnShow, ln1, blnum2, ln2, None, None)
 
     ### ---go back to Tree---
-    vim.command("let &fdm=b_fdm")
-    vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
+    vimCommand("let &fdm=b_fdm",
+            "call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
 
     ### change levels of Tree lines (same as for VO.levels)
     tlines = Tree[ln1-1:ln2]
     tlines = setLevTreeLines(tlines, levels, ln1-1)
+    spliceTreeLevels(VO, ln1-1, ln2, nLevels)
     Tree[ln1-1:ln2] = tlines
+    voom_core.addWritten(VO, bWritten, len(tlines))
 
     ### set snLn to ln1
     snLn = VO.snLn
@@ -1500,108 +1594,106 @@ def voom_OopLeft(): #{{{2
         VO.snLn = snLn
 
     # do this last to tell vim script that there were no errors
-    vim.command('let l:blnShow=%s' %blnShow)
-    vim.command('let l:pyOK=1')
+    vimLet(blnShow=blnShow, pyOK=1)
 
 
+@countVimCalls
 def voom_OopMark(): # {{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
+    bnodes = VO.bnodes
     marker_re = VO.marker_re
 
-    for i in xrange(ln1-1,ln2):
+    tEdits, bEdits = LineEdits(Tree), LineEdits(Body)
+    lnums = []
+    for i, tline in enumerate(Tree[ln1-1:ln2], ln1):
         # insert 'x' in Tree line
-        tline = Tree[i]
         if tline[1]!='x':
-            Tree[i] = '%sx%s' %(tline[0], tline[2:])
-            # insert 'x' in Body headline
-            bln = bnodes[i]
-            bline = Body[bln-1]
-            end = marker_re.search(bline).end(1)
-            Body[bln-1] = '%sx%s' %(bline[:end], bline[end:])
-
-    vim.command('let l:pyOK=1')
-
-
+            tEdits[i] = '%sx%s' %(tline[0], tline[2:])
+            lnums.append(i)
+    # insert 'x' in Body headlines
+    flags = VO.nodeFlags
+    blns = [bnodes[i-1] for i in lnums]
+    for i, bln, bline in zip(lnums, blns, getLines(Body, blns)):
+        end = marker_re.search(bline).end(1)
+        bEdits[bln] = '%sx%s' %(bline[:end], bline[end:])
+        if flags:
+            flags[i-1] |= FLAG_MARKED
+    voom_core.addWritten(VO, bEdits.apply(), tEdits.apply())
+
+    vimCommand('let l:pyOK=1')
+
+
+@countVimCalls
 def voom_OopUnmark(): # {{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
+    bnodes = VO.bnodes
     marker_re = VO.marker_re
 
-    for i in xrange(ln1-1,ln2):
+    tEdits, bEdits = LineEdits(Tree), LineEdits(Body)
+    lnums = []
+    for i, tline in enumerate(Tree[ln1-1:ln2], ln1):
         # remove 'x' from Tree line
-        tline = Tree[i]
         if tline[1]=='x':
-            Tree[i] = '%s %s' %(tline[0], tline[2:])
-            # remove 'x' from Body headline
-            bln = bnodes[i]
-            bline = Body[bln-1]
-            end = marker_re.search(bline).end(1)
-            # remove one 'x', not enough
-            #Body[bln-1] = '%s%s' %(bline[:end], bline[end+1:])
-            # remove all consecutive 'x' chars
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('x'))
-
-    vim.command('let l:pyOK=1')
-
-
+            tEdits[i] = '%s %s' %(tline[0], tline[2:])
+            lnums.append(i)
+    # remove 'x' from Body headlines
+    flags = VO.nodeFlags
+    blns = [bnodes[i-1] for i in lnums]
+    for i, bln, bline in zip(lnums, blns, getLines(Body, blns)):
+        end = marker_re.search(bline).end(1)
+        # remove one 'x', not enough
+        #bEdits[bln] = '%s%s' %(bline[:end], bline[end+1:])
+        # remove all consecutive 'x' chars
+        bline = bEdits[bln] = '%s%s' %(bline[:end], bline[end:].lstrip('x'))
+        # chars after removed 'x' can be new flags
+        if flags:
+            flags[i-1] = markerFlags(bline, marker_re.search(bline))
+    voom_core.addWritten(VO, bEdits.apply(), tEdits.apply())
+
+    vimCommand('let l:pyOK=1')
+
+
+@countVimCalls
 def voom_OopMarkStartup(): # {{{2
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln = int(vim.eval('l:ln'))
+    body, tree, ln = [int(i) for i in vimGet('l:body', 'l:tree', 'l:ln')]
     VO = VOOMS[body]
     assert VO.tree == tree
-    Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
+    Body = VO.Body
+    bnodes = VO.bnodes
     marker_re = VO.marker_re
 
-    if ln==1:
-        bln_selected = 0
-    else:
-        bln_selected = bnodes[ln-1]
+    flags = getNodeFlags(VO)
+    edits = LineEdits(Body)
     # remove '=' from all other Body headlines
     # also, strip 'x' and 'o' after removed '='
-    for bln in bnodes[1:]:
-        if bln==bln_selected: continue
-        bline = Body[bln-1]
+    lnums = [i+1 for i in xrange(1,len(flags)) if flags[i] & FLAG_STARTUP and i+1 != ln]
+    blns = [bnodes[i-1] for i in lnums]
+    for i, bln, bline in zip(lnums, blns, getLines(Body, blns)):
         end = marker_re.search(bline).end()
-        bline2 = bline[end:]
-        if not bline2: continue
-        if bline2[0]=='=':
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('=xo'))
-        elif bline2[0]=='o' and bline2[1:] and bline2[1]=='=':
-            Body[bln-1] = '%s%s' %(bline[:end+1], bline[end+1:].lstrip('=xo'))
-
-    if ln==1:
-        vim.command('let l:pyOK=1')
-        return
+        # '=' or 'o=' after marker+level+'x'
+        if bline[end]=='o':
+            end+=1
+        bline = edits[bln] = '%s%s' %(bline[:end], bline[end:].lstrip('=xo'))
+        flags[i-1] = markerFlags(bline, marker_re.search(bline))
 
     # insert '=' in current Body headline, but only if it's not there already
-    bline = Body[bln_selected-1]
-    end = marker_re.search(bline).end()
-    bline2 = bline[end:]
-    if not bline2:
-        Body[bln_selected-1] = '%s=' %bline
-        vim.command('let l:pyOK=1')
-        return
-    if bline2[0]=='=':
-        vim.command('let l:pyOK=1')
-        return
-    elif bline2[0]=='o' and bline2[1:] and bline2[1]=='=':
-        vim.command('let l:pyOK=1')
-        return
-    elif bline2[0]=='o':
-        end+=1
-    Body[bln_selected-1] = '%s=%s' %(bline[:end], bline[end:])
+    if ln > 1 and not flags[ln-1] & FLAG_STARTUP:
+        bln = bnodes[ln-1]
+        bline = Body[bln-1]
+        end = marker_re.search(bline).end()
+        if bline[end:end+1]=='o':
+            end+=1
+        bline = edits[bln] = '%s=%s' %(bline[:end], bline[end:])
+        flags[ln-1] = markerFlags(bline, marker_re.search(bline))
 
-    vim.command('let l:pyOK=1')
+    voom_core.addWritten(VO, edits.apply())
+    vimCommand('let l:pyOK=1')
 
 
 #--- Tree Folding Operations --- {{{2
@@ -1609,14 +1701,18 @@ def voom_OopMarkStartup(): # {{{2
 # By default, folds are closed.
 # Opened folds are marked by 'o' in Body headlines (after 'x', before '=').
 #
-# To determine which folds are currently closed/opened, we open all closed
-# folds one by one, from top to bottom, starting from top level visible folds.
-# This produces list of closed folds.
+# To determine which folds are currently closed/opened, we open all visible
+# closed folds, then closed folds that became visible, and so on, one nesting
+# level at a time. This produces list of closed folds.
 #
 # To restore folding according to a list of closed folds:
 #   open all folds;
 #   close folds from bottom to top.
 #
+# Folds are opened and closed with ":{lnum}foldopen" and ":{lnum}foldclose"
+# (same as "zo" and "zc" at line lnum): all folds are done with one Vim
+# command, foldclosed() is evaluated for many lines with one vim.eval().
+#
 # Conventions:
 #   cFolds --lnums of closed folds
 #   oFolds --lnums of opened folds
@@ -1626,27 +1722,30 @@ def voom_OopMarkStartup(): # {{{2
 # See also:  VOoM**voom_notes.txt#id_20110120011733
 
 
+@countVimCalls
 def voom_OopFolding(action): #{{{3
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
+    if action=='cleanup':
+        body, tree = [int(i) for i in vimGet('l:body', 'l:tree')]
+    else:
+        body, tree, ln1, ln2 = [int(i) for i in vimGet('l:body', 'l:tree', 'a:ln1', 'a:ln2')]
     VO = VOOMS[body]
     assert VO.tree == tree
     # check and adjust range lnums
     # don't worry about invalid range lnums: Vim checks that
     if not action=='cleanup':
-        ln1, ln2 = int(vim.eval('a:ln1')), int(vim.eval('a:ln2'))
         if ln2<ln1: ln1,ln2=ln2,ln1 # probably redundant
         if ln2==1:
-            vim.command('let l:pyOK=1')
+            vimCommand('let l:pyOK=1')
             return
         #if ln1==1: ln1=2
         if ln1==ln2:
             ln2 = ln2 + nodeSubnodes(VO, ln2)
             if ln1==ln2:
-                vim.command('let l:pyOK=1')
+                vimCommand('let l:pyOK=1')
                 return
 
     if action=='save':
-        cFolds = foldingGet(ln1, ln2)
+        cFolds = foldingGet(VO, ln1, ln2)
         foldingWrite(VO, ln1, ln2, cFolds)
     elif action=='restore':
         cFolds = foldingRead(VO, ln1, ln2)
@@ -1654,39 +1753,47 @@ def voom_OopFolding(action): #{{{3
     elif action=='cleanup':
         foldingCleanup(VO)
 
-    vim.command('let l:pyOK=1')
+    vimCommand('let l:pyOK=1')
 
 
-def foldingGet(ln1, ln2): #{{{3
+def foldingGet(VO, ln1, ln2): #{{{3
     """Get all closed folds in line range ln1-ln2, including subfolds.
     If line ln2 is visible and is folded, its subfolds are included.
-    Executed in Tree buffer.
+    Folds are nodes with children. Executed in Tree buffer.
     """
     cFolds = []
-    lnum = ln1
-    # go through top level folded lines (visible closed folds)
-    while lnum < ln2+1:
-        # line lnum is first line of a closed fold
-        if int(vim.eval('foldclosed(%s)' %lnum))==lnum:
-            cFolds.append(lnum)
-            # line after this fold and subfolds
-            foldend = int(vim.eval('foldclosedend(%s)' %lnum))+1
-            lnum0 = lnum
-            lnum = foldend
-            vim.command('keepj normal! %sGzo' %lnum0)
-            # open every folded line in this fold
-            for ln in xrange(lnum0+1, foldend):
-                # line ln is first line of a closed fold
-                if int(vim.eval('foldclosed(%s)' %ln))==ln:
-                    cFolds.append(ln)
-                    vim.command('keepj normal! %sGzo' %ln)
-        else:
-            lnum+=1
-
-    cFolds.reverse()
-    # close back opened folds
-    for ln in cFolds:
-        vim.command('keepj normal! %sGzc' %ln)
+    # nodes with children in range, the last one can be a visible closed fold
+    lnums = [ln for ln in xrange(ln1, ln2+1) if nodeHasChildren(VO, ln)]
+    if not lnums:
+        return cFolds
+    # skip lines hidden in a closed fold that starts before ln1
+    top = True
+    while lnums:
+        foldStarts = vimEval("map(%s, 'foldclosed(v:val)')" %vimLiteral(lnums))
+        closed, hidden = [], []
+        for i in xrange(len(lnums)):
+            f, ln = int(foldStarts[i]), lnums[i]
+            # line ln is first line of a closed fold
+            if f==ln:
+                closed.append(ln)
+            elif f >= ln1:
+                hidden.append(ln)
+        if not closed:
+            break
+        if top:
+            top = False
+            # subfolds of a visible closed fold that extends after ln2
+            end = int(vimEval('foldclosedend(%s)' %closed[-1]))
+            hidden.extend([ln for ln in xrange(ln2+1, end+1) if nodeHasChildren(VO, ln)])
+        # open closed folds, look again at lines that were hidden in them
+        cFolds.extend(closed)
+        vimCommand('|'.join(['%sfoldopen' %ln for ln in closed]))
+        lnums = hidden
+
+    if cFolds:
+        cFolds.sort(reverse=True)
+        # close back opened folds, from bottom to top
+        vimCommand('|'.join(['%sfoldclose' %ln for ln in cFolds]))
     return cFolds
 
 
@@ -1697,12 +1804,12 @@ def foldingCreate(ln1, ln2, cFolds): #{{{3
     """
     #cFolds.sort()
     #cFolds.reverse()
-    #vim.command('%s,%sfoldopen!' %(ln1,ln2))
+    #vimCommand('%s,%sfoldopen!' %(ln1,ln2))
     # see  VOoM**voom_notes.txt#id_20110120011733
-    vim.command(r'try | %s,%sfoldopen! | catch /^Vim\%%((\a\+)\)\=:E490/ | endtry'
+    vimCommand(r'try | %s,%sfoldopen! | catch /^Vim\%%((\a\+)\)\=:E490/ | endtry'
             %(ln1,ln2))
-    for ln in cFolds:
-        vim.command('keepj normal! %sGzc' %ln)
+    if cFolds:
+        vimCommand('|'.join(['%sfoldclose' %ln for ln in cFolds]))
 
 
 def foldingFlip(VO, ln1, ln2, folds): #{{{3
@@ -1722,21 +1829,9 @@ def foldingFlip(VO, ln1, ln2, folds): #{{{3
 
 def foldingRead(VO, ln1, ln2): #{{{3
     """Read "o" marks in Body headlines."""
-    cFolds = []
-    marker_re = VO.marker_re
-    bnodes = VO.bnodes
-    Body = VO.Body
-
-    for ln in xrange(ln1,ln2+1):
-        if not nodeHasChildren(VO, ln):
-            continue
-        bline = Body[bnodes[ln-1]-1]
-        end = marker_re.search(bline).end()
-        if end<len(bline) and bline[end]=='o':
-            continue
-        else:
-            cFolds.append(ln)
-
+    flags = getNodeFlags(VO)
+    cFolds = [ln for ln in xrange(ln1,ln2+1)
+            if nodeHasChildren(VO, ln) and not flags[ln-1] & FLAG_OPENED]
     cFolds.reverse()
     return cFolds
 
@@ -1747,27 +1842,24 @@ def foldingWrite(VO, ln1, ln2, cFolds): #{{{3
     marker_re = VO.marker_re
     bnodes = VO.bnodes
     Body = VO.Body
-
-    for ln in xrange(ln1,ln2+1):
-        if not nodeHasChildren(VO, ln):
-            continue
-        bln = bnodes[ln-1]
-        bline = Body[bln-1]
+    flags = getNodeFlags(VO)
+
+    # headlines marked with 'o' that are closed, not marked that are opened
+    edits = LineEdits(Body)
+    lnums = [ln for ln in xrange(ln1,ln2+1) if nodeHasChildren(VO, ln)
+            and (not flags[ln-1] & FLAG_OPENED) == (not ln in cFolds)]
+    blns = [bnodes[ln-1] for ln in lnums]
+    for ln, bln, bline in zip(lnums, blns, getLines(Body, blns)):
         end = marker_re.search(bline).end()
-        isClosed = ln in cFolds
-        # headline is marked with 'o'
-        if end<len(bline) and bline[end]=='o':
-            # remove 'o' mark
-            if isClosed:
-                Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
-        # headline is not marked with 'o'
+        # remove 'o' mark
+        if flags[ln-1] & FLAG_OPENED:
+            bline = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+        # add 'o' mark
         else:
-            # add 'o' mark
-            if not isClosed:
-                if end==len(bline):
-                    Body[bln-1] = '%so' %bline
-                elif bline[end] != 'o':
-                    Body[bln-1] = '%so%s' %(bline[:end], bline[end:])
+            bline = '%so%s' %(bline[:end], bline[end:])
+        edits[bln] = bline
+        flags[ln-1] = markerFlags(bline, marker_re.search(bline))
+    voom_core.addWritten(VO, edits.apply())
 
 
 def foldingCleanup(VO): #{{{3
@@ -1775,47 +1867,31 @@ def foldingCleanup(VO): #{{{3
     marker_re = VO.marker_re
     bnodes = VO.bnodes
     Body = VO.Body
+    flags = getNodeFlags(VO)
 
-    for ln in xrange(2,len(bnodes)+1):
-        if nodeHasChildren(VO, ln): continue
-        bln = bnodes[ln-1]
-        bline = Body[bln-1]
+    edits = LineEdits(Body)
+    lnums = [ln for ln in xrange(2,len(bnodes)+1)
+            if flags[ln-1] & FLAG_OPENED and not nodeHasChildren(VO, ln)]
+    blns = [bnodes[ln-1] for ln in lnums]
+    for ln, bln, bline in zip(lnums, blns, getLines(Body, blns)):
         end = marker_re.search(bline).end()
-        if end<len(bline) and bline[end]=='o':
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+        bline = edits[bln] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+        flags[ln-1] = markerFlags(bline, marker_re.search(bline))
+    voom_core.addWritten(VO, edits.apply())
 
 
 #--- Sort Operations --- {{{2
-# 1) Sort siblings of the current node.
-# - Get list of siblings of the current node (as Tree lnums).
-#   Two nodes are siblings if they have the same parent and the same level.
-# - Construct list of corresponding Tree headlines. Decorate with indexes and
-#   Tree lnums. Sort by headline text.
-# - Construct new Body region from nodes in sorted order. Replace the region.
-#   IMPORTANT: this does not change outline data (Tree, VO.levels, VO.bnodes)
-#   for nodes with smaller levels or for nodes outside of the siblings region.
-#   Thus, recursive sort is possible.
-#
-# 2) Deep (recursive) sort: sort siblings of the current node and siblings in
-# all subnodes. Sort as above for all groups of siblings in the affected
-# region, starting from the most deeply nested.
-# - Construct list of groups of all siblings: top to bottom, decorate each
-#   siblings group with level and parent lnum.
-# - Reverse sort the list by levels.
-# - Do sort for each group of siblings in the list: from right to left and from
-#   bottom to top.
-#
-# 3) We modify only the Body buffer. We then do global outline update to redraw
-# the Tree and to update outline data. Performing targeted update as in other
-# outline operations is too tedious.
+# Sorting is done by voom_core.sortNodes(), see notes there.
 
 
+@countVimCalls
 def voom_OopSort(): #{{{3
     # Returning before setting l:blnShow means no changes were made.
     ### parse options {{{
     oDeep = False
     D = {'oIgnorecase':0, 'oBytes':0, 'oEnc':0, 'oReverse':0, 'oFlip':0, 'oShuffle':0}
-    options = vim.eval('a:qargs')
+    body, tree, ln1, ln2, options, enc = vimGet('l:body', 'l:tree', 'l:ln1', 'l:ln2',
+            'a:qargs', '&enc')
     options = options.strip().split()
     for o in options:
         if o=='deep': oDeep = True
@@ -1825,26 +1901,21 @@ def voom_OopSort(): #{{{3
         elif o=='shuffle': D['oShuffle']    = 1
         elif o=='bytes':       D['oBytes']    = 1
         else:
-            vim.command("call voom#ErrorMsg('VOoM (sort): invalid option: %s')" %o.replace("'","''"))
-            vim.command("call voom#WarningMsg('VOoM (sort): valid options are: deep, i (ignore-case), r (reverse-sort), flip, shuffle, bytes')")
-            vim.command('let l:pyOK=1')
+            vimCommand("call voom#ErrorMsg('VOoM (sort): invalid option: %s')" %o.replace("'","''"),
+                    "call voom#WarningMsg('VOoM (sort): valid options are: deep, i (ignore-case), r (reverse-sort), flip, shuffle, bytes')",
+                    'let l:pyOK=1')
             return
 
     if (D['oReverse'] + D['oFlip'] + D['oShuffle']) > 1:
-        vim.command("call voom#ErrorMsg('VOoM (sort): these options cannot be combined: r, flip, shuffle')")
-        vim.command('let l:pyOK=1')
+        vimCommand("call voom#ErrorMsg('VOoM (sort): these options cannot be combined: r, flip, shuffle')",
+                'let l:pyOK=1')
         return
 
-    if D['oShuffle']:
-        global shuffle
-        if shuffle is None: from random import shuffle
-
-    D['oEnc'] = get_vim_encoding()
+    D['oEnc'] = get_vim_encoding(enc)
     ###### }}}
 
     ### get other Vim data, compute 'siblings' {{{
-    body, tree = int(vim.eval('l:body')), int(vim.eval('l:tree'))
-    ln1, ln2 = int(vim.eval('l:ln1')), int(vim.eval('l:ln2'))
+    body, tree, ln1, ln2 = int(body), int(tree), int(ln1), int(ln2)
     VO = VOOMS[body]
     assert VO.tree == tree
     Body, Tree = VO.Body, VO.Tree
@@ -1857,161 +1928,68 @@ def voom_OopSort(): #{{{3
         # Tree lnums of all siblings in the range
         siblings = rangeSiblings(VO,ln1,ln2)
         if not siblings:
-            vim.command("call voom#ErrorMsg('VOoM (sort): invalid Tree selection')")
-            vim.command('let l:pyOK=1')
+            vimCommand("call voom#ErrorMsg('VOoM (sort): invalid Tree selection')",
+                    'let l:pyOK=1')
             return
     ###### }}}
     #print('ln1=%s ln2=%s siblings=%s' % (ln1, ln2, siblings))
 
     ### do sorting
     # progress flags: (got >1 siblings, order changed after sort)
-    flag1,flag2 = 0,0
-    if not oDeep:
-        flag1,flag2 = sortSiblings(VO, siblings, **D)
-    else:
-        siblings_groups = getSiblingsGroups(VO,siblings)
-        for group in siblings_groups:
-            m, n = sortSiblings(VO, group, **D)
-            flag1+=m; flag2+=n
+    flag1,flag2 = voom_core.sortNodes(VO, siblings, oDeep, **D)
 
     if flag1==0:
-        vim.command("call voom#WarningMsg('VOoM (sort): nothing to sort')")
-        vim.command('let l:pyOK=1')
+        vimCommand("call voom#WarningMsg('VOoM (sort): nothing to sort')",
+                'let l:pyOK=1')
         return
     elif flag2==0:
-        vim.command("call voom#WarningMsg('VOoM (sort): already sorted')")
-        vim.command('let l:pyOK=1')
+        vimCommand("call voom#WarningMsg('VOoM (sort): already sorted')",
+                'let l:pyOK=1')
         return
 
     # Show first sibling. Tracking the current node and bnode is too hard.
     lnum1 = siblings[0]
     lnum2 = siblings[-1] + nodeSubnodes(VO,siblings[-1])
     blnShow = bnodes[lnum1-1]
-    vim.command('let [l:blnShow,l:lnum1,l:lnum2]=[%s,%s,%s]' %(blnShow, lnum1, lnum2))
-    vim.command('let l:pyOK=1')
-
-
-def sortSiblings(VO, siblings, oIgnorecase, oBytes, oEnc, oReverse, oFlip, oShuffle): #{{{3
-    """Sort sibling nodes. 'siblings' is list of Tree lnums in ascending order.
-    This only modifies Body buffer. Outline data are not updated.
-    Return progress flags (flag1,flag2), see voom_OopSort().
-    """
-    sibs = siblings
-    if len(sibs) < 2:
-        return (0,0)
-    Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
-    z, Z = len(sibs), len(bnodes)
-
-    sibs_dec = [] # list of siblings for sorting
-    if oFlip or oShuffle: # flip or shuffle: Tree headlines don't matter
-        # make list of siblings for sorting
-        #       [(0, index, lnum), ...]
-        for i in xrange(z):
-            sib = sibs[i]
-            sibs_dec.append((0, i, sib))
-        if oFlip:
-            sibs_dec.reverse()
-        elif oShuffle:
-            shuffle(sibs_dec)
-    else: # sort, reverse sort: according to Tree headlines
-        # make list of siblings for sorting, decorate with headline text
-        #       [(Tree headline text, index, lnum), ...]
-        for i in xrange(z):
-            sib = sibs[i]
-            head = Tree[sib-1].split('|',1)[1]
-            if IS_PY2:
-                if not oBytes:
-                    head = unicode(head, oEnc, 'replace')
-            else:
-                if oBytes:
-                    head = bytes(head, oEnc, 'replace')
-            if oIgnorecase:
-                head = head.lower()
-            sibs_dec.append((head, i, sib))
-        if oReverse: # reverse sort
-            sibs_dec.sort(key=lambda x: x[0], reverse=True)
-        else: # sort
-            sibs_dec.sort()
-
-    sibs_sorted = [i[2] for i in sibs_dec]
-    #print(sibs_dec); print(sibs_sorted)
-    # don't sort if already sorted (can happen with shuffle)
-    if sibs==sibs_sorted:
-        return (1,0)
-
-    ### blnum1, blnum2: first and last Body lnums of the affected region
-    blnum1 = bnodes[sibs[0]-1]
-    n = sibs[-1] + nodeSubnodes(VO,sibs[-1])
-    if n < Z:
-        blnum2 = bnodes[n]-1
-    else:
-        blnum2 = len(Body)
-
-    ### construct new Body region
-    blines = []
-    for i in xrange(z):
-        sib = sibs[i]
-        j = sibs_dec[i][1] # index into sibs that points to new sib
-        sib_new = sibs[j]
-
-        # get Body region for sib_new branch
-        bln1 = bnodes[sib_new-1]
-        if j+1 < z:
-            sib_next = sibs[j+1]
-            bln2 = bnodes[sib_next-1]-1
-        else:
-            node_last = sib_new + nodeSubnodes(VO,sib_new)
-            if node_last < Z:
-                bln2 = bnodes[node_last]-1
-            else:
-                bln2 = len(Body)
-
-        blines.extend(Body[bln1-1:bln2])
-
-    ### replace Body region with the new, sorted region
-    body_len = len(Body)
-    Body[blnum1-1:blnum2] = blines
-    assert body_len == len(Body)
-
-    return (1,1)
+    vimLet(blnShow=blnShow, lnum1=lnum1, lnum2=lnum2, pyOK=1)
 
 
 #---EXECUTE SCRIPT----------------------------{{{1
 #
 
+@countVimCalls
 def voom_GetVoomRange(withSubnodes=0): #{{{2
-    body = int(vim.eval('l:body'))
-    VO = VOOMS[body]
-    lnum = int(vim.eval('a:lnum'))
-    if vim.eval('l:bufType')=='Body':
+    body, lnum, bufType = vimGet('l:body', 'a:lnum', 'l:bufType')
+    VO = VOOMS[int(body)]
+    lnum = int(lnum)
+    if bufType=='Body':
         lnum = bisect.bisect_right(VO.bnodes, lnum)
     bln1, bln2 = nodesBodyRange(VO, lnum, lnum, withSubnodes)
-    vim.command("let [l:bln1,l:bln2]=[%s,%s]" %(bln1,bln2))
+    vimLet(bln1=bln1, bln2=bln2)
 
 
+@countVimCalls
 def voom_GetBufRange(): #{{{2
-    body = int(vim.eval('l:body'))
-    ln1, ln2 = int(vim.eval('a:ln1')), int(vim.eval('a:ln2'))
+    body, ln1, ln2 = [int(i) for i in vimGet('l:body', 'a:ln1', 'a:ln2')]
     VO = VOOMS[body]
     bln1, bln2 = nodesBodyRange(VO, ln1, ln2)
-    vim.command("let [l:bln1,l:bln2]=[%s,%s]" %(bln1,bln2))
+    vimLet(bln1=bln1, bln2=bln2)
 
 
+@countVimCalls
 def voom_Exec(): #{{{2
-    if vim.eval('l:bufType')=='Tree':
-        Buf = VOOMS[int(vim.eval('l:body'))].Body
+    bufType, body, bln1, bln2 = vimGet('l:bufType', 'l:body', 'l:bln1', 'l:bln2')
+    if bufType=='Tree':
+        Buf = VOOMS[int(body)].Body
     else:
         Buf = vim.current.buffer
-    bln1, bln2 = int(vim.eval('l:bln1')), int(vim.eval('l:bln2'))
+    bln1, bln2 = int(bln1), int(bln2)
     blines = Buf[bln1-1:bln2]
-    # specifiy script encoding (Vim internal encoding) on the first line
-    enc = '# -*- coding: %s -*-' %get_vim_encoding()
-    # prepend extra \n's to make traceback lnums match buffer lnums
-    # TODO: find less silly way to adjust traceback lnums
-    _code_ = '%s\n%s%s\n' %(enc, '\n'*(bln1-2), '\n'.join(blines))
     _globs_ = {'vim': vim, '_VOoM2657': sys.modules['voom_vimplugin2657.voom_vim']}
     try:
+        # script encoding is Vim internal encoding
+        # traceback lnums are buffer lnums
+        _code_ = voom_core.compileScript(blines, bln1, bln2, Buf.number, get_vim_encoding())
         exec(_code_, _globs_)
     #except Exception: # does not catch vim.error
     except:
@@ -2046,23 +2024,88 @@ def voom_Exec(): #{{{2
 
 def printTraceback(bln1,bln2): #{{{2
     """Print traceback from exception caught during Voomexec."""
-    out = None
-    # like traceback.format_exc(), traceback.print_exc()
-    try:
-        etype, value, tb = sys.exc_info()
-        out = traceback.format_exception(etype, value, tb)
-        #out = traceback.format_exception(etype, value, tb.tb_next)
-    finally:
-        etype = value = tb = None
+    out = voom_core.scriptTraceback(bln1,bln2)
     if not out:
         sys.stderr.write('ERROR: Voomexec failed to format Python traceback')
         return
-    info = '  ...exception executing script (%s-%s)...\n' %(bln1,bln2)
-    if bln1==1:
-        info += '  ...subtract 1 from traceback lnums to get buffer lnums...\n'
-    out[1:2] = [info]
-    #out[1:1] = [info]
-    sys.stderr.write(''.join(out))
+    sys.stderr.write(out)
+
+
+# :Voomexecbg -- execute script in a worker thread, see voom_core.ScriptJob.
+# Output of the script is queued by LogBufferClass.write() and is written to
+# PyLog by timer callback voom#ExecBgPoll().
+
+# the current ScriptJob, None if there is none
+EXEC_JOB = None
+
+
+@countVimCalls
+def voom_ExecBg(): #{{{2
+    global EXEC_JOB
+    bufType, body, bln1, bln2 = vimGet('l:bufType', 'l:body', 'l:bln1', 'l:bln2')
+    if not isinstance(sys.stdout, LogBufferClass):
+        vimCommand("call voom#ErrorMsg('VOoM: Voomexecbg requires PyLog (:Voomlog)')")
+        return
+    if bufType=='Tree':
+        Buf = VOOMS[int(body)].Body
+    else:
+        Buf = vim.current.buffer
+    bln1, bln2 = int(bln1), int(bln2)
+    # the script gets a snapshot of the buffer, not the vim module
+    blines = tuple(Buf[:])
+    _globs_ = {'blines': blines, 'bln1': bln1, 'bln2': bln2}
+    try:
+        _code_ = voom_core.compileScript(blines[bln1-1:bln2], bln1, bln2, Buf.number, get_vim_encoding())
+    except:
+        printTraceback(bln1,bln2)
+        print('---end of Python script (%s-%s)---' %(bln1,bln2))
+        return
+    job = EXEC_JOB = voom_core.ScriptJob(_code_, _globs_, bln1, bln2)
+    job.log = sys.stdout
+    job.start()
+    vimLet(ok=1)
+
+
+@countVimCalls
+def voom_ExecBgPoll(): #{{{2
+    """Timer callback voom#ExecBgPoll(): write output of the background script
+    to PyLog. Set l:status:
+        'running' -- the script is running;
+        'done' -- the script has finished, output has been written;
+        'none' -- there is nothing to do.
+    Output is discarded if PyLog has been unloaded.
+    """
+    global EXEC_JOB
+    job = EXEC_JOB
+    if job is None:
+        vimLet(status='none')
+        return
+    # check before writing: all output of a finished job is in the queue
+    alive = job.is_alive()
+    log = job.log
+    if vimEval('bufloaded(%s)' %log.logbnr)=='0':
+        log.pending.clear()
+        log = None
+    else:
+        log.writePending()
+    if alive:
+        vimLet(status='running')
+        return
+    EXEC_JOB = None
+    if log:
+        if job.error:
+            log.write(job.error)
+        log.write('---end of Python script (%s-%s)---\n' %(job.bln1,job.bln2))
+    vimLet(status='done')
+
+
+@countVimCalls
+def voom_ExecBgStop(): #{{{2
+    job = EXEC_JOB
+    if job is None:
+        vimCommand("call voom#ErrorMsg('VOoM: no background Python script is running')")
+        return
+    job.cancel()
 
 
 #---LOG BUFFER--------------------------------{{{1
@@ -2072,9 +2115,12 @@ class LogBufferClass: #{{{2
 
     def __init__(self): #{{{3
         self.buffer = vim.current.buffer
-        self.logbnr = vim.eval('bufnr("")')
+        self.logbnr = vimEval('bufnr("")')
         self.buffer[0] = 'Python %s Log buffer ...' % PY_VERSION
         self.join = False
+        # strings written by other threads, see writePending()
+        self.thread = threading.current_thread()
+        self.pending = collections.deque()
         if IS_PY2:
             self.encoding = get_vim_encoding()
             self.type_u = type(u" ")
@@ -2099,13 +2145,17 @@ class LogBufferClass: #{{{2
         #print(self.buffer.name)
 
         if not s: return
+        # Not in Vim's thread (:Voomexecbg script): can't touch Vim, queue it.
+        if threading.current_thread() is not self.thread:
+            self.pending.append(s)
+            return
         # Nasty things happen when printing to unloaded PyLog buffer.
         # This also catches printing to noexisting buffer, as in pydoc help() glitch.
-        if vim.eval("bufloaded(%s)" %(self.logbnr))=='0':
-            vim.command("call voom#ErrorMsg('VOoM (PyLog): PyLog buffer %s is unloaded or doesn''t exist')" %self.logbnr)
-            vim.command("call voom#ErrorMsg('VOoM (PyLog): unable to write string:')")
-            vim.command("echom '%s'" %(repr(s).replace("'", "''")) )
-            vim.command("call voom#ErrorMsg('VOoM (PyLog): please try executing command :Voomlog to fix')")
+        if vimEval("bufloaded(%s)" %(self.logbnr))=='0':
+            vimCommand("call voom#ErrorMsg('VOoM (PyLog): PyLog buffer %s is unloaded or doesn''t exist')" %self.logbnr,
+                    "call voom#ErrorMsg('VOoM (PyLog): unable to write string:')",
+                    "echom '%s'" %(repr(s).replace("'", "''")) ,
+                    "call voom#ErrorMsg('VOoM (PyLog): please try executing command :Voomlog to fix')")
             return
         try:
             if IS_PY2 and type(s) == self.type_u: # needed for Vim 7.2, 7.3
@@ -2125,16 +2175,27 @@ class LogBufferClass: #{{{2
             self.buffer.append(exc_lines)
             self.buffer.append('')
 
-        vim.command('call voom#LogScroll()')
+        vimCommand('call voom#LogScroll()')
+
+
+    def writePending(self): #{{{3
+        """Write strings queued by other threads. Call from Vim's thread."""
+        out = []
+        while self.pending:
+            out.append(self.pending.popleft())
+        if IS_PY2:
+            out = [s.encode(self.encoding) if type(s)==self.type_u else s for s in out]
+        self.write(''.join(out))
 
 
 #---misc--------------------------------------{{{1
 
-def get_vim_encoding(): #{{{2
-    """Return Vim internal encoding."""
+def get_vim_encoding(enc=None): #{{{2
+    """Return Vim internal encoding. enc is value of &enc if known."""
     # When &enc is any Unicode Vim allegedly uses utf-8 internally.
     # See |encoding|, mbyte.c, values are from |encoding-values|
-    enc = vim.eval('&enc')
+    if enc is None:
+        enc = vimEval('&enc')
     if enc in ('utf-8','ucs-2','ucs-2le','utf-16','utf-16le','ucs-4','ucs-4le'):
         return 'utf-8'
     return enc
@@ -16,6 +16,8 @@ com! -complete=custom,voom#Complete -nargs=? VoomToggle call voom#Init(<q-args>,
 com! Voomhelp call voom#Help()
 com! Voomlog  call voom#LogInit()
 com! -nargs=? Voomexec call voom#Exec(<q-args>)
+com! -nargs=? Voomexecbg call voom#ExecBg(<q-args>)
+com! -complete=custom,voom#ProfileComplete -nargs=+ Voomprofile call voom#Profile(<q-args>)
 " other commands are defined in ../autoload/voom.vim
 
 " support for Vim sessions (:mksession)